@@ -0,0 +1,270 @@
+"""
+Group-by style tallies over the resolved citation graph.
+
+Every function works on the integer paper ids of a lookup (PaperLookup or
+StoreLookup) and returns a tidy DataFrame with one row per group key, e.g.
+
+    groups = {'ASSETS': core['a11y_assets'], 'CHI': core['a11y_chi']}
+    venues = neighbor_venue_counts(lookup, 'refs', groups)
+    top_k(venues, 'venue', 'count', k=30)
+"""
+
+import os, sys
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from biblio.papers import PaperLookup
+from biblio.load_fos import MagLookup
+
+
+# columns of the source paper that results can be grouped by
+SOURCE_KEYS = ['group', 'direction', 'source_venue', 'source_year']
+
+
+def paper_table(lookup: PaperLookup) -> pd.DataFrame:
+    """
+    Venue and year of every paper in the lookup, indexed by paper id
+    :param lookup:
+    :return: DataFrame with columns venue (categorical) and year (nullable int)
+    """
+    store = getattr(lookup, 'store', None)
+    if store is not None:
+        years = np.asarray(store.columns['year']).astype(np.int64)
+        venue = pd.Categorical.from_codes(np.asarray(store.columns['venue']), categories=list(store.tables['venues']))
+        year = pd.array(np.where(years > 0, years, 0), dtype='Int64')
+        year[years <= 0] = pd.NA
+    else:
+        venue = pd.Categorical([p.venue if p else None for p in lookup.papers])
+        year = pd.array([p.year if p and p.year else None for p in lookup.papers], dtype='Int64')
+    return pd.DataFrame({'venue': venue, 'year': year})
+
+
+def paper_fos_table(lookup: PaperLookup, level: int = 1) -> pd.DataFrame:
+    """
+    One row per FoS entry of the given level of every paper
+    :param lookup:
+    :param level:
+    :return: DataFrame with columns paper, fos_id, score and weight (1 / number of FoS of that level in the paper)
+    """
+    store = getattr(lookup, 'store', None)
+    if store is not None:
+        cols = store.columns
+        entry_papers = np.repeat(np.arange(len(store)), np.diff(cols['fos_ptr']))
+        at_level = np.asarray(cols['fos_level']) == level
+        papers = entry_papers[at_level]
+        fos_ids = np.asarray(cols['fos_id'])[at_level]
+        scores = np.asarray(cols['fos_score'])[at_level]
+    else:
+        entries = [
+            (i, entry[0], entry[1])
+            for i, p in enumerate(lookup.papers) if p and p.fos
+            for entry in p.fos if entry[-1] == level
+        ]
+        papers, fos_ids, scores = (np.array(values) for values in zip(*entries)) if entries else \
+            (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    counts = np.bincount(papers, minlength=len(lookup.papers))
+    return pd.DataFrame({
+        'paper': papers.astype(np.int64),
+        'fos_id': fos_ids.astype(np.int64),
+        'score': scores.astype(np.float64),
+        'weight': 1. / counts[papers]
+    })
+
+
+def group_table(lookup: PaperLookup, groups: Optional[Dict[str, Sequence]] = None) -> pd.DataFrame:
+    """
+    Paper ids of each group of papers, with the venue and year of each paper.
+    Papers that are not in the lookup are dropped.
+    :param lookup:
+    :param groups: group name -> papers; None for one group (named None) of all papers in the lookup
+    :return: DataFrame with columns group, paper, source_venue and source_year
+    """
+    if groups is None:
+        names = np.full(len(lookup.papers), None, dtype=object)
+        ids = np.arange(len(lookup.papers))
+    else:
+        names = []
+        ids = []
+        for name, papers in groups.items():
+            group_ids = [lookup.get_paper_id(p) for p in papers]
+            group_ids = [i for i in group_ids if i >= 0]
+            names += [name] * len(group_ids)
+            ids += group_ids
+        names = np.array(names, dtype=object)
+        ids = np.array(ids, dtype=np.int64)
+    papers = paper_table(lookup)
+    return pd.DataFrame({
+        'group': names,
+        'paper': ids,
+        'source_venue': papers['venue'].values[ids] if len(ids) else papers['venue'].values[:0],
+        'source_year': papers['year'].values[ids] if len(ids) else papers['year'].values[:0]
+    })
+
+
+def _gather_neighbors(ptr: np.ndarray, ind: np.ndarray, rows: np.ndarray):
+    """
+    Neighbors of many CSR rows at once
+    :return: (position in rows of each edge, neighbor of each edge)
+    """
+    starts = np.asarray(ptr)[rows]
+    degrees = np.asarray(ptr)[rows + 1] - starts
+    positions = np.repeat(np.arange(len(rows)), degrees)
+    # offset of each edge within its row
+    offsets = np.arange(degrees.sum()) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    return positions, np.asarray(ind)[np.repeat(starts, degrees) + offsets]
+
+
+def edge_table(
+        lookup: PaperLookup,
+        direction: Union[str, Iterable[str]] = 'refs',
+        groups: Optional[Dict[str, Sequence]] = None
+) -> pd.DataFrame:
+    """
+    Resolved references (direction='refs') and/or citations ('cits') of each
+    group of papers, one row per edge
+    :param lookup:
+    :param direction: 'refs', 'cits' or both, e.g. ('refs', 'cits')
+    :param groups: group name -> papers; None for all papers in the lookup
+    :return: DataFrame with columns group, paper, source_venue, source_year, direction and neighbor
+    """
+    directions = [direction] if isinstance(direction, str) else list(direction)
+    sources = group_table(lookup, groups)
+    graph = lookup.graph
+    frames = []
+    for d in directions:
+        ptr = graph.refs_ptr if d == 'refs' else graph.cits_ptr
+        ind = graph.refs_ind if d == 'refs' else graph.cits_ind
+        positions, neighbors = _gather_neighbors(ptr, ind, sources['paper'].values)
+        frame = sources.iloc[positions].reset_index(drop=True)
+        frame['direction'] = d
+        frame['neighbor'] = neighbors.astype(np.int64)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _group_sum(df: pd.DataFrame, by: List[str], value: str, name: str) -> pd.DataFrame:
+    return df.groupby(by, dropna=False, observed=True)[value].sum().rename(name).reset_index()
+
+
+def neighbor_venue_counts(
+        lookup: PaperLookup,
+        direction: Union[str, Iterable[str]] = 'refs',
+        groups: Optional[Dict[str, Sequence]] = None,
+        by: Sequence[str] = ('group', 'direction')
+) -> pd.DataFrame:
+    """
+    Number of references/citations to each venue
+    :param lookup:
+    :param direction: 'refs', 'cits' or both
+    :param groups: group name -> papers; None for all papers in the lookup
+    :param by: source keys to group by (any of SOURCE_KEYS)
+    :return: DataFrame with columns by..., venue, count
+    """
+    edges = edge_table(lookup, direction, groups)
+    edges['venue'] = paper_table(lookup)['venue'].values[edges['neighbor'].values]
+    edges['count'] = 1
+    return _group_sum(edges, list(by) + ['venue'], 'count', 'count')
+
+
+def _add_fos_names(df: pd.DataFrame, mag_lookup: Optional[MagLookup]) -> pd.DataFrame:
+    if mag_lookup is None or df.empty:
+        return df
+    fos_ids = df['fos_id'].unique()
+    l0_ids = mag_lookup.get_l0_many(fos_ids, first=True)
+    names = pd.DataFrame({
+        'fos_id': fos_ids,
+        'name': [mag_lookup.get_name(int(m)) for m in fos_ids],
+        'l0_id': l0_ids,
+        'l0_name': [mag_lookup.get_name(int(m)) if m >= 0 else None for m in l0_ids]
+    })
+    return df.merge(names, on='fos_id', how='left')
+
+
+def neighbor_fos_weights(
+        lookup: PaperLookup,
+        direction: Union[str, Iterable[str]] = 'refs',
+        groups: Optional[Dict[str, Sequence]] = None,
+        by: Sequence[str] = ('group', 'direction'),
+        level: int = 1,
+        mag_lookup: Optional[MagLookup] = None
+) -> pd.DataFrame:
+    """
+    FoS of references/citations, each neighbor spreading a weight of 1 evenly
+    over its FoS of the given level
+    :param lookup:
+    :param direction: 'refs', 'cits' or both
+    :param groups: group name -> papers; None for all papers in the lookup
+    :param by: source keys to group by (any of SOURCE_KEYS)
+    :param level: FoS level
+    :param mag_lookup: if given, adds FoS name and first L0 parent (id and name)
+    :return: DataFrame with columns by..., fos_id, weight (and name, l0_id, l0_name)
+    """
+    edges = edge_table(lookup, direction, groups)
+    fos = paper_fos_table(lookup, level)
+    edges = edges.merge(fos[['paper', 'fos_id', 'weight']], left_on='neighbor', right_on='paper', suffixes=('', '_fos'))
+    result = _group_sum(edges, list(by) + ['fos_id'], 'weight', 'weight')
+    return _add_fos_names(result, mag_lookup)
+
+
+def paper_fos_weights(
+        lookup: PaperLookup,
+        groups: Optional[Dict[str, Sequence]] = None,
+        by: Sequence[str] = ('group', 'source_year'),
+        level: int = 1,
+        weight: str = 'score',
+        mag_lookup: Optional[MagLookup] = None
+) -> pd.DataFrame:
+    """
+    FoS of the papers themselves
+    :param lookup:
+    :param groups: group name -> papers; None for all papers in the lookup
+    :param by: keys to group by (any of SOURCE_KEYS except direction)
+    :param level: FoS level
+    :param weight: 'score' (MAG FoS score) or 'fraction' (1 / number of FoS of that level)
+    :param mag_lookup: if given, adds FoS name and first L0 parent (id and name)
+    :return: DataFrame with columns by..., fos_id, weight (and name, l0_id, l0_name)
+    """
+    sources = group_table(lookup, groups)
+    fos = paper_fos_table(lookup, level)
+    rows = sources.merge(fos, on='paper')
+    rows['weight'] = rows['score'] if weight == 'score' else rows['weight']
+    result = _group_sum(rows, list(by) + ['fos_id'], 'weight', 'weight')
+    return _add_fos_names(result, mag_lookup)
+
+
+def paper_counts(
+        lookup: PaperLookup,
+        groups: Optional[Dict[str, Sequence]] = None,
+        by: Sequence[str] = ('group', 'source_year')
+) -> pd.DataFrame:
+    """
+    Number of papers per group key
+    :param lookup:
+    :param groups: group name -> papers; None for all papers in the lookup
+    :param by: keys to group by (any of SOURCE_KEYS except direction)
+    :return: DataFrame with columns by..., count
+    """
+    sources = group_table(lookup, groups)
+    sources['count'] = 1
+    return _group_sum(sources, list(by), 'count', 'count')
+
+
+def top_k(df: pd.DataFrame, key: str, value: str, k: Optional[int] = None, columns: str = 'group') -> pd.DataFrame:
+    """
+    Wide table of a tally: one row per key, one column per value of `columns`
+    plus a Total column, sorted by Total (e.g. the notebook's top venues table)
+    :param df: tidy result of one of the functions above
+    :param key: e.g. 'venue' or 'fos_id'
+    :param value: e.g. 'count' or 'weight'
+    :param k: number of rows to keep (all if None)
+    :param columns:
+    :return:
+    """
+    wide = df.pivot_table(index=key, columns=columns, values=value, aggfunc='sum', fill_value=0, observed=True)
+    wide.columns.name = None
+    wide['Total'] = wide.sum(axis=1)
+    # ties keep key order
+    wide = wide.sort_index().sort_values('Total', ascending=False, kind='stable')
+    return wide.head(k) if k is not None else wide
@@ -0,0 +1,137 @@
+import os, sys
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+
+class CitationGraph:
+    """
+    Citation graph over the papers of a lookup, with every paper identified by
+    a dense integer id (its position in lookup.papers). Outbound references and
+    inbound citations are stored as compressed sparse rows: the neighbors of
+    paper i are ind[ptr[i]:ptr[i + 1]]. Edges whose [pid, doi, sha] triple does
+    not resolve to a paper in the lookup are dropped and counted per paper.
+    """
+    def __init__(
+            self,
+            refs_ptr: np.ndarray,
+            refs_ind: np.ndarray,
+            cits_ptr: np.ndarray,
+            cits_ind: np.ndarray,
+            refs_unresolved: np.ndarray,
+            cits_unresolved: np.ndarray
+    ):
+        self.refs_ptr = refs_ptr
+        self.refs_ind = refs_ind
+        self.cits_ptr = cits_ptr
+        self.cits_ind = cits_ind
+        self.refs_unresolved = refs_unresolved
+        self.cits_unresolved = cits_unresolved
+        self.num_papers = len(refs_ptr) - 1
+
+    @classmethod
+    def from_resolved(
+            cls,
+            refs_ptr: np.ndarray,
+            refs_row: np.ndarray,
+            cits_ptr: np.ndarray,
+            cits_row: np.ndarray
+    ) -> 'CitationGraph':
+        """
+        Build from per-edge resolved ids in CSR layout, where -1 marks an unresolved edge
+        :param refs_ptr:
+        :param refs_row:
+        :param cits_ptr:
+        :param cits_row:
+        :return:
+        """
+        arrays = []
+        for ptr, rows in ((refs_ptr, refs_row), (cits_ptr, cits_row)):
+            rows = np.asarray(rows)
+            resolved = rows >= 0
+            # number of resolved edges before each row boundary
+            resolved_before = np.concatenate([[0], np.cumsum(resolved, dtype=np.int64)])
+            new_ptr = resolved_before[np.asarray(ptr)]
+            unresolved = (np.diff(ptr) - np.diff(new_ptr)).astype(np.int32)
+            arrays.append((new_ptr, rows[resolved].astype(np.int32), unresolved))
+        (refs_ptr, refs_ind, refs_unresolved), (cits_ptr, cits_ind, cits_unresolved) = arrays
+        return cls(refs_ptr, refs_ind, cits_ptr, cits_ind, refs_unresolved, cits_unresolved)
+
+    @classmethod
+    def from_papers(cls, papers: List, resolve: Callable) -> 'CitationGraph':
+        """
+        Resolve every ref/cit triple of papers once
+        :param papers: papers in id order
+        :param resolve: maps a [pid, doi, sha] triple to a paper id, or -1
+        :return:
+        """
+        arrays = []
+        for direction in ('refs', 'cits'):
+            ptr = np.zeros(len(papers) + 1, dtype=np.int64)
+            rows = []
+            for i, paper in enumerate(papers):
+                edges = getattr(paper, direction)
+                rows += [resolve(triple) for triple in edges]
+                ptr[i + 1] = len(rows)
+            arrays += [ptr, np.array(rows, dtype=np.int32)]
+        return cls.from_resolved(*arrays)
+
+    def refs(self, i: int) -> np.ndarray:
+        """
+        Ids of papers referenced by paper i
+        :param i:
+        :return:
+        """
+        return self.refs_ind[self.refs_ptr[i]:self.refs_ptr[i + 1]]
+
+    def cits(self, i: int) -> np.ndarray:
+        """
+        Ids of papers citing paper i
+        :param i:
+        :return:
+        """
+        return self.cits_ind[self.cits_ptr[i]:self.cits_ptr[i + 1]]
+
+    def neighbors(self, i: int, direction: str) -> np.ndarray:
+        if direction == 'refs':
+            return self.refs(i)
+        elif direction == 'cits':
+            return self.cits(i)
+        raise ValueError(f'Unknown direction: {direction}')
+
+    def _matrix(self, ptr: np.ndarray, ind: np.ndarray) -> 'scipy.sparse.csr_matrix':
+        # imported here so that importing biblio.papers stays fast
+        import scipy.sparse
+        return scipy.sparse.csr_matrix(
+            (np.ones(len(ind), dtype=np.float64), ind, ptr),
+            shape=(self.num_papers, self.num_papers)
+        )
+
+    def refs_matrix(self) -> 'scipy.sparse.csr_matrix':
+        """
+        Sparse adjacency matrix A with A[i, j] = number of times paper i references paper j
+        :return:
+        """
+        return self._matrix(self.refs_ptr, self.refs_ind)
+
+    def cits_matrix(self) -> 'scipy.sparse.csr_matrix':
+        """
+        Sparse adjacency matrix C with C[i, j] = number of times paper j is listed as citing paper i
+        :return:
+        """
+        return self._matrix(self.cits_ptr, self.cits_ind)
+
+    def edge_list(self, direction: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        All resolved edges as (source ids, neighbor ids) arrays
+        :param direction: 'refs' or 'cits'
+        :return:
+        """
+        ptr = self.refs_ptr if direction == 'refs' else self.cits_ptr
+        ind = self.refs_ind if direction == 'refs' else self.cits_ind
+        sources = np.repeat(np.arange(self.num_papers, dtype=np.int32), np.diff(ptr))
+        return sources, ind
+
+    def num_unresolved(self, direction: str) -> int:
+        unresolved = self.refs_unresolved if direction == 'refs' else self.cits_unresolved
+        return int(unresolved.sum())
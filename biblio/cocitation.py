@@ -0,0 +1,317 @@
+"""
+Co-citation and bibliographic coupling over the resolved citation graph.
+
+With A the (papers x papers) citation matrix (A[i, j] = 1 if i cites j),
+co-citation is A^T A (number of papers citing both i and j) and bibliographic
+coupling is A A^T (number of references i and j share). Neither is formed
+at the paper level; venue and FoS tallies are computed as (A M)^T (A M) and
+(A^T M)^T (A^T M) for a sparse (papers x labels) membership matrix M, and
+paper-level neighbors are computed in chunks of query papers, e.g.
+
+    pairs = venue_cocitation(lookup, groups={'a11y': core['a11y']})
+    top_k_neighbors(pairs, 'venue', 'count', k=5)
+"""
+
+import os, sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from biblio.papers import PaperLookup
+from biblio.load_fos import MagLookup
+from biblio.constants import VENUES_TO_PLOT
+from biblio.aggregate import paper_table
+from biblio.utils.lcdi_utils import fos_weight_matrix
+from biblio.utils.profile_utils import phase
+
+
+def citation_matrix(lookup: PaperLookup) -> scipy.sparse.csr_matrix:
+    """
+    Binary (papers x papers) matrix with A[i, j] = 1 if paper i cites paper j,
+    from the references of i and the citations of j (an edge listed on either
+    side counts once); self-citations are dropped
+    :param lookup:
+    :return:
+    """
+    graph = lookup.graph
+    num_papers = graph.num_papers
+    papers = np.arange(num_papers)
+    citing = np.concatenate([np.repeat(papers, np.diff(graph.refs_ptr)), np.asarray(graph.cits_ind)])
+    cited = np.concatenate([np.asarray(graph.refs_ind), np.repeat(papers, np.diff(graph.cits_ptr))])
+    keep = citing != cited
+    matrix = scipy.sparse.csr_matrix(
+        (np.ones(keep.sum()), (citing[keep], cited[keep])),
+        shape=(num_papers, num_papers)
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.
+    return matrix
+
+
+def membership_matrix(
+        lookup: PaperLookup,
+        venues: Optional[Sequence[str]] = VENUES_TO_PLOT,
+        groups: Optional[Dict[str, Sequence]] = None
+) -> Tuple[scipy.sparse.csr_matrix, List[str]]:
+    """
+    Sparse (papers x labels) indicator of the venue of each paper (for the
+    given venues) and of membership in each group
+    :param lookup:
+    :param venues: venue keys, or None for every venue in the lookup
+    :param groups: group name -> papers, added as extra labels
+    :return: matrix and the label of each column
+    """
+    venue = paper_table(lookup)['venue']
+    codes = np.asarray(venue.cat.codes)
+    categories = list(venue.cat.categories)
+    labels = list(categories) if venues is None else list(venues)
+    # map category codes onto label columns (-1 for venues not kept, and for code -1, no venue)
+    code_of = {category: code for code, category in enumerate(categories)}
+    code_to_col = np.full(len(categories) + 1, -1, dtype=np.int64)
+    for col, label in enumerate(labels):
+        if label in code_of:
+            code_to_col[code_of[label]] = col
+    cols = code_to_col[codes]
+    rows = np.flatnonzero(cols >= 0)
+    cols = cols[rows]
+    for name, papers in (groups or dict()).items():
+        group_rows = np.unique([i for i in (lookup.get_paper_id(p) for p in papers) if i >= 0]).astype(np.int64)
+        rows = np.concatenate([rows, group_rows])
+        cols = np.concatenate([cols, np.full(len(group_rows), len(labels), dtype=np.int64)])
+        labels.append(name)
+    matrix = scipy.sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)),
+        shape=(len(lookup.papers), len(labels))
+    )
+    return matrix, labels
+
+
+def _pair_counts(adjacency: scipy.sparse.csr_matrix, membership: scipy.sparse.csr_matrix) -> scipy.sparse.csr_matrix:
+    """
+    (labels x labels) sum over rows r of adjacency of the pairs (i, j), i != j,
+    of nonzero columns of r, weighted by membership[i, a] * membership[j, b]
+    """
+    spread = adjacency @ membership
+    pairs = (spread.T @ spread).tocsr()
+    # pairs with i == j, once per row of adjacency containing i
+    degrees = np.asarray(adjacency.sum(axis=0)).ravel()
+    self_pairs = (membership.T @ scipy.sparse.diags(degrees) @ membership).tocsr()
+    pairs = (pairs - self_pairs).tocsr()
+    # rounding residue of the subtraction with fractional FoS weights
+    pairs.data[np.abs(pairs.data) < 1e-9] = 0.
+    pairs.eliminate_zeros()
+    return pairs
+
+
+def _pairs_frame(pairs: scipy.sparse.csr_matrix, labels: List, key: str, value: str) -> pd.DataFrame:
+    coo = pairs.tocoo()
+    order = np.lexsort((coo.col, coo.row))
+    labels = np.asarray(labels, dtype=object)
+    return pd.DataFrame({
+        key: labels[coo.row[order]],
+        f'other_{key}': labels[coo.col[order]],
+        value: coo.data[order]
+    })
+
+
+def venue_cocitation(
+        lookup: PaperLookup,
+        venues: Optional[Sequence[str]] = VENUES_TO_PLOT,
+        groups: Optional[Dict[str, Sequence]] = None,
+        adjacency: Optional[scipy.sparse.csr_matrix] = None
+) -> pd.DataFrame:
+    """
+    Number of times a paper from one venue/group and a different paper from
+    another (or the same) venue/group are cited together by the same paper
+    :param lookup:
+    :param venues: venue keys, or None for every venue in the lookup
+    :param groups: group name -> papers, e.g. {'a11y': core['a11y']}
+    :param adjacency: citation_matrix(lookup), if already computed
+    :return: DataFrame with columns venue, other_venue, count (both orders of each pair)
+    """
+    with phase('cocitation.venue_cocitation'):
+        adjacency = citation_matrix(lookup) if adjacency is None else adjacency
+        membership, labels = membership_matrix(lookup, venues, groups)
+        pairs = _pair_counts(adjacency, membership)
+        result = _pairs_frame(pairs, labels, 'venue', 'count')
+    result['count'] = result['count'].round().astype(np.int64)
+    return result
+
+
+def venue_coupling(
+        lookup: PaperLookup,
+        venues: Optional[Sequence[str]] = VENUES_TO_PLOT,
+        groups: Optional[Dict[str, Sequence]] = None,
+        adjacency: Optional[scipy.sparse.csr_matrix] = None
+) -> pd.DataFrame:
+    """
+    Number of references shared by a paper from one venue/group and a
+    different paper from another (or the same) venue/group
+    :param lookup:
+    :param venues: venue keys, or None for every venue in the lookup
+    :param groups: group name -> papers
+    :param adjacency: citation_matrix(lookup), if already computed
+    :return: DataFrame with columns venue, other_venue, count (both orders of each pair)
+    """
+    with phase('cocitation.venue_coupling'):
+        adjacency = citation_matrix(lookup) if adjacency is None else adjacency
+        membership, labels = membership_matrix(lookup, venues, groups)
+        pairs = _pair_counts(adjacency.T.tocsr(), membership)
+        result = _pairs_frame(pairs, labels, 'venue', 'count')
+    result['count'] = result['count'].round().astype(np.int64)
+    return result
+
+
+def _add_pair_names(df: pd.DataFrame, mag_lookup: Optional[MagLookup]) -> pd.DataFrame:
+    if mag_lookup is None:
+        return df
+    names = {m: mag_lookup.get_name(int(m)) for m in pd.unique(df[['fos_id', 'other_fos_id']].values.ravel())}
+    df['name'] = df['fos_id'].map(names)
+    df['other_name'] = df['other_fos_id'].map(names)
+    return df
+
+
+def fos_cocitation(
+        lookup: PaperLookup,
+        level: int = 1,
+        mag_lookup: Optional[MagLookup] = None,
+        adjacency: Optional[scipy.sparse.csr_matrix] = None
+) -> pd.DataFrame:
+    """
+    FoS co-citation: each pair of distinct papers cited together adds the
+    product of their FoS weights (each paper spreads 1 over its FoS of the level)
+    :param lookup:
+    :param level: FoS level
+    :param mag_lookup: if given, adds name and other_name
+    :param adjacency: citation_matrix(lookup), if already computed
+    :return: DataFrame with columns fos_id, other_fos_id, weight (and name, other_name)
+    """
+    with phase('cocitation.fos_cocitation'):
+        adjacency = citation_matrix(lookup) if adjacency is None else adjacency
+        membership, fos_ids = fos_weight_matrix(lookup, level)
+        pairs = _pair_counts(adjacency, membership)
+    return _add_pair_names(_pairs_frame(pairs, fos_ids, 'fos_id', 'weight'), mag_lookup)
+
+
+def fos_coupling(
+        lookup: PaperLookup,
+        level: int = 1,
+        mag_lookup: Optional[MagLookup] = None,
+        adjacency: Optional[scipy.sparse.csr_matrix] = None
+) -> pd.DataFrame:
+    """
+    FoS bibliographic coupling: each reference shared by two distinct papers
+    adds the product of their FoS weights
+    :param lookup:
+    :param level: FoS level
+    :param mag_lookup: if given, adds name and other_name
+    :param adjacency: citation_matrix(lookup), if already computed
+    :return: DataFrame with columns fos_id, other_fos_id, weight (and name, other_name)
+    """
+    with phase('cocitation.fos_coupling'):
+        adjacency = citation_matrix(lookup) if adjacency is None else adjacency
+        membership, fos_ids = fos_weight_matrix(lookup, level)
+        pairs = _pair_counts(adjacency.T.tocsr(), membership)
+    return _add_pair_names(_pairs_frame(pairs, fos_ids, 'fos_id', 'weight'), mag_lookup)
+
+
+def _top_k_per_row(matrix: scipy.sparse.spmatrix, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    k largest entries of each row of a sparse matrix (ties by column), without densifying
+    :return: (rows, cols, values)
+    """
+    coo = matrix.tocoo()
+    order = np.lexsort((coo.col, -coo.data, coo.row))
+    rows = coo.row[order]
+    # rank of each entry within its row
+    starts = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - starts < k
+    return rows[keep], coo.col[order][keep], coo.data[order][keep]
+
+
+def _paper_top_k(
+        lookup: PaperLookup,
+        papers: Sequence,
+        k: int,
+        left: scipy.sparse.csr_matrix,
+        right: scipy.sparse.csr_matrix,
+        chunk_size: int
+) -> pd.DataFrame:
+    ids = np.array([lookup.get_paper_id(p) for p in papers], dtype=np.int64)
+    ids = ids[ids >= 0]
+    frames = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        scores = (left[chunk] @ right).tocoo()
+        # drop each query paper's pairing with itself
+        keep = scores.col != chunk[scores.row]
+        scores = scipy.sparse.coo_matrix(
+            (scores.data[keep], (scores.row[keep], scores.col[keep])),
+            shape=scores.shape
+        )
+        rows, cols, values = _top_k_per_row(scores, k)
+        frames.append(pd.DataFrame({
+            'paper': chunk[rows],
+            'other_paper': cols.astype(np.int64),
+            'count': values.round().astype(np.int64)
+        }))
+    if not frames:
+        return pd.DataFrame({'paper': [], 'other_paper': [], 'count': []}, dtype=np.int64)
+    return pd.concat(frames, ignore_index=True)
+
+
+def paper_cocitation_top_k(
+        lookup: PaperLookup,
+        papers: Sequence,
+        k: int = 10,
+        adjacency: Optional[scipy.sparse.csr_matrix] = None,
+        chunk_size: int = 1024
+) -> pd.DataFrame:
+    """
+    For each of papers, the k papers most often cited together with it
+    :param lookup:
+    :param papers:
+    :param k:
+    :param adjacency: citation_matrix(lookup), if already computed
+    :param chunk_size: query papers per sparse product
+    :return: DataFrame with columns paper, other_paper (paper ids of the lookup), count
+    """
+    with phase('cocitation.paper_cocitation_top_k'):
+        adjacency = citation_matrix(lookup) if adjacency is None else adjacency
+        return _paper_top_k(lookup, papers, k, adjacency.T.tocsr(), adjacency, chunk_size)
+
+
+def paper_coupling_top_k(
+        lookup: PaperLookup,
+        papers: Sequence,
+        k: int = 10,
+        adjacency: Optional[scipy.sparse.csr_matrix] = None,
+        chunk_size: int = 1024
+) -> pd.DataFrame:
+    """
+    For each of papers, the k papers sharing the most references with it
+    :param lookup:
+    :param papers:
+    :param k:
+    :param adjacency: citation_matrix(lookup), if already computed
+    :param chunk_size: query papers per sparse product
+    :return: DataFrame with columns paper, other_paper (paper ids of the lookup), count
+    """
+    with phase('cocitation.paper_coupling_top_k'):
+        adjacency = citation_matrix(lookup) if adjacency is None else adjacency
+        return _paper_top_k(lookup, papers, k, adjacency, adjacency.T.tocsr(), chunk_size)
+
+
+def top_k_neighbors(df: pd.DataFrame, key: str, value: str, k: int = 10) -> pd.DataFrame:
+    """
+    k strongest pairs of each key in a result of the functions above (ties by other key)
+    :param df:
+    :param key: e.g. 'venue' or 'fos_id'
+    :param value: e.g. 'count' or 'weight'
+    :param k:
+    :return:
+    """
+    df = df.sort_values(f'other_{key}', kind='stable').sort_values(value, ascending=False, kind='stable')
+    return df.sort_values(key, kind='stable').groupby(key, sort=False).head(k).reset_index(drop=True)
@@ -0,0 +1,214 @@
+import os, sys
+import json
+import gzip
+import shutil
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from biblio.utils.hash_utils import hash_strs, find_sorted
+from biblio.utils.cache_utils import file_stamp, make_tmp_dir, publish_dir
+
+
+DBLP_ALL_FILE = 'data/dblp_papers_by_conference.json.gz'
+DBLP_INDEX_DIR = 'data/cache/dblp_index'
+
+# bump when the on-disk layout changes so stale indexes get rebuilt
+DBLP_INDEX_VERSION = 1
+
+# year value stored for DBLP entries without a year
+NO_YEAR = -1
+
+
+def write_dblp_index(doi_to_conf_year: Dict[str, Tuple[str, Optional[int]]], out_dir: str, meta: Dict):
+    """
+    Write a DOI -> (conf, year) mapping as a compact index of sorted DOI hashes
+    with parallel conf/year arrays
+    :param doi_to_conf_year: lowercased DOI -> (DBLP conf key, year)
+    :param out_dir:
+    :param meta: source stamp stored alongside the arrays
+    :return:
+    """
+    dois = list(doi_to_conf_year.keys())
+    hashes = hash_strs(dois)
+    order = np.argsort(hashes, kind='stable')
+
+    confs = sorted(set(conf for conf, _ in doi_to_conf_year.values()))
+    conf_to_ind = {conf: i for i, conf in enumerate(confs)}
+    conf_inds = np.fromiter(
+        (conf_to_ind[doi_to_conf_year[doi][0]] for doi in dois), dtype=np.int32, count=len(dois)
+    )
+    years = np.fromiter(
+        (int(doi_to_conf_year[doi][1]) if doi_to_conf_year[doi][1] else NO_YEAR for doi in dois),
+        dtype=np.int16, count=len(dois)
+    )
+    write_dblp_index_arrays(hashes[order], conf_inds[order], years[order], confs, out_dir, meta)
+
+
+def write_dblp_index_arrays(
+        doi_hashes: np.ndarray,
+        conf_inds: np.ndarray,
+        years: np.ndarray,
+        confs: List[str],
+        out_dir: str,
+        meta: Dict
+):
+    """
+    Write an index from parallel arrays sorted by DOI hash (unique hashes)
+    :param doi_hashes: hash_strs of the lowercased DOIs
+    :param conf_inds: position of each DOI's conf key in confs
+    :param years: year of each DOI (NO_YEAR if unknown)
+    :param confs: DBLP conf keys
+    :param out_dir:
+    :param meta: source stamp stored alongside the arrays
+    :return:
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    np.save(os.path.join(out_dir, 'doi_hashes.npy'), np.asarray(doi_hashes, dtype=np.uint64))
+    np.save(os.path.join(out_dir, 'conf_inds.npy'), np.asarray(conf_inds, dtype=np.int32))
+    np.save(os.path.join(out_dir, 'years.npy'), np.asarray(years, dtype=np.int16))
+    with open(os.path.join(out_dir, 'confs.json'), 'w') as outf:
+        json.dump(list(confs), outf)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as outf:
+        json.dump(dict(meta, num_dois=len(doi_hashes)), outf)
+
+
+class DblpIndex:
+    """
+    DOI -> (DBLP conf key, year) index over the DBLP dump.
+
+    The index is built from the DBLP file on first use and persisted under
+    index_dir in a subdirectory keyed by the source file's size and mtime, so
+    it is only rebuilt when the source changes. Arrays are memory-mapped
+    read-only, so processes on the same machine share one copy via the page cache.
+    """
+    def __init__(self, dblp_file: str = DBLP_ALL_FILE, index_dir: str = DBLP_INDEX_DIR):
+        self.dblp_file = dblp_file
+        self.index_dir = index_dir
+        self._doi_hashes = None
+        self._conf_inds = None
+        self._years = None
+        self._confs = None
+
+    def _source_stamp(self) -> Dict:
+        return dict(file_stamp(self.dblp_file), version=DBLP_INDEX_VERSION)
+
+    def _stamp_dir(self, stamp: Dict) -> str:
+        return os.path.join(
+            self.index_dir,
+            f"v{stamp['version']}-{stamp['size']}-{stamp['mtime_ns']}"
+        )
+
+    def build(self) -> str:
+        """
+        Build the index from the DBLP file (if not already up to date)
+        :return: directory holding the index
+        """
+        stamp = self._source_stamp()
+        stamp_dir = self._stamp_dir(stamp)
+        if os.path.exists(os.path.join(stamp_dir, 'meta.json')):
+            return stamp_dir
+
+        print('building dblp doi index; this will take a moment...')
+        with gzip.open(self.dblp_file, 'r') as f:
+            data = json.load(f)
+
+        doi_to_conf_year = dict()
+        for conf_key, papers in data.items():
+            for paper in papers:
+                if paper['doi']:
+                    doi_to_conf_year[paper['doi'].lower()] = (conf_key, paper['year'])
+        del data
+        return self._publish(lambda out_dir: write_dblp_index(doi_to_conf_year, out_dir, stamp))
+
+    def publish_arrays(self, doi_hashes: np.ndarray, conf_inds: np.ndarray, years: np.ndarray, confs: List[str]) -> str:
+        """
+        Install an index built elsewhere (e.g. while writing the DBLP file) for
+        the current version of the DBLP file; see write_dblp_index_arrays
+        :return: directory holding the index
+        """
+        stamp = self._source_stamp()
+        return self._publish(
+            lambda out_dir: write_dblp_index_arrays(doi_hashes, conf_inds, years, confs, out_dir, stamp)
+        )
+
+    def _publish(self, write: Callable[[str], None]) -> str:
+        stamp_dir = self._stamp_dir(self._source_stamp())
+        # write to a private directory and rename into place, so concurrent
+        # builders never expose a partial index
+        tmp_dir = make_tmp_dir(stamp_dir)
+        write(tmp_dir)
+        publish_dir(tmp_dir, stamp_dir)
+
+        # drop indexes built from older versions of the source file
+        for entry in os.listdir(self.index_dir):
+            entry_path = os.path.join(self.index_dir, entry)
+            if entry_path != stamp_dir and not entry.startswith('.'):
+                shutil.rmtree(entry_path, ignore_errors=True)
+        return stamp_dir
+
+    def load(self):
+        """
+        Memory-map the index, building it first if needed
+        :return:
+        """
+        stamp_dir = self.build()
+        self._doi_hashes = np.load(os.path.join(stamp_dir, 'doi_hashes.npy'), mmap_mode='r')
+        self._conf_inds = np.load(os.path.join(stamp_dir, 'conf_inds.npy'), mmap_mode='r')
+        self._years = np.load(os.path.join(stamp_dir, 'years.npy'), mmap_mode='r')
+        with open(os.path.join(stamp_dir, 'confs.json'), 'r') as f:
+            self._confs = json.load(f)
+
+    def _ensure_loaded(self):
+        if self._doi_hashes is None:
+            self.load()
+
+    def lookup(self, doi: str) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        Get DBLP conf key and year for a DOI
+        :param doi:
+        :return: (conf, year) or None if DOI is not in DBLP
+        """
+        if not doi:
+            return None
+        self._ensure_loaded()
+        ind = find_sorted(self._doi_hashes, doi.lower())
+        if ind < 0:
+            return None
+        year = int(self._years[ind])
+        return self._confs[self._conf_inds[ind]], (year if year != NO_YEAR else None)
+
+    def get_conf(self, doi: str) -> Optional[str]:
+        entry = self.lookup(doi)
+        return entry[0] if entry else None
+
+    def get_year(self, doi: str) -> Optional[int]:
+        entry = self.lookup(doi)
+        return entry[1] if entry else None
+
+    def __contains__(self, doi: str) -> bool:
+        return self.lookup(doi) is not None
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._doi_hashes)
+
+
+_DBLP_INDEX = None
+
+
+def get_dblp_index() -> DblpIndex:
+    """
+    Shared DBLP index for this process (created on first use)
+    :return:
+    """
+    global _DBLP_INDEX
+    if _DBLP_INDEX is None:
+        _DBLP_INDEX = DblpIndex()
+    return _DBLP_INDEX
+
+
+if __name__ == '__main__':
+    index = get_dblp_index()
+    index.load()
+    print(f'{len(index)} DOIs indexed')
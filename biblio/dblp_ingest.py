@@ -0,0 +1,286 @@
+"""
+Build data/dblp_papers_by_conference.json.gz and data/dblp_container_meta.json
+from the DBLP XML dump (https://dblp.org/xml/dblp.xml.gz).
+
+The dump is stream-parsed with iterparse, clearing each record once it is
+read, and papers of conf/ and journals/ venues are spilled to temporary
+bucket files (all papers of a venue in the same bucket); the output is then
+assembled one bucket at a time. Memory is bounded by the largest bucket,
+not by the size of the dump. Entities declared in dblp.dtd (e.g. &ouml;)
+are the HTML entities, so the DTD itself is not needed.
+
+usage: python -m biblio.dblp_ingest [dblp.xml.gz] [--doi-index]
+"""
+
+import os, sys
+import json
+import gzip
+import time
+import shutil
+import argparse
+import tempfile
+import html.entities
+import xml.etree.ElementTree as ET
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from biblio.dblp_index import DblpIndex, DBLP_ALL_FILE, NO_YEAR
+from biblio.utils.hash_utils import hash_str, hash_strs
+from biblio.utils.profile_utils import count, phase
+
+
+DBLP_XML_FILE = 'data/dblp.xml.gz'
+DBLP_CONTAINER_META_FILE = 'data/dblp_container_meta.json'
+
+VENUE_PREFIXES = ('conf/', 'journals/')
+# top-level record elements of the dump
+RECORD_TAGS = {
+    'article', 'inproceedings', 'proceedings', 'book', 'incollection', 'phdthesis', 'mastersthesis', 'www', 'data'
+}
+# records written to the per-venue paper lists
+PAPER_TAGS = {'article', 'inproceedings'}
+DOI_PREFIXES = ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/')
+
+NUM_BUCKETS = 64
+PROGRESS_EVERY = 1000000
+
+
+def venue_of_key(record_key: str) -> Optional[str]:
+    """
+    DBLP venue key of a record key, e.g. conf/chi/SmithJ20 -> conf/chi
+    :param record_key:
+    :return: None for records outside conf/ and journals/
+    """
+    if not record_key.startswith(VENUE_PREFIXES):
+        return None
+    parts = record_key.split('/')
+    return '/'.join(parts[:2]) if len(parts) >= 3 else None
+
+
+def doi_of_urls(urls: List[str]) -> Optional[str]:
+    """
+    DOI of the first doi.org link among a record's electronic editions
+    :param urls:
+    :return:
+    """
+    for url in urls:
+        for prefix in DOI_PREFIXES:
+            if url.startswith(prefix):
+                return url[len(prefix):]
+    return None
+
+
+def _text(elem) -> str:
+    # element text including markup children (e.g. <i>, <sub> in titles)
+    return ''.join(elem.itertext()).strip()
+
+
+def iter_dblp_records(xml_path: str) -> Iterator[Tuple[str, Dict]]:
+    """
+    Stream (tag, fields) for every conf/ and journals/ record of a DBLP XML
+    file (gzipped or not); fields are key, title, year, doi, booktitle,
+    journal and issns. Each record is cleared once read.
+    :param xml_path:
+    :return:
+    """
+    parser = ET.XMLParser()
+    parser.entity.update(html.entities.entitydefs)
+    opener = gzip.open if xml_path.endswith('.gz') else open
+    with opener(xml_path, 'rb') as f:
+        root = None
+        depth = 0
+        for event, elem in ET.iterparse(f, events=('start', 'end'), parser=parser):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            # a top-level record is complete
+            if elem.tag in RECORD_TAGS:
+                key = elem.get('key', '')
+                if venue_of_key(key):
+                    year = elem.findtext('year')
+                    title = elem.find('title')
+                    yield elem.tag, {
+                        'key': key,
+                        'title': _text(title) if title is not None else None,
+                        'year': int(year) if year and year.isdigit() else None,
+                        'doi': doi_of_urls([ee.text or '' for ee in elem.iter('ee')]),
+                        'booktitle': elem.findtext('booktitle'),
+                        'journal': elem.findtext('journal'),
+                        'issns': [issn.text for issn in elem.iter('issn') if issn.text]
+                    }
+            root.clear()
+
+
+class _VenueStats:
+    # what the container metadata is derived from, per venue
+    def __init__(self):
+        self.names = Counter()
+        self.proceedings_title = None
+        self.proceedings_year = -1
+        self.issns = set()
+
+
+def _container_entry(venue: str, stats: _VenueStats, existing: Optional[Dict]) -> Dict:
+    # curated fields of an existing entry are kept; ISSNs are merged
+    entry = dict(existing or {}, key=venue)
+    name = stats.names.most_common(1)[0][0] if stats.names else None
+    if venue.startswith('conf/'):
+        if name and not entry.get('acronym'):
+            entry['acronym'] = name
+        title = stats.proceedings_title or name
+    else:
+        title = name
+    if not entry.get('title'):
+        entry['title'] = title or venue
+    entry['issns'] = sorted(set(entry.get('issns') or []) | stats.issns)
+    return entry
+
+
+def ingest_dblp(
+        xml_path: str = DBLP_XML_FILE,
+        out_path: str = DBLP_ALL_FILE,
+        meta_path: str = DBLP_CONTAINER_META_FILE,
+        doi_index: bool = False,
+        merge_meta: bool = True,
+        num_buckets: int = NUM_BUCKETS
+) -> Dict:
+    """
+    Write the DBLP papers-by-venue file (dict(key=venue, value=list of papers
+    with key, title, year and doi)) and the container metadata (one JSON
+    object per venue with key, title, acronym and issns) from the XML dump
+    :param xml_path:
+    :param out_path:
+    :param meta_path:
+    :param doi_index: also install the DblpIndex of the new file, so it is not rebuilt on first use
+    :param merge_meta: keep the fields of entries already in meta_path (e.g. curated titles and homepages)
+    :param num_buckets: number of temporary bucket files
+    :return: counts and throughput of the run
+    """
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(dir=out_dir, prefix='.tmp-dblp-')
+    stats = dict()
+    num_records = 0
+    num_papers = 0
+    tic = time.time()
+    try:
+        buckets = [open(os.path.join(spill_dir, f'{i:03d}.jsonl'), 'w') for i in range(num_buckets)]
+        with phase('dblp_ingest.parse'):
+            for tag, record in iter_dblp_records(xml_path):
+                num_records += 1
+                venue = venue_of_key(record['key'])
+                venue_stats = stats.get(venue)
+                if venue_stats is None:
+                    venue_stats = stats[venue] = _VenueStats()
+                venue_stats.issns.update(record['issns'])
+                if tag == 'proceedings':
+                    if record['title'] and (record['year'] or 0) >= venue_stats.proceedings_year:
+                        venue_stats.proceedings_title = record['title']
+                        venue_stats.proceedings_year = record['year'] or 0
+                elif tag in PAPER_TAGS:
+                    name = record['booktitle'] if tag == 'inproceedings' else record['journal']
+                    if name:
+                        venue_stats.names[name] += 1
+                    paper = {key: record[key] for key in ('key', 'title', 'year', 'doi')}
+                    buckets[hash_str(venue) % num_buckets].write(json.dumps([venue, paper]) + '\n')
+                    num_papers += 1
+                if num_records % PROGRESS_EVERY == 0:
+                    print(f'{num_records} records, {num_records / (time.time() - tic):.0f} records/sec')
+        for bucket in buckets:
+            bucket.close()
+        parse_seconds = time.time() - tic
+        print(f'parsed {num_records} records ({num_papers} papers, {len(stats)} venues) '
+              f'in {parse_seconds:.1f}s, {num_records / max(parse_seconds, 1e-9):.0f} records/sec')
+
+        # assemble one bucket at a time
+        doi_hashes, doi_confs, doi_years = [], [], []
+        confs = sorted(stats)
+        conf_to_ind = {venue: i for i, venue in enumerate(confs)}
+        tmp_out = os.path.join(spill_dir, 'papers.json.gz')
+        with phase('dblp_ingest.write'), gzip.open(tmp_out, 'wt', encoding='utf-8') as outf:
+            outf.write('{')
+            first = True
+            for i in range(num_buckets):
+                by_venue = dict()
+                with open(os.path.join(spill_dir, f'{i:03d}.jsonl'), 'r') as f:
+                    for line in f:
+                        venue, paper = json.loads(line)
+                        by_venue.setdefault(venue, []).append(paper)
+                for venue in sorted(by_venue):
+                    papers = by_venue[venue]
+                    outf.write(('' if first else ', ') + json.dumps(venue) + ': ' + json.dumps(papers))
+                    first = False
+                    if doi_index:
+                        with_doi = [p for p in papers if p['doi']]
+                        doi_hashes.append(hash_strs(p['doi'].lower() for p in with_doi))
+                        doi_confs.append(np.full(len(with_doi), conf_to_ind[venue], dtype=np.int32))
+                        doi_years.append(np.array([p['year'] or NO_YEAR for p in with_doi], dtype=np.int16))
+                del by_venue
+            outf.write('}')
+        os.replace(tmp_out, out_path)
+
+        existing = dict()
+        if merge_meta and os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    existing[entry['key']] = entry
+        tmp_meta = os.path.join(spill_dir, 'container_meta.json')
+        with open(tmp_meta, 'w') as outf:
+            for venue in list(existing) + sorted(set(stats) - set(existing)):
+                entry = _container_entry(venue, stats[venue], existing.get(venue)) if venue in stats \
+                    else existing[venue]
+                outf.write(json.dumps(entry, sort_keys=True) + '\n')
+        os.replace(tmp_meta, meta_path)
+
+        num_dois = None
+        if doi_index:
+            with phase('dblp_ingest.doi_index'):
+                hashes = np.concatenate(doi_hashes) if doi_hashes else np.zeros(0, dtype=np.uint64)
+                # a DOI listed twice keeps its last (conf, year), as DblpIndex.build does
+                unique, last = np.unique(hashes[::-1], return_index=True)
+                last = len(hashes) - 1 - last
+                index = DblpIndex(out_path)
+                index_dir = index.publish_arrays(
+                    unique, np.concatenate(doi_confs)[last] if doi_confs else np.zeros(0, dtype=np.int32),
+                    np.concatenate(doi_years)[last] if doi_years else np.zeros(0, dtype=np.int16), confs
+                )
+                num_dois = len(unique)
+            print(f'{num_dois} DOIs indexed in {index_dir}')
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    seconds = time.time() - tic
+    count('dblp_ingest.records', num_records)
+    count('dblp_ingest.papers', num_papers)
+    result = {
+        'records': num_records,
+        'papers': num_papers,
+        'venues': len(stats),
+        'dois_indexed': num_dois,
+        'seconds': seconds,
+        'records_per_sec': num_records / max(seconds, 1e-9)
+    }
+    print(f"wrote {out_path} and {meta_path} in {seconds:.1f}s ({result['records_per_sec']:.0f} records/sec)")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the DBLP venue files from the DBLP XML dump')
+    parser.add_argument('xml_path', nargs='?', default=DBLP_XML_FILE, help='dblp.xml or dblp.xml.gz')
+    parser.add_argument('--out', default=DBLP_ALL_FILE, help='papers by venue (gzipped JSON)')
+    parser.add_argument('--meta-out', default=DBLP_CONTAINER_META_FILE, help='container metadata (JSONL)')
+    parser.add_argument('--doi-index', action='store_true', help='also write the DOI -> (venue, year) index')
+    parser.add_argument(
+        '--no-merge-meta', action='store_true',
+        help='do not keep the fields of entries already in the container metadata file'
+    )
+    args = parser.parse_args()
+    ingest_dblp(args.xml_path, args.out, args.meta_out, args.doi_index, not args.no_merge_meta)
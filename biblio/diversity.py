@@ -0,0 +1,156 @@
+"""
+Leinster–Cobbold diversity of paper neighborhoods at any FoS level and any
+order q, with the per-paper LCDI of scripts/get_lcdi_scores.py as the case
+level=1, q=2.
+
+For a paper with neighborhood FoS proportions p, similarity Z and weights u
+over FoS (u = p for the classical index; for the LCDI, u_j = p_j / |own| on
+the paper's own FoS), the diversity of order q is
+
+    D_q = 1 / (S * M_{q-1}(u / S, Zp)),   S = sum(u)
+
+with M_r the weighted power mean of order r (geometric at r = 0, max at
+r = inf). With u = p this is the classical index (sum(p (Zp)^(q-1)))^(1/(1-q));
+at q = 2 with own-FoS weights it is compute_lcdi_batch. The neighbor
+adjacency is built once per direction, proportions and Zp once per level,
+and every order is read off the same chunk, so a sweep over orders costs
+about one LCDI run per level, e.g.
+
+    scores = compute_diversity(papers, lookup, mag_lookup, 'refs', levels=(0, 1, 2), orders=(0, 1, 2, np.inf))
+"""
+
+import os, sys
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from biblio.papers import PaperLookup
+from biblio.load_fos import MagLookup
+from biblio.utils.lcdi_utils import build_fos_proportions, get_lcdi_fos_universe, neighbor_adjacency
+from biblio.utils.profile_utils import count, phase
+
+
+DIVERSITY_ORDERS = (0, 1, 2, np.inf)
+WEIGHTINGS = ('own', 'abundance')
+
+
+def order_name(level: int, q: float) -> str:
+    """
+    Column name of a (level, order) combination, e.g. l1_q2 or l0_qinf
+    :param level:
+    :param q:
+    :return:
+    """
+    q_name = 'inf' if np.isinf(q) else f'{q:g}'
+    return f'l{level}_q{q_name}'
+
+
+def _power_means(weights: np.ndarray, values: np.ndarray, orders: Sequence[float]) -> np.ndarray:
+    # (rows x orders) weighted power means of `values` over entries with weight > 0
+    # (weights are normalized per row); nan for rows without weight
+    support = weights > 0
+    safe_values = np.where(support, values, 1.)
+    means = np.full((weights.shape[0], len(orders)), np.nan)
+    for k, r in enumerate(orders):
+        if np.isposinf(r):
+            means[:, k] = np.where(support, values, -np.inf).max(axis=1)
+        elif r == 0:
+            means[:, k] = np.exp((weights * np.log(safe_values)).sum(axis=1))
+        else:
+            with np.errstate(divide='ignore'):
+                means[:, k] = (weights * safe_values ** r).sum(axis=1) ** (1. / r)
+    means[~support.any(axis=1)] = np.nan
+    return means
+
+
+def compute_diversity_batch(
+        prop: scipy.sparse.csr_matrix,
+        this_fos: scipy.sparse.csr_matrix,
+        sim: np.ndarray,
+        orders: Sequence[float] = DIVERSITY_ORDERS,
+        weighting: str = 'own',
+        chunk_size: int = 4096
+) -> np.ndarray:
+    """
+    Diversity of every row for every order, from one pass of dense chunks
+    :param prop: (papers x FoS) proportion counts, from build_fos_proportions
+    :param this_fos: (papers x FoS) indicator of each paper's own FoS
+    :param sim: (FoS x FoS) similarity matrix
+    :param orders: orders q >= 0 (np.inf allowed)
+    :param weighting: 'own' (LCDI, averaged over each paper's own FoS) or
+        'abundance' (classical index, over all FoS in the neighborhood)
+    :param chunk_size:
+    :return: (papers x orders) diversities (nan for papers without own FoS)
+    """
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f'weighting must be one of {WEIGHTINGS}, got {weighting!r}')
+    if any(q < 0 for q in orders):
+        raise ValueError(f'orders must be >= 0, got {orders}')
+    power_orders = [q - 1. for q in orders]
+    num_papers = prop.shape[0]
+    diversity = np.full((num_papers, len(orders)), np.nan)
+    for start in range(0, num_papers, chunk_size):
+        end = min(start + chunk_size, num_papers)
+        p = prop[start:end].toarray()
+        totals = p.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.
+        p /= totals
+        zp = p @ sim
+        own = this_fos[start:end].toarray()
+        num_own = own.sum(axis=1)
+        if weighting == 'own':
+            u = own * p / np.where(num_own > 0, num_own, 1.)[:, None]
+        else:
+            u = p
+        u_total = u.sum(axis=1)
+        means = _power_means(u / np.where(u_total > 0, u_total, 1.)[:, None], zp, power_orders)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk = 1. / (u_total[:, None] * means)
+        chunk[num_own == 0] = np.nan
+        diversity[start:end] = chunk
+    return diversity
+
+
+def compute_diversity(
+        papers: Sequence,
+        lookup: PaperLookup,
+        mag_lookup: MagLookup,
+        direction: str = 'refs',
+        levels: Sequence[int] = (1,),
+        orders: Sequence[float] = DIVERSITY_ORDERS,
+        fos_of_interest: Optional[Dict[int, Set]] = None,
+        weighting: str = 'own',
+        chunk_size: int = 4096
+) -> pd.DataFrame:
+    """
+    Diversity of each paper's neighborhood for every (level, order) combination
+    :param papers:
+    :param lookup:
+    :param mag_lookup:
+    :param direction: 'refs', 'cits' or 'both'
+    :param levels: FoS levels (0-2)
+    :param orders: orders q >= 0 (np.inf allowed)
+    :param fos_of_interest: level -> extra FoS columns (they only add zero proportions)
+    :param weighting: see compute_diversity_batch
+    :param chunk_size: rows per dense block
+    :return: DataFrame with a pid column and one column per combination, named by order_name,
+        in the row order of papers
+    """
+    with phase('diversity.adjacency'):
+        adj = neighbor_adjacency(papers, lookup, direction)
+    scores = pd.DataFrame({'pid': [p.pid if p else None for p in papers]})
+    for level in levels:
+        with phase('diversity.build_fos_proportions'):
+            fos_universe = get_lcdi_fos_universe(papers, lookup, (fos_of_interest or {}).get(level, set()), level)
+            prop, this_fos, fos_ids = build_fos_proportions(papers, lookup, fos_universe, direction, level, adj)
+        with phase('diversity.batch'):
+            values = compute_diversity_batch(
+                prop, this_fos, mag_lookup.compute_sim_matrix(fos_ids), orders, weighting, chunk_size
+            )
+        for k, q in enumerate(orders):
+            scores[order_name(level, q)] = values[:, k]
+        count('diversity.papers_skipped_no_fos', int(np.isnan(values[:, 0]).sum()))
+    count('diversity.papers', len(papers))
+    return scores
@@ -0,0 +1,166 @@
+"""
+Merge records of the same paper that share any of their pid, DOI or SHA.
+
+The dataset lists a paper once per venue group it is in, and the same paper
+may come with only some of its ids filled in, e.g. [pid, None, sha] in one
+group and [None, doi, sha] in another. Paper.__eq__ treats these as equal
+but Paper.__hash__ does not, so set-based dedupe keeps both. resolve_papers
+unions records that share an id (one pass over per-id hash indexes, with a
+union-find over record positions), merges each connected set into one
+canonical paper and returns an alias map from every id seen to it.
+"""
+
+import os, sys
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from biblio.papers import Paper
+
+
+class UnionFind:
+    """
+    Disjoint sets over 0..n-1, with union by size and path halving
+    """
+    def __init__(self, n: int = 0):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def add(self) -> int:
+        self.parent.append(len(self.parent))
+        self.size.append(1)
+        return len(self.parent) - 1
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x: int, y: int) -> int:
+        x = self.find(x)
+        y = self.find(y)
+        if x == y:
+            return x
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        return x
+
+
+class PaperAliases:
+    """
+    Every pid, DOI and SHA seen in the input records, mapped to the position
+    of its canonical paper, plus the canonical position of each input record
+    """
+    def __init__(self, pid_map: Dict[int, int], doi_map: Dict[str, int], sha_map: Dict[str, int], records: List[int]):
+        self.pid_map = pid_map
+        self.doi_map = doi_map
+        self.sha_map = sha_map
+        self.records = records
+
+    def find(self, paper_ids) -> int:
+        """
+        Canonical position of a [pid, doi, sha] triple, matching on pid, then DOI, then SHA
+        :param paper_ids:
+        :return: -1 if none of the ids are known
+        """
+        pid, doi, sha = paper_ids
+        if pid and int(pid) in self.pid_map:
+            return self.pid_map[int(pid)]
+        if doi and doi.lower() in self.doi_map:
+            return self.doi_map[doi.lower()]
+        if sha and sha.lower() in self.sha_map:
+            return self.sha_map[sha.lower()]
+        return -1
+
+
+def _merge_edges(edge_lists: Sequence[List]) -> List:
+    # drop edges sharing any id with an edge already kept
+    merged = []
+    seen = (set(), set(), set())
+    for edges in edge_lists:
+        for edge in edges:
+            pid, doi, sha = edge
+            keys = (int(pid) if pid else None, doi.lower() if doi else None, sha.lower() if sha else None)
+            if any(key is not None and key in ids for key, ids in zip(keys, seen)):
+                continue
+            for key, ids in zip(keys, seen):
+                if key is not None:
+                    ids.add(key)
+            merged.append(edge)
+    return merged
+
+
+def _first(values):
+    return next((value for value in values if value), None)
+
+
+def merge_papers(papers: Sequence[Paper]) -> Paper:
+    """
+    Merge records of one paper: the first non-empty value of each field (in
+    record order), the union of FoS (highest score per MAG id) and the union
+    of refs/cits (an edge sharing any id with an earlier one is dropped)
+    :param papers:
+    :return: papers[0] itself if there is a single record
+    """
+    if len(papers) == 1:
+        return papers[0]
+    fos_by_id = dict()
+    for p in papers:
+        for entry in (p.fos or []):
+            if entry[0] not in fos_by_id or entry[1] > fos_by_id[entry[0]][1]:
+                fos_by_id[entry[0]] = entry
+    return Paper.from_normalized(
+        pid=_first(p.pid for p in papers),
+        doi=_first(p.doi for p in papers),
+        sha=_first(p.sha for p in papers),
+        venue=_first(p.venue for p in papers),
+        year=_first(p.year for p in papers),
+        fos=sorted(fos_by_id.values(), key=lambda x: x[1], reverse=True) if fos_by_id else None,
+        title=_first(p.title for p in papers),
+        refs=_merge_edges([p.refs for p in papers]),
+        cits=_merge_edges([p.cits for p in papers])
+    )
+
+
+def group_records(id_triples: Iterable[Tuple]) -> PaperAliases:
+    """
+    Group records that share a pid, DOI or SHA (transitively), from their ids
+    alone, so that a stream of records can be resolved without keeping them
+    :param id_triples: (pid, doi, sha) of each record
+    :return: aliases; canonical positions are in order of each group's first record
+    """
+    sets = UnionFind()
+    # id -> first record with that id
+    first_by_id = (dict(), dict(), dict())
+    for ids in id_triples:
+        i = sets.add()
+        for key, first in zip(ids, first_by_id):
+            if not key:
+                continue
+            j = first.setdefault(key, i)
+            if j != i:
+                sets.union(i, j)
+
+    position = dict()
+    records = []
+    for i in range(len(sets.parent)):
+        records.append(position.setdefault(sets.find(i), len(position)))
+
+    pid_map, doi_map, sha_map = ({key: records[i] for key, i in first.items()} for first in first_by_id)
+    return PaperAliases(pid_map, doi_map, sha_map, records)
+
+
+def resolve_papers(records: Sequence[Paper]) -> Tuple[List[Paper], PaperAliases]:
+    """
+    Group records that share a pid, DOI or SHA (transitively) and merge each group
+    :param records:
+    :return: canonical papers, in order of their first record, and aliases
+    """
+    aliases = group_records((p.pid, p.doi, p.sha) for p in records)
+    members = [[] for _ in range(max(aliases.records, default=-1) + 1)]
+    for i, ind in enumerate(aliases.records):
+        members[ind].append(records[i])
+    papers = [merge_papers(group) for group in members]
+    return papers, aliases
@@ -0,0 +1,333 @@
+"""
+Streamed per-paper LCDI results and per-group summaries for plotting.
+
+Results are written as JSONL while they are computed: a header line, then
+one [group, pid, direction, lcdi] row per paper, with the rows of a group
+contiguous. The writer keeps a fixed-resolution histogram per group, so
+memory does not grow with the number of papers. On close it writes a summary
+table (count, mean, exact quantiles and box-plot whiskers, computed from the
+results file one group at a time) and a histogram table, which the notebook
+plots without reading any per-paper results, e.g.
+
+    summary = pd.read_csv(lcdi_result_paths('refs')['summary'], index_col='group')
+    ax.bxp(lcdi_box_stats(summary, VENUES_TO_PLOT), showfliers=False)
+"""
+
+import os, sys
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+LCDI_RESULTS_DIR = 'data/analysis'
+
+# bump when the row layout changes
+LCDI_RESULTS_VERSION = 1
+
+RESULT_COLUMNS = ['group', 'pid', 'direction', 'lcdi']
+
+# width of the running histogram bins the histogram table is built from
+SUMMARY_RESOLUTION = 0.01
+# width of the bins of the histogram table
+HISTOGRAM_BIN_WIDTH = 1.
+SUMMARY_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def lcdi_result_paths(direction: str, out_dir: str = LCDI_RESULTS_DIR) -> Dict[str, str]:
+    """
+    Files written by LcdiResultWriter for a direction
+    :param direction: 'refs' or 'cits'
+    :param out_dir:
+    :return:
+    """
+    return {
+        'results': os.path.join(out_dir, f'lcdi_{direction}_l1.jsonl'),
+        'summary': os.path.join(out_dir, f'lcdi_{direction}_summary_l1.csv'),
+        'histogram': os.path.join(out_dir, f'lcdi_{direction}_histogram_l1.csv')
+    }
+
+
+class _RunningHistogram:
+    # fixed-resolution histogram of one group's finite values
+    def __init__(self, resolution: float):
+        self.resolution = resolution
+        self.bins = np.zeros(0, dtype=np.int64)
+
+    def add(self, values: np.ndarray):
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        bins = np.bincount(np.maximum(np.floor(values / self.resolution), 0).astype(np.int64))
+        if len(bins) > len(self.bins):
+            bins[:len(self.bins)] += self.bins
+            self.bins = bins
+        else:
+            self.bins[:len(bins)] += bins
+
+
+def _whiskers(values: np.ndarray, q1: float, q3: float) -> Tuple[float, float]:
+    # most extreme values within 1.5 IQR of the quartiles (as matplotlib's boxplot_stats)
+    low = values[values >= q1 - 1.5 * (q3 - q1)]
+    high = values[values <= q3 + 1.5 * (q3 - q1)]
+    return (
+        min(float(low.min()), q1) if len(low) else q1,
+        max(float(high.max()), q3) if len(high) else q3
+    )
+
+
+def _summary_row(values: np.ndarray) -> Dict:
+    # count, moments, quantiles and box-plot whiskers of one group's values
+    finite = values[np.isfinite(values)]
+    row = {'count': len(finite)}
+    if len(finite):
+        row['mean'] = float(finite.mean())
+        row['std'] = float(finite.std(ddof=1)) if len(finite) > 1 else 0.
+        row['min'] = float(finite.min())
+        for q, value in zip(SUMMARY_QUANTILES, np.quantile(finite, SUMMARY_QUANTILES)):
+            row[f'q{int(round(q * 100)):02d}'] = float(value)
+        row['max'] = float(finite.max())
+        row['whisker_low'], row['whisker_high'] = _whiskers(finite, row['q25'], row['q75'])
+    row['num_nonfinite'] = len(values) - len(finite)
+    return row
+
+
+class LcdiResultWriter:
+    """
+    Streams per-paper LCDI rows of one direction to JSONL, keeping per-group
+    running histograms; the rows of a group must be written contiguously. The
+    files are written under temporary names and moved into place on close, so
+    readers never see a partial run.
+    """
+    def __init__(self, direction: str, out_dir: str = LCDI_RESULTS_DIR, resolution: float = SUMMARY_RESOLUTION):
+        self.direction = direction
+        self.paths = lcdi_result_paths(direction, out_dir)
+        self.resolution = resolution
+        self.histograms: Dict[str, _RunningHistogram] = {}
+        self.num_rows = 0
+        self._last_group = None
+        os.makedirs(out_dir, exist_ok=True)
+        self._tmp_path = f"{self.paths['results']}.{os.getpid()}.tmp"
+        self._outf = open(self._tmp_path, 'w')
+        self._outf.write(json.dumps({
+            'columns': RESULT_COLUMNS, 'direction': direction, 'version': LCDI_RESULTS_VERSION
+        }) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, group: str, pids: Sequence, values: np.ndarray):
+        """
+        Append rows for papers of one group
+        :param group:
+        :param pids:
+        :param values: LCDI of each paper
+        :return:
+        """
+        if group != self._last_group and group in self.histograms:
+            raise ValueError(f'rows of group {group} must be written contiguously')
+        self._last_group = group
+        values = np.asarray(values, dtype=np.float64)
+        self._outf.write(''.join(
+            json.dumps([group, pid, self.direction, float(value)]) + '\n' for pid, value in zip(pids, values)
+        ))
+        if group not in self.histograms:
+            self.histograms[group] = _RunningHistogram(self.resolution)
+        self.histograms[group].add(values)
+        self.num_rows += len(values)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Exact per-group summary of the rows written so far, read back from the
+        results file one group at a time
+        :return: DataFrame with columns group, direction, count, mean, std, min, q05, q25, q50,
+            q75, q95, max, whisker_low, whisker_high and num_nonfinite
+        """
+        path = self._tmp_path
+        if self._outf.closed:
+            path = self.paths['results']
+        else:
+            self._outf.flush()
+        rows = [
+            dict(group=group, direction=self.direction, **_summary_row(values))
+            for group, values in iter_lcdi_group_values(path)
+        ]
+        return pd.DataFrame(rows)
+
+    def histogram(self, bin_width: float = HISTOGRAM_BIN_WIDTH) -> pd.DataFrame:
+        """
+        Per-group counts of the rows written so far in bins of bin_width
+        (a multiple of the writer's resolution); empty bins are left out
+        :param bin_width:
+        :return: DataFrame with columns group, direction, bin_start, bin_end and count
+        """
+        factor = max(1, int(round(bin_width / self.resolution)))
+        frames = []
+        for group, s in self.histograms.items():
+            padded = np.zeros(-(-len(s.bins) // factor) * factor, dtype=np.int64)
+            padded[:len(s.bins)] = s.bins
+            counts = padded.reshape(-1, factor).sum(axis=1)
+            occupied = np.flatnonzero(counts)
+            starts = occupied * factor * self.resolution
+            frames.append(pd.DataFrame({
+                'group': group, 'direction': self.direction,
+                'bin_start': starts, 'bin_end': starts + factor * self.resolution, 'count': counts[occupied]
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['group', 'direction', 'bin_start', 'bin_end', 'count'])
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        """
+        Publish the results and write the summary and histogram tables
+        :return:
+        """
+        self._outf.close()
+        os.replace(self._tmp_path, self.paths['results'])
+        self.summary().to_csv(self.paths['summary'], index=False)
+        self.histogram().to_csv(self.paths['histogram'], index=False)
+
+    def abort(self):
+        self._outf.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def _check_header(f, path: str):
+    header = json.loads(f.readline())
+    if header.get('version') != LCDI_RESULTS_VERSION:
+        raise ValueError(f'{path} has version {header.get("version")}, expected {LCDI_RESULTS_VERSION}')
+
+
+def iter_lcdi_results(path: str) -> Iterator[Tuple[str, object, str, float]]:
+    """
+    Rows (group, pid, direction, lcdi) of a results file, in file order
+    :param path:
+    :return:
+    """
+    with open(path, 'r') as f:
+        _check_header(f, path)
+        for line in f:
+            group, pid, direction, lcdi = json.loads(line)
+            yield group, pid, direction, lcdi
+
+
+def iter_lcdi_group_values(path: str) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    LCDI values of each group of a results file, one group at a time (rows of
+    a group must be contiguous, as written by LcdiResultWriter)
+    :param path:
+    :return: iterator of (group, values), in file order
+    """
+    current = None
+    values = []
+    seen = set()
+    for group, _, _, lcdi in iter_lcdi_results(path):
+        if group != current:
+            if group in seen:
+                raise ValueError(f'rows of group {group} are not contiguous in {path}')
+            seen.add(group)
+            if current is not None:
+                yield current, np.array(values, dtype=np.float64)
+            current = group
+            values = []
+        values.append(lcdi)
+    if current is not None:
+        yield current, np.array(values, dtype=np.float64)
+
+
+def load_lcdi_results(path: str, groups: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Results file as a DataFrame with columns group, pid, direction and lcdi
+    :param path:
+    :param groups: groups to keep (default all)
+    :return:
+    """
+    with open(path, 'r') as f:
+        _check_header(f, path)
+        # one parse of all rows is much faster than one per line
+        rows = json.loads('[' + ','.join(line for line in f if line.strip()) + ']')
+    df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    if groups is not None:
+        df = df[df['group'].isin(list(groups))]
+    return df.reset_index(drop=True)
+
+
+def write_lcdi_json(results_path: str, json_path: str):
+    """
+    Write a results file in the dict(key=group, value=dict(key=pid, value=lcdi))
+    JSON layout, one group at a time (rows of a group must be contiguous, as
+    written by get_lcdi_scores.py)
+    :param results_path:
+    :param json_path:
+    :return:
+    """
+    with open(json_path, 'w') as outf:
+        outf.write('{')
+        current = None
+        seen = set()
+        for group, pid, _, lcdi in iter_lcdi_results(results_path):
+            if group != current:
+                if group in seen:
+                    raise ValueError(f'rows of group {group} are not contiguous in {results_path}')
+                seen.add(group)
+                outf.write(('}, ' if current is not None else '') + json.dumps(str(group)) + ': {')
+                current = group
+                first = True
+            outf.write(('' if first else ', ') + json.dumps(str(pid)) + ': ' + json.dumps(lcdi))
+            first = False
+        outf.write('}}' if current is not None else '}')
+
+
+def lcdi_box_stats(summary: pd.DataFrame, groups: Sequence[str], labels: Optional[Sequence[str]] = None) -> List[Dict]:
+    """
+    Box-plot statistics of the given groups for matplotlib's Axes.bxp
+    :param summary: summary table indexed by group
+    :param groups:
+    :param labels: label of each group (default the group names)
+    :return:
+    """
+    labels = list(groups) if labels is None else labels
+    return [
+        {
+            'label': label,
+            'med': summary.loc[group, 'q50'],
+            'q1': summary.loc[group, 'q25'],
+            'q3': summary.loc[group, 'q75'],
+            'whislo': summary.loc[group, 'whisker_low'],
+            'whishi': summary.loc[group, 'whisker_high'],
+            'mean': summary.loc[group, 'mean'],
+            'fliers': []
+        }
+        for group, label in zip(groups, labels)
+    ]
+
+
+def summarize_lcdi_json(json_path: str, direction: str, out_dir: str = LCDI_RESULTS_DIR) -> Dict[str, str]:
+    """
+    Convert a dict(key=group, value=dict(key=pid, value=lcdi)) JSON result file
+    (as shipped in data/analysis) to a results file with summary tables
+    :param json_path:
+    :param direction:
+    :param out_dir:
+    :return: paths written
+    """
+    with open(json_path, 'r') as f:
+        results = json.load(f)
+    with LcdiResultWriter(direction, out_dir) as writer:
+        for group, values in results.items():
+            writer.write(group, [int(pid) for pid in values], np.fromiter(values.values(), dtype=np.float64))
+    return writer.paths
+
+
+if __name__ == '__main__':
+    for direction_arg in ('refs', 'cits'):
+        paths = summarize_lcdi_json(os.path.join(LCDI_RESULTS_DIR, f'lcdi_{direction_arg}_by_papers_l1.json'), direction_arg)
+        print(f'{direction_arg}: wrote {", ".join(paths.values())}')
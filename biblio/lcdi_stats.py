@@ -0,0 +1,168 @@
+"""
+Bootstrap confidence intervals and pairwise permutation tests for the mean
+per-paper LCDI of each venue, on the results of scripts/get_lcdi_scores.py.
+
+Resamples are drawn and reduced as (resamples x papers) NumPy arrays, in
+chunks of at most max_elements entries; results depend only on the seed,
+the number of resamples and max_elements.
+"""
+
+import os, sys
+import json
+import itertools
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from biblio.constants import VENUES_TO_PLOT
+
+
+LCDI_RESULT_FILES = {
+    'refs': 'data/analysis/lcdi_refs_by_papers_l1.json',
+    'cits': 'data/analysis/lcdi_cits_by_papers_l1.json'
+}
+
+# entries per chunk of resamples
+MAX_ELEMENTS = 2 ** 23
+
+
+def load_lcdi_values(path: str, groups: Optional[Sequence[str]] = VENUES_TO_PLOT) -> Dict[str, np.ndarray]:
+    """
+    Per-paper LCDI values of each group in a get_lcdi_scores.py result file;
+    papers without a score are dropped
+    :param path:
+    :param groups: groups to keep, in this order (None for all groups in the file)
+    :return:
+    """
+    with open(path, 'r') as f:
+        results = json.load(f)
+    groups = list(results) if groups is None else groups
+    values = dict()
+    for group in groups:
+        x = np.array([v for v in results[group].values() if v is not None], dtype=np.float64)
+        values[group] = x[np.isfinite(x)]
+    return values
+
+
+def _chunks(num_resamples: int, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    for start in range(0, num_resamples, chunk_size):
+        yield start, min(start + chunk_size, num_resamples)
+
+
+def bootstrap_ci(
+        values: Dict[str, np.ndarray],
+        num_resamples: int = 10000,
+        confidence: float = 0.95,
+        seed: int = 0,
+        max_elements: int = MAX_ELEMENTS
+) -> pd.DataFrame:
+    """
+    Percentile bootstrap confidence interval of the mean of each group
+    :param values: group -> per-paper values
+    :param num_resamples:
+    :param confidence:
+    :param seed:
+    :param max_elements: bound on the size of each (resamples x papers) chunk
+    :return: DataFrame with columns group, n, mean, ci_low, ci_high
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(values))
+    rows = []
+    for (group, x), group_seed in zip(values.items(), seeds):
+        rng = np.random.default_rng(group_seed)
+        n = len(x)
+        if n == 0:
+            rows.append((group, 0, np.nan, np.nan, np.nan))
+            continue
+        means = np.empty(num_resamples)
+        for start, end in _chunks(num_resamples, max(1, max_elements // n)):
+            means[start:end] = x[rng.integers(0, n, size=(end - start, n), dtype=np.int32)].mean(axis=1)
+        alpha = (1. - confidence) / 2.
+        ci_low, ci_high = np.quantile(means, [alpha, 1. - alpha])
+        rows.append((group, n, x.mean(), ci_low, ci_high))
+    return pd.DataFrame(rows, columns=['group', 'n', 'mean', 'ci_low', 'ci_high'])
+
+
+def _holm(p_values: np.ndarray) -> np.ndarray:
+    # Holm-Bonferroni adjusted p-values
+    order = np.argsort(p_values, kind='stable')
+    scaled = p_values[order] * (len(p_values) - np.arange(len(p_values)))
+    adjusted = np.empty_like(p_values)
+    adjusted[order] = np.minimum(np.maximum.accumulate(scaled), 1.)
+    return adjusted
+
+
+def permutation_tests(
+        values: Dict[str, np.ndarray],
+        pairs: Optional[Sequence[Tuple[str, str]]] = None,
+        num_resamples: int = 10000,
+        seed: int = 0,
+        max_elements: int = MAX_ELEMENTS
+) -> pd.DataFrame:
+    """
+    Two-sided permutation test of the difference in means for each pair of groups.
+
+    A permutation of the pooled values of a pair puts a hypergeometric number
+    k of group's values (and group_size - k of other_group's) into group, each
+    a uniformly random subset of its own group. So each group is shuffled once
+    per resample, and each pair's permuted group sum is read from prefix sums
+    of the two shuffles at k and group_size - k. Shuffles are shared by all
+    pairs a group is in; each pair's null distribution is exact.
+    :param values: group -> per-paper values
+    :param pairs: pairs of groups to test (default all pairs, e.g. 78 for 13 venues)
+    :param num_resamples:
+    :param seed:
+    :param max_elements: bound on the size of each (resamples x papers) chunk, summed over groups
+    :return: DataFrame with columns group, other_group, n, other_n, mean, other_mean, diff,
+        p_value and p_holm (Holm-adjusted over the tested pairs)
+    """
+    pairs = list(itertools.combinations(values, 2)) if pairs is None else [tuple(pair) for pair in pairs]
+    groups = list(dict.fromkeys(group for pair in pairs for group in pair))
+    seeds = np.random.SeedSequence(seed).spawn(len(groups) + len(pairs))
+    group_rngs = {group: np.random.default_rng(s) for group, s in zip(groups, seeds)}
+    pair_rngs = [np.random.default_rng(s) for s in seeds[len(groups):]]
+
+    sizes = {group: len(values[group]) for group in groups}
+    totals = {group: values[group].sum() for group in groups}
+    observed = np.array([
+        values[a].mean() - values[b].mean() if sizes[a] and sizes[b] else np.nan for a, b in pairs
+    ])
+    # permuted differences at least as extreme as observed (up to rounding)
+    threshold = np.abs(observed) - 1e-12 * (1. + np.abs(observed))
+    extreme = np.zeros(len(pairs), dtype=np.int64)
+
+    chunk_size = max(1, max_elements // max(1, sum(sizes.values())))
+    for start, end in _chunks(num_resamples, chunk_size):
+        num = end - start
+        rows = np.arange(num)[:, None]
+        prefix = dict()
+        for group in groups:
+            shuffled = np.tile(values[group], (num, 1))
+            group_rngs[group].permuted(shuffled, axis=1, out=shuffled)
+            prefix[group] = np.zeros((num, sizes[group] + 1))
+            np.cumsum(shuffled, axis=1, out=prefix[group][:, 1:])
+        for ind, ((a, b), rng) in enumerate(zip(pairs, pair_rngs)):
+            n_a, n_b = sizes[a], sizes[b]
+            if not n_a or not n_b:
+                continue
+            k = rng.hypergeometric(n_a, n_b, n_a, size=num)[:, None]
+            sum_a = prefix[a][rows, k] + prefix[b][rows, n_a - k]
+            diff = sum_a / n_a - (totals[a] + totals[b] - sum_a) / n_b
+            extreme[ind] += int((np.abs(diff) >= threshold[ind]).sum())
+
+    p_values = (extreme + 1.) / (num_resamples + 1.)
+    p_values[np.isnan(observed)] = np.nan
+    result = pd.DataFrame({
+        'group': [a for a, _ in pairs],
+        'other_group': [b for _, b in pairs],
+        'n': [sizes[a] for a, _ in pairs],
+        'other_n': [sizes[b] for _, b in pairs],
+        'mean': [values[a].mean() if sizes[a] else np.nan for a, _ in pairs],
+        'other_mean': [values[b].mean() if sizes[b] else np.nan for _, b in pairs],
+        'diff': observed,
+        'p_value': p_values
+    })
+    tested = ~np.isnan(p_values)
+    result['p_holm'] = np.nan
+    result.loc[tested, 'p_holm'] = _holm(p_values[tested])
+    return result
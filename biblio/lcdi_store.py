@@ -0,0 +1,118 @@
+import os, sys
+import json
+import math
+from typing import Dict, Iterable, Optional, Tuple
+
+
+LCDI_STORE_DIR = 'data/cache/lcdi'
+
+# bump when the fingerprint or the LCDI computation changes
+LCDI_STORE_VERSION = 2
+
+
+def paper_key(paper) -> str:
+    """
+    Store key of a paper: its pid, or its [pid, doi, sha] triple if it has no pid
+    :param paper:
+    :return:
+    """
+    if paper.pid:
+        return str(paper.pid)
+    return json.dumps([paper.pid, paper.doi, paper.sha])
+
+
+class LcdiStore:
+    """
+    Persistent per-paper LCDI results, keyed by paper (see paper_key) and a
+    fingerprint of the paper's inputs (see lcdi_utils.lcdi_fingerprints).
+
+    Results are appended to a JSONL file as they are computed and flushed to
+    disk, so an interrupted run resumes from its last checkpoint. The first
+    line holds the store metadata (e.g. direction and MAG file stamp); if it
+    does not match, the stored results are discarded. Later lines for the same
+    paper supersede earlier ones until the file is compacted.
+    """
+    def __init__(self, path: str, meta: Dict):
+        self.path = path
+        self.meta = dict(meta, version=LCDI_STORE_VERSION)
+        # paper_key -> (fingerprint, lcdi), lcdi is nan for papers without FoS
+        self.results: Dict[str, Tuple[str, float]] = {}
+        self._outf = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r') as f:
+            header = f.readline()
+            try:
+                if json.loads(header).get('meta') != self.meta:
+                    print(f'{self.path} is out of date; recomputing all papers')
+                    return
+            except json.JSONDecodeError:
+                return
+            for line in f:
+                try:
+                    key, fingerprint, lcdi = json.loads(line)
+                except ValueError:
+                    # partially written last line of an interrupted run
+                    continue
+                self.results[key] = (fingerprint, math.nan if lcdi is None else lcdi)
+        # continue appending to the existing file
+        self._outf = open(self.path, 'a')
+
+    def __len__(self):
+        return len(self.results)
+
+    def get(self, paper, fingerprint: str) -> Optional[float]:
+        """
+        Stored LCDI for a paper if its fingerprint is unchanged, otherwise None
+        :param paper:
+        :param fingerprint:
+        :return:
+        """
+        stored = self.results.get(paper_key(paper))
+        if stored is None or stored[0] != fingerprint:
+            return None
+        return stored[1]
+
+    def add_many(self, items: Iterable[Tuple[object, str, float]]):
+        """
+        Record (paper, fingerprint, lcdi) results and checkpoint them to disk
+        :param items:
+        :return:
+        """
+        self._add_keyed((paper_key(paper), fingerprint, lcdi) for paper, fingerprint, lcdi in items)
+
+    def _add_keyed(self, items: Iterable[Tuple[str, str, float]]):
+        if self._outf is None:
+            self._start_file(self.path)
+        for key, fingerprint, lcdi in items:
+            lcdi = float(lcdi)
+            self.results[key] = (fingerprint, lcdi)
+            self._outf.write(json.dumps([key, fingerprint, None if math.isnan(lcdi) else lcdi]) + '\n')
+        self._outf.flush()
+        os.fsync(self._outf.fileno())
+
+    def _start_file(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._outf = open(path, 'w')
+        self._outf.write(json.dumps({'meta': self.meta}) + '\n')
+
+    def compact(self):
+        """
+        Rewrite the file with only the latest result per paper
+        :return:
+        """
+        self.close()
+        tmp_path = self.path + '.tmp'
+        self._start_file(tmp_path)
+        self._add_keyed((key, fingerprint, lcdi) for key, (fingerprint, lcdi) in self.results.items())
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._outf = open(self.path, 'a')
+
+    def close(self):
+        if self._outf is not None:
+            self._outf.close()
+            self._outf = None
@@ -1,45 +1,126 @@
 import os
-import json
+import io
 import gzip
+import time
 from collections import defaultdict
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Iterable, Iterator, Optional
 
-from biblio.utils.list_utils import flatten
-from biblio.papers import Paper, PaperLookup
+import numpy as np
+
+from biblio.utils.json_utils import iter_grouped_records
+from biblio.utils.profile_utils import PROFILER, add_time, count, phase
+from biblio.papers import Paper, PaperLookup, get_venue_normalizer, resolve_venue_year
+from biblio.entity_resolution import group_records, merge_papers, resolve_papers
+from biblio.paper_store import NO_ID, PaperStore, PaperStoreBuilder, StoreLookup, split_groups
 
 
 DATASET_PATH = 'data/analysis/a11y_bibliometrics_dataset.jsonl.gz'
 
 
-def load_dataset(data_path=DATASET_PATH) -> Tuple[Dict, Dict, PaperLookup]:
+def iter_dataset(
+        data_path=DATASET_PATH,
+        venues: Optional[Iterable[str]] = None,
+        years: Optional[Iterable[int]] = None,
+        include_extended: bool = True
+) -> Iterator[Tuple[str, str, Paper]]:
     """
-    Load a11y bibliometric dataset
+    Stream papers from the a11y bibliometric dataset without loading it whole.
+    Venue and year filters are checked on the raw records, so papers that
+    are filtered out are never constructed.
     :param data_path:
-    :return:
+    :param venues: keep only papers in these venues (normalized like get_papers_in_venue)
+    :param years: keep only papers from these years
+    :param include_extended: also read the extended set (core is always read)
+    :return: iterator of (section, venue key, paper), where section is 'core' or 'extended'
     """
-    print('loading data...')
-    with gzip.open(data_path, 'rb') as f:
-        dataset = json.load(f)
+    venue_normalizer = get_venue_normalizer()
+    venue_set = set(venue for venue, _ in venue_normalizer.normalize_many(venues)) if venues is not None else None
+    year_set = set(years) if years is not None else None
+    sections = None if include_extended else {'core'}
 
-    print('generating paper list...')
-    core = defaultdict(list)
-    for venue, plist in dataset['core'].items():
-        for pdict in plist:
+    # with profiling on, split time between reading records and building
+    # papers (time spent by the consumer between yields is not counted)
+    profiling = PROFILER.enabled
+    mark = time.perf_counter() if profiling else 0.
+    with io.TextIOWrapper(gzip.open(data_path, 'rb'), encoding='utf-8') as f:
+        for section, venue_key, pdict in iter_grouped_records(f, sections):
+            if profiling:
+                now = time.perf_counter()
+                add_time('dataset.read_records', now - mark)
+                count('dataset.records')
+                mark = now
+            if venue_set is not None or year_set is not None:
+                try:
+                    venue, year = resolve_venue_year(pdict.get('doi'), pdict.get('venue'), pdict.get('year'))
+                except AttributeError:
+                    print('Error: ', pdict)
+                    count('dataset.errors')
+                    continue
+                if venue_set is not None and venue not in venue_set:
+                    count('dataset.filtered')
+                    continue
+                if year_set is not None and year not in year_set:
+                    count('dataset.filtered')
+                    continue
             try:
                 paper = Paper(**pdict)
-                core[venue].append(paper)
             except TypeError:
                 print('Error: ', pdict)
+                count('dataset.errors')
                 continue
-    extended = defaultdict(list)
-    for venue, plist in dataset['extended'].items():
-        for pdict in plist:
-            try:
-                paper = Paper(**pdict)
-                extended[venue].append(paper)
-            except TypeError:
-                print('Error: ', pdict)
+            if profiling:
+                add_time('dataset.build_papers', time.perf_counter() - mark)
+                count('dataset.papers')
+            yield section, venue_key, paper
+            if profiling:
+                mark = time.perf_counter()
+    # keep the raw venue strings learned on this pass for the next load
+    venue_normalizer.save_aliases()
+
+
+def load_dataset(
+        data_path=DATASET_PATH,
+        venues: Optional[Iterable[str]] = None,
+        years: Optional[Iterable[int]] = None,
+        include_extended: bool = True
+) -> Tuple[Dict, Dict, PaperLookup]:
+    """
+    Load a11y bibliometric dataset
+
+    Records of the same paper (sharing a pid, DOI or SHA) are merged into one
+    canonical Paper, which is what core/extended and the lookup hold; any id
+    of a merged record resolves to it in the lookup.
+
+    With venue/year filters, references and citations pointing outside the
+    filtered set will not resolve in the returned lookup.
+    :param data_path:
+    :param venues: keep only papers in these venues
+    :param years: keep only papers from these years
+    :param include_extended: also load the extended set
+    :return:
+    """
+    print('loading data...')
+    records = []
+    with phase('load_dataset.read'):
+        for section, venue_key, paper in iter_dataset(data_path, venues, years, include_extended):
+            if section not in ('core', 'extended'):
+                continue
+            records.append((section, venue_key, paper))
+
+    print('resolving paper ids...')
+    with phase('load_dataset.resolve'):
+        all_paper_list, aliases = resolve_papers([paper for _, _, paper in records])
+        count('dataset.merged_records', len(records) - len(all_paper_list))
+        # canonical papers in each venue group, each listed once
+        core = defaultdict(list)
+        extended = defaultdict(list)
+        seen = set()
+        for (section, venue_key, _), ind in zip(records, aliases.records):
+            if (section, venue_key, ind) in seen:
                 continue
+            seen.add((section, venue_key, ind))
+            (core if section == 'core' else extended)[venue_key].append(all_paper_list[ind])
+        del records, seen
 
     print('generate special a11y subsets...')
     a11y_assets = []
@@ -54,16 +135,119 @@ def load_dataset(data_path=DATASET_PATH) -> Tuple[Dict, Dict, PaperLookup]:
     core['a11y_assets'] = a11y_assets
     core['a11y_chi'] = a11y_chi
 
-    all_paper_list = flatten(core.values()) + flatten(extended.values())
-    all_paper_list = list(set(all_paper_list))
-
     print('forming lookup tables...')
-    lookup = PaperLookup(
-        paper_list=all_paper_list
-    )
+    with phase('load_dataset.lookup'):
+        lookup = PaperLookup(
+            paper_list=all_paper_list,
+            aliases=aliases
+        )
     return core, extended, lookup
 
 
+def build_dataset_store(
+        data_path=DATASET_PATH,
+        venues: Optional[Iterable[str]] = None,
+        years: Optional[Iterable[int]] = None,
+        include_extended: bool = True
+) -> PaperStore:
+    """
+    Stream the a11y bibliometric dataset into a PaperStore, without keeping Paper objects around.
+
+    Records of the same paper are merged as in load_dataset: a first pass over
+    the ids of every record groups them, and the second pass adds each
+    canonical paper once its last record has been read, so only the records of
+    partially read groups are kept. Rows are stored in the order of
+    load_dataset's lookup.papers, and every id of a merged record finds its row.
+    :param data_path:
+    :param venues: keep only papers in these venues
+    :param years: keep only papers from these years
+    :param include_extended: also load the extended set
+    :return:
+    """
+    def records():
+        for section, venue_key, paper in iter_dataset(data_path, venues, years, include_extended):
+            if section in ('core', 'extended'):
+                yield section, venue_key, paper
+
+    print('resolving paper ids...')
+    with phase('build_dataset_store.resolve'):
+        aliases = group_records((paper.pid, paper.doi, paper.sha) for _, _, paper in records())
+        num_records = len(aliases.records)
+        num_papers = max(aliases.records, default=-1) + 1
+        # last record of each canonical paper
+        last_record = np.zeros(num_papers, dtype=np.int64)
+        last_record[np.asarray(aliases.records, dtype=np.int64)] = np.arange(num_records)
+        count('dataset.merged_records', num_records - num_papers)
+
+    print('loading data...')
+    builder = PaperStoreBuilder()
+    # builder row of each canonical paper
+    rows = np.zeros(num_papers, dtype=np.int64)
+    pending = dict()
+    # canonical papers in each venue group, each listed once, at its first record
+    members = defaultdict(list)
+    seen = set()
+    for i, (section, venue_key, paper) in enumerate(records()):
+        ind = aliases.records[i]
+        if last_record[ind] != i:
+            pending.setdefault(ind, []).append(paper)
+        else:
+            rows[ind] = builder.add(merge_papers(pending.pop(ind, []) + [paper]))
+        if (section, venue_key, ind) not in seen:
+            seen.add((section, venue_key, ind))
+            members[(section, venue_key)].append(ind)
+    del seen
+    for (section, venue_key), inds in members.items():
+        for ind in inds:
+            builder.add_group_row(section, venue_key, rows[ind])
+    for name, alias_map in (('pid', aliases.pid_map), ('doi', aliases.doi_map), ('sha', aliases.sha_map)):
+        for key, ind in alias_map.items():
+            builder.add_alias(name, key, rows[ind])
+    del aliases
+
+    print('generate special a11y subsets...')
+    venues_table = builder.tables['venues'].strings
+    a11y_assets = []
+    a11y_chi = []
+    for ind in members[('core', 'a11y')]:
+        venue_ind = builder.columns['venue'][rows[ind]]
+        venue = venues_table[venue_ind] if venue_ind != NO_ID else None
+        if venue == 'conf/assets':
+            a11y_assets.append(rows[ind])
+        elif venue == 'conf/chi':
+            a11y_chi.append(rows[ind])
+        else:
+            print('Unknown venue! ', venue)
+    for row in a11y_assets:
+        builder.add_group_row('core', 'a11y_assets', row)
+    for row in a11y_chi:
+        builder.add_group_row('core', 'a11y_chi', row)
+
+    print('forming paper store...')
+    with phase('build_dataset_store.build'):
+        return builder.build(order=rows)
+
+
+def load_dataset_store(
+        data_path=DATASET_PATH,
+        venues: Optional[Iterable[str]] = None,
+        years: Optional[Iterable[int]] = None,
+        include_extended: bool = True
+) -> Tuple[Dict, Dict, StoreLookup]:
+    """
+    Load a11y bibliometric dataset into a compact array-backed PaperStore.
+    Same return values as load_dataset, with PaperViews in place of Papers.
+    :param data_path:
+    :param venues: keep only papers in these venues
+    :param years: keep only papers from these years
+    :param include_extended: also load the extended set
+    :return:
+    """
+    store = build_dataset_store(data_path, venues, years, include_extended)
+    core, extended = split_groups(store)
+    return core, extended, StoreLookup(store)
+
+
 if __name__ == '__main__':
     core_ds, extended_ds, lookup_dict = load_dataset()
     assets_papers = lookup_dict.get_papers_in_venue('conf/assets')
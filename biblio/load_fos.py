@@ -1,28 +1,184 @@
 import os, sys
 import json
 import gzip
+import shutil
+import functools
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from biblio.utils.hash_utils import hash_str
+from biblio.utils.cache_utils import file_stamp, make_tmp_dir, publish_dir
+from biblio.utils.profile_utils import PROFILER, count, phase
 
 
 MAG_FILE = 'data/analysis/a11y_biblioemtrics_mag_fos.jsonl.gz'
+MAG_CACHE_DIR = 'data/cache/mag'
+
+# bump when the cache layout changes
+MAG_CACHE_VERSION = 1
+
+MAG_CACHE_ARRAYS = [
+    'ids', 'levels',
+    'l0_ptr', 'l0_ind', 'l0_null', 'l0_parents', 'l0_bits',
+    'l1_ptr', 'l1_ind', 'l1_null', 'l1_parents', 'l1_bits'
+]
+
+
+def _encode_parents(ids: List[int], parent_dict: Dict) -> Dict[str, np.ndarray]:
+    """
+    Encode each FoS's parent list as CSR (ptr, ind, null mask for missing
+    lists) and as a bitset over all parents (bit k of row i set if ids[i] has
+    parent parents[k]), packed into uint64 words
+    :param ids:
+    :param parent_dict:
+    :return:
+    """
+    lists = [parent_dict[m] for m in ids]
+    ptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum([len(parent_list or []) for parent_list in lists])
+    ind = np.array([parent for parent_list in lists for parent in (parent_list or [])], dtype=np.int64)
+    null = np.array([parent_list is None for parent_list in lists], dtype=bool)
+
+    parents = np.unique(ind)
+    bits = np.zeros((len(ids), max(1, -(-len(parents) // 64))), dtype=np.uint64)
+    cols = np.searchsorted(parents, ind)
+    rows = np.repeat(np.arange(len(ids)), np.diff(ptr))
+    np.bitwise_or.at(bits, (rows, cols // 64), np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64)))
+    return {'ptr': ptr, 'ind': ind, 'null': null, 'parents': parents, 'bits': bits}
+
+
+def _bits_to_incidence(bits: np.ndarray) -> np.ndarray:
+    # one float column per bit, for computing shared parents with a matrix product
+    unpacked = np.unpackbits(np.ascontiguousarray(bits).view(np.uint8), axis=1, bitorder='little')
+    return unpacked.astype(np.float32)
 
 
 # create MAG FoS similarity lookup
 class MagLookup:
-    def __init__(self, mag_file=MAG_FILE):
+    """
+    MAG FoS hierarchy (levels 0-2) with parent lookups and FoS similarity.
+
+    The parsed hierarchy is cached in binary form under cache_dir (keyed by
+    the source file's size and mtime) and memory-mapped on later loads.
+    Ancestor sets are stored as uint64 bitsets, so two FoS share a parent
+    when the AND of their rows is nonzero.
+    """
+    def __init__(self, mag_file=MAG_FILE, cache_dir: Optional[str] = MAG_CACHE_DIR):
+        self.mag_file = mag_file
+        self.cache_dir = cache_dir
+        with phase('mag_lookup.load'):
+            if cache_dir:
+                arrays, names = self._load_cache()
+            else:
+                arrays, names = self._parse()
+        for key in MAG_CACHE_ARRAYS:
+            setattr(self, key, arrays[key])
+        self._names = names
+        # precomputed similarity over a FoS universe (see precompute_sim)
+        self.sim_ids = None
+        self.sim_index = None
+        self.sim_values = None
+        self._sim_matrix_cache = None
+
+    def _parse(self) -> Tuple[Dict[str, np.ndarray], List[str]]:
         l0_lookup = dict()
         l1_lookup = dict()
         name_lookup = dict()
-        with gzip.open(mag_file, 'rb') as f:
+        levels = dict()
+        with gzip.open(self.mag_file, 'rb') as f:
             for line in f:
                 entry = json.loads(line)
                 if entry['level'] <= 2:
                     l0_lookup[entry['mag_id']] = entry['l0_parent']
                     l1_lookup[entry['mag_id']] = entry['l1_parent']
-                if entry['level'] <= 2:
                     name_lookup[entry['mag_id']] = entry['normalizedname']
-        self.l0_dict = l0_lookup
-        self.l1_dict = l1_lookup
-        self.name_dict = name_lookup
+                    levels[entry['mag_id']] = entry['level']
+        ids = sorted(name_lookup.keys())
+        arrays = {
+            'ids': np.array(ids, dtype=np.int64),
+            'levels': np.array([levels[m] for m in ids], dtype=np.int8)
+        }
+        for prefix, parent_dict in (('l0', l0_lookup), ('l1', l1_lookup)):
+            for key, value in _encode_parents(ids, parent_dict).items():
+                arrays[f'{prefix}_{key}'] = value
+        return arrays, [name_lookup[m] for m in ids]
+
+    def _cache_subdir(self) -> str:
+        stamp = file_stamp(self.mag_file)
+        source_key = hash_str(stamp['source']) & 0xffffffff
+        return os.path.join(
+            self.cache_dir,
+            f"{source_key:08x}-v{MAG_CACHE_VERSION}-{stamp['size']}-{stamp['mtime_ns']}"
+        )
+
+    def _load_cache(self) -> Tuple[Dict[str, np.ndarray], Optional[List[str]]]:
+        cache_subdir = self._cache_subdir()
+        if not os.path.exists(os.path.join(cache_subdir, 'meta.json')):
+            print('caching mag hierarchy...')
+            arrays, names = self._parse()
+            tmp_dir = make_tmp_dir(cache_subdir)
+            for key in MAG_CACHE_ARRAYS:
+                np.save(os.path.join(tmp_dir, f'{key}.npy'), arrays[key])
+            with open(os.path.join(tmp_dir, 'names.json'), 'w') as outf:
+                json.dump(names, outf)
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as outf:
+                json.dump(dict(file_stamp(self.mag_file), version=MAG_CACHE_VERSION, num_fos=len(names)), outf)
+            publish_dir(tmp_dir, cache_subdir)
+            # drop caches built from older versions of the same source file
+            source_key = os.path.basename(cache_subdir).split('-')[0]
+            for entry in os.listdir(self.cache_dir):
+                entry_path = os.path.join(self.cache_dir, entry)
+                if entry_path != cache_subdir and entry.startswith(source_key + '-'):
+                    shutil.rmtree(entry_path, ignore_errors=True)
+            return arrays, names
+        arrays = {
+            key: np.load(os.path.join(cache_subdir, f'{key}.npy'), mmap_mode='r')
+            for key in MAG_CACHE_ARRAYS
+        }
+        # names are only read when first needed
+        return arrays, None
+
+    @property
+    def names(self) -> List[str]:
+        if self._names is None:
+            with open(os.path.join(self._cache_subdir(), 'names.json'), 'r') as f:
+                self._names = json.load(f)
+        return self._names
+
+    def _rows(self, ids) -> np.ndarray:
+        """
+        Row of each FoS id, or -1 if not in the hierarchy
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, ids)
+        rows[rows == len(self.ids)] = 0
+        found = self.ids[rows] == ids if len(self.ids) else np.zeros(len(ids), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def _row(self, m: int) -> int:
+        row = int(np.searchsorted(self.ids, m))
+        return row if row < len(self.ids) and self.ids[row] == m else -1
+
+    def _parent_list(self, prefix: str, row: int) -> Optional[List[int]]:
+        if row < 0 or getattr(self, f'{prefix}_null')[row]:
+            return None
+        ptr = getattr(self, f'{prefix}_ptr')
+        return getattr(self, f'{prefix}_ind')[ptr[row]:ptr[row + 1]].tolist()
+
+    # full id -> value dicts, built once on first access; get_l0/get_l1/get_name
+    # answer single lookups without them
+    @functools.cached_property
+    def l0_dict(self) -> Dict[int, List[int]]:
+        return {int(m): self._parent_list('l0', row) for row, m in enumerate(self.ids)}
+
+    @functools.cached_property
+    def l1_dict(self) -> Dict[int, List[int]]:
+        return {int(m): self._parent_list('l1', row) for row, m in enumerate(self.ids)}
+
+    @functools.cached_property
+    def name_dict(self) -> Dict[int, str]:
+        return dict(zip(self.ids.tolist(), self.names))
 
     def get_name(self, m: int) -> str:
         """
@@ -30,7 +186,8 @@ class MagLookup:
         :param m:
         :return:
         """
-        return self.name_dict.get(m, None)
+        row = self._row(m)
+        return self.names[row] if row >= 0 else None
 
     def get_l0(self, m: int) -> int:
         """
@@ -38,7 +195,7 @@ class MagLookup:
         :param m:
         :return:
         """
-        return self.l0_dict.get(m, None)
+        return self._parent_list('l0', self._row(m))
 
     def get_l1(self, m: int) -> int:
         """
@@ -46,7 +203,123 @@ class MagLookup:
         :param m:
         :return:
         """
-        return self.l1_dict.get(m, None)
+        return self._parent_list('l1', self._row(m))
+
+    def _get_parents_many(self, prefix: str, ids: Iterable[int], first: bool):
+        rows = self._rows(list(ids))
+        if not first:
+            return [self._parent_list(prefix, int(row)) for row in rows]
+        ptr = np.asarray(getattr(self, f'{prefix}_ptr'))
+        ind = getattr(self, f'{prefix}_ind')
+        safe_rows = np.maximum(rows, 0)
+        has_parent = (rows >= 0) & (ptr[safe_rows + 1] > ptr[safe_rows])
+        firsts = np.full(len(rows), -1, dtype=np.int64)
+        firsts[has_parent] = ind[ptr[safe_rows[has_parent]]]
+        return firsts
+
+    def get_l0_many(self, ids: Iterable[int], first: bool = False):
+        """
+        Batch get_l0
+        :param ids:
+        :param first: return only the first l0 FoS of each id, as an array (-1 if none)
+        :return:
+        """
+        return self._get_parents_many('l0', ids, first)
+
+    def get_l1_many(self, ids: Iterable[int], first: bool = False):
+        """
+        Batch get_l1
+        :param ids:
+        :param first: return only the first l1 FoS of each id, as an array (-1 if none)
+        :return:
+        """
+        return self._get_parents_many('l1', ids, first)
+
+    def _shared_parents(self, bits: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        Boolean matrix with [i, j] set if rows[i] and rows[j] share a parent (False for unknown rows)
+        """
+        row_bits = np.where((rows >= 0)[:, None], bits[np.maximum(rows, 0)], np.uint64(0))
+        incidence = _bits_to_incidence(row_bits)
+        return (incidence @ incidence.T) > 0
+
+    def compute_sim_matrix(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Dense similarity matrix between the given FoS ids (same values as sim)
+        :param ids:
+        :return:
+        """
+        ids = list(ids)
+        rows = self._rows(ids)
+        # no parents in common, 1/(2^3)
+        sim = np.full((len(ids), len(ids)), 0.125)
+        sim[self._shared_parents(self.l0_bits, rows)] = 0.25
+        sim[self._shared_parents(self.l1_bits, rows)] = 0.5
+        ids_arr = np.array(ids)
+        sim[ids_arr[:, None] == ids_arr[None, :]] = 1.
+        return sim
+
+    def precompute_sim(self, ids: Iterable[int]):
+        """
+        Precompute similarities among a FoS universe (e.g. all L1 ids of interest);
+        sim, sim_many and sim_matrix then become array lookups for these ids
+        :param ids:
+        :return:
+        """
+        with phase('mag_lookup.precompute_sim'):
+            self.sim_ids = np.array(sorted(set(ids)), dtype=np.int64)
+            self.sim_index = {int(m): i for i, m in enumerate(self.sim_ids)}
+            self.sim_values = self.compute_sim_matrix(self.sim_ids.tolist())
+            self._sim_matrix_cache = None
+
+    def _universe_rows(self, ids: List[int]) -> Optional[np.ndarray]:
+        if self.sim_index is None:
+            return None
+        rows = [self.sim_index.get(m, -1) for m in ids]
+        if -1 in rows:
+            return None
+        return np.array(rows, dtype=np.int64)
+
+    def sim_matrix(self, ids: Iterable[int]) -> np.ndarray:
+        """
+        Similarity matrix between the given FoS ids, with rows/columns in the order given
+        :param ids:
+        :return:
+        """
+        ids = tuple(ids)
+        # LCDI asks for the same id order for every paper
+        if self._sim_matrix_cache is not None and self._sim_matrix_cache[0] == ids:
+            count('mag.sim_matrix_cache_hits')
+            return self._sim_matrix_cache[1]
+        count('mag.sim_matrix_computed')
+        rows = self._universe_rows(list(ids))
+        if rows is not None:
+            matrix = self.sim_values[np.ix_(rows, rows)]
+        else:
+            matrix = self.compute_sim_matrix(ids)
+        self._sim_matrix_cache = (ids, matrix)
+        return matrix
+
+    def sim_many(self, a_ids: Iterable[int], b_ids: Iterable[int]) -> np.ndarray:
+        """
+        Elementwise similarity of two equal-length sequences of FoS ids
+        :param a_ids:
+        :param b_ids:
+        :return:
+        """
+        a_ids = np.asarray(list(a_ids), dtype=np.int64)
+        b_ids = np.asarray(list(b_ids), dtype=np.int64)
+        uniq = np.unique(np.concatenate([a_ids, b_ids]))
+        rows = self._universe_rows(uniq.tolist())
+        if rows is not None:
+            values = self.sim_values
+            a_rows = rows[np.searchsorted(uniq, a_ids)]
+            b_rows = rows[np.searchsorted(uniq, b_ids)]
+        else:
+            values = self.compute_sim_matrix(uniq.tolist())
+            a_rows = np.searchsorted(uniq, a_ids)
+            b_rows = np.searchsorted(uniq, b_ids)
+        return values[a_rows, b_rows]
 
     def sim(self, m1: int, m2: int) -> float:
         """
@@ -55,21 +328,30 @@ class MagLookup:
         :param m2:
         :return:
         """
+        if PROFILER.enabled:
+            count('mag.sim_calls')
+        if self.sim_index is not None:
+            r1 = self.sim_index.get(m1)
+            r2 = self.sim_index.get(m2)
+            if r1 is not None and r2 is not None:
+                return float(self.sim_values[r1, r2])
+
         # same, similarity = 1
         if m1 == m2:
             return 1.
 
+        r1 = self._row(m1)
+        r2 = self._row(m2)
+        if r1 < 0 or r2 < 0:
+            return 0.125
+
         # check l1 fos
-        m1_l1 = self.l1_dict.get(m1, [])
-        m2_l1 = self.l1_dict.get(m2, [])
-        if m1_l1 and m2_l1 and set(m1_l1) & set(m2_l1):
+        if np.any(self.l1_bits[r1] & self.l1_bits[r2]):
             return 0.5
 
         # check l0 fos
-        m1_l0 = self.l0_dict.get(m1, [])
-        m2_l0 = self.l0_dict.get(m2, [])
-        if m1_l0 and m2_l0 and set(m1_l0) & set(m2_l0):
+        if np.any(self.l0_bits[r1] & self.l0_bits[r2]):
             return 0.25
 
         # no parents in common, return 1/(2^3)
-        return 0.125
\ No newline at end of file
+        return 0.125
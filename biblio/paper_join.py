@@ -0,0 +1,205 @@
+"""
+Join external paper-level tables (e.g. data/a11y_survey_quant_dataset.csv,
+keyed by DOI) onto the papers of a lookup (PaperLookup, StoreLookup or
+SqliteLookup).
+
+The key column is normalized in one vectorized pass (DOIs and SHAs are
+stripped and lowercased, doi.org prefixes removed; pids are parsed as
+integers) and matched against one hash index of the lookup's keys, built on
+first use and kept for the lifetime of the lookup, e.g.
+
+    survey, unmatched = join_papers(lookup, SURVEY_FILE, key='doi')
+"""
+
+import os, sys
+import weakref
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from biblio.papers import PaperLookup
+from biblio.paper_store import NO_ID
+
+
+SURVEY_FILE = 'data/a11y_survey_quant_dataset.csv'
+
+JOIN_KEYS = ('pid', 'doi', 'sha')
+# paper attributes at the front of a joined frame, after the dense paper id
+PAPER_COLUMNS = ['pid', 'doi', 'sha', 'title', 'venue', 'year']
+# string dtype (missing values are pd.NA) on every backend
+STRING_COLUMNS = ['doi', 'sha', 'title', 'venue']
+DOI_PREFIX_PATTERN = r'^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)'
+
+# lookup -> key -> pd.Series of paper ids indexed by key
+_KEY_INDEXES = weakref.WeakKeyDictionary()
+
+
+def normalize_keys(values: pd.Series, key: str) -> pd.Series:
+    """
+    Normalize a column of pids, DOIs or SHAs the way the lookups compare them
+    :param values:
+    :param key: 'pid', 'doi' or 'sha'
+    :return: int64 pids (Int64, NA if missing or not an integer) or lowercase strings (NA if missing)
+    """
+    if key == 'pid':
+        pids = pd.to_numeric(values, errors='coerce')
+        pids = pids.where(pids == np.floor(pids))
+        return pids.astype('Int64')
+    keys = values.astype('string').str.strip().str.lower()
+    if key == 'doi':
+        keys = keys.str.replace(DOI_PREFIX_PATTERN, '', regex=True)
+    return keys.mask(keys == '')
+
+
+def _table_strings(table, inds: np.ndarray) -> np.ndarray:
+    # decode each distinct string of an interned table once; None for NO_ID
+    uniq, inverse = np.unique(inds, return_inverse=True)
+    return np.array([table[ind] for ind in uniq], dtype=object)[inverse.reshape(-1)]
+
+
+def _build_key_index(lookup: PaperLookup, key: str) -> pd.Series:
+    store = getattr(lookup, 'store', None)
+    if store is not None:
+        # the store's id index, which also holds the ids of merged records
+        ids = np.asarray(store.columns[f'index_{key}_rows'], dtype=np.int64)
+        if key == 'pid':
+            keys = np.asarray(store.columns['index_pid_keys'])
+        else:
+            keys = _table_strings(store.tables[f'{key}s'], np.asarray(store.columns[f'index_{key}_strs']))
+    else:
+        ids_by_key = getattr(lookup, f'{key}_dict')
+        keys = list(ids_by_key)
+        ids = np.fromiter((lookup.get_paper_id(p) for p in ids_by_key.values()), dtype=np.int64, count=len(keys))
+    index = pd.Series(ids, index=pd.Index(keys))
+    # the last paper with a key wins, as in the lookups
+    return index[~index.index.duplicated(keep='last')]
+
+
+def key_index(lookup: PaperLookup, key: str) -> pd.Series:
+    """
+    Hash index from a pid, DOI or SHA to the dense paper id (built on first use)
+    :param lookup: PaperLookup or StoreLookup
+    :param key:
+    :return: Series of paper ids indexed by key
+    """
+    indexes = _KEY_INDEXES.setdefault(lookup, dict())
+    if key not in indexes:
+        indexes[key] = _build_key_index(lookup, key)
+    return indexes[key]
+
+
+def resolve_keys(lookup: PaperLookup, keys: pd.Series, key: str) -> np.ndarray:
+    """
+    Dense paper ids of normalized keys
+    :param lookup:
+    :param keys: output of normalize_keys
+    :param key: 'pid', 'doi' or 'sha'
+    :return: paper ids (-1 where missing or unmatched)
+    """
+    codes, uniq = pd.factorize(keys)
+    if hasattr(lookup, 'get_paper_ids_by_triples'):
+        # database-backed lookup: resolve the distinct keys in a few queries
+        slot = JOIN_KEYS.index(key)
+        triples = [[k if i == slot else None for i in range(3)] for k in uniq.tolist()]
+        uniq_ids = np.array(lookup.get_paper_ids_by_triples(triples), dtype=np.int64)
+    else:
+        index = key_index(lookup, key)
+        positions = index.index.get_indexer(uniq)
+        uniq_ids = np.where(positions >= 0, index.to_numpy()[positions], NO_ID)
+    return np.where(codes >= 0, np.append(uniq_ids, NO_ID)[codes], NO_ID)
+
+
+def paper_attributes(lookup: PaperLookup, ids: np.ndarray) -> pd.DataFrame:
+    """
+    pid, DOI, SHA, title, venue and year of papers given by dense id
+    :param lookup:
+    :param ids: paper ids (all >= 0)
+    :return: DataFrame with one row per id and columns PAPER_COLUMNS (pid and year Int64,
+        the others string, missing values pd.NA on every backend)
+    """
+    store = getattr(lookup, 'store', None)
+    if store is not None:
+        cols = store.columns
+        pids = np.asarray(cols['pid'])[ids]
+        years = np.asarray(cols['year'])[ids].astype(np.int64)
+        data = {'pid': pd.array(np.where(pids != NO_ID, pids, 0), dtype='Int64')}
+        data['pid'][pids == NO_ID] = pd.NA
+        for name in STRING_COLUMNS:
+            data[name] = pd.array(_table_strings(store.tables[f'{name}s'], np.asarray(cols[name])[ids]), dtype='string')
+        data['year'] = pd.array(np.where(years > 0, years, 0), dtype='Int64')
+        data['year'][years <= 0] = pd.NA
+        return pd.DataFrame(data)[PAPER_COLUMNS]
+    if hasattr(lookup, 'get_papers_by_ids'):
+        papers = lookup.get_papers_by_ids(ids.tolist())
+    else:
+        papers = [lookup.papers[i] for i in ids]
+    data = {'pid': pd.array([p.pid for p in papers], dtype='Int64')}
+    for name in STRING_COLUMNS:
+        data[name] = pd.array([getattr(p, name) for p in papers], dtype='string')
+    data['year'] = pd.array([p.year if p.year else None for p in papers], dtype='Int64')
+    return pd.DataFrame(data)[PAPER_COLUMNS]
+
+
+def _find_key_column(table: pd.DataFrame, key: str) -> str:
+    # the column named like the key, ignoring case (e.g. DOI)
+    for column in table.columns:
+        if str(column).strip().lower() == key:
+            return column
+    raise ValueError(f'no {key} column in {list(table.columns)}; pass key_column')
+
+
+def join_papers(
+        lookup: PaperLookup,
+        table: Union[pd.DataFrame, str],
+        key: str = 'doi',
+        key_column: Optional[str] = None,
+        how: str = 'inner',
+        suffix: str = '_ext',
+        verbose: bool = True
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Attach the papers of a lookup to the rows of an external per-paper table
+    :param lookup:
+    :param table: DataFrame or path of a CSV file
+    :param key: 'pid', 'doi' or 'sha'
+    :param key_column: column of table holding the key (default the column named like key, ignoring case)
+    :param how: 'inner' (matched rows only) or 'left' (every row, with missing paper attributes if unmatched)
+    :param suffix: appended to external columns named like a paper attribute (e.g. title)
+    :param verbose: print the number of unmatched rows and a few of their keys
+    :return: joined frame (columns paper, PAPER_COLUMNS and the external columns, in the row order of table)
+        and the unmatched rows of table (with their normalized key in a 'key' column)
+    """
+    if key not in JOIN_KEYS:
+        raise ValueError(f'key must be one of {JOIN_KEYS}, got {key!r}')
+    if how not in ('inner', 'left'):
+        raise ValueError(f"how must be 'inner' or 'left', got {how!r}")
+    if isinstance(table, str):
+        # utf-8-sig drops the byte order mark of files exported from Excel
+        table = pd.read_csv(table, encoding='utf-8-sig')
+    if key_column is None:
+        key_column = _find_key_column(table, key)
+    table = table.reset_index(drop=True)
+
+    keys = normalize_keys(table[key_column], key)
+    ids = resolve_keys(lookup, keys, key)
+    matched = ids != NO_ID
+
+    unmatched = table[~matched].assign(key=keys[~matched])
+    if verbose and len(unmatched):
+        missing = int(unmatched['key'].isna().sum())
+        examples = unmatched['key'].dropna().unique()[:5].tolist()
+        print(f'{len(unmatched)} of {len(table)} rows unmatched by {key} '
+              f'({missing} without a key){", e.g. " + ", ".join(map(str, examples)) if examples else ""}')
+
+    rows = np.arange(len(table)) if how == 'left' else np.flatnonzero(matched)
+    joined = pd.DataFrame({'paper': pd.array(np.where(matched[rows], ids[rows], 0), dtype='Int64')})
+    joined.loc[~matched[rows], 'paper'] = pd.NA
+    attributes = paper_attributes(lookup, ids[rows][matched[rows]])
+    attributes.index = np.flatnonzero(matched[rows])
+    joined = joined.join(attributes)
+    external = table.iloc[rows].reset_index(drop=True)
+    external.columns = [
+        f'{column}{suffix}' if column in joined.columns else column for column in external.columns
+    ]
+    return pd.concat([joined, external], axis=1), unmatched
@@ -0,0 +1,784 @@
+import os, sys
+import json
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Iterator, Sequence, Callable, Union
+
+import numpy as np
+
+from biblio.papers import Paper, get_venue_normalizer
+from biblio.citation_graph import CitationGraph
+from biblio.utils.hash_utils import hash_str, hash_strs
+from biblio.utils.profile_utils import PROFILER, count
+
+
+# stored in integer columns for missing ids, years and string references
+NO_ID = -1
+
+# (name, dtype) of every array column in a store
+STORE_COLUMNS = [
+    ('pid', np.int64),
+    ('doi', np.int32),
+    ('sha', np.int32),
+    ('title', np.int32),
+    ('venue', np.int32),
+    ('year', np.int16),
+    ('fos_ptr', np.int64),
+    ('fos_id', np.int64),
+    ('fos_score', np.float64),
+    ('fos_meta', np.int32),
+    ('fos_level', np.int8),
+] + [
+    (f'{direction}_{field}', dtype)
+    for direction in ('refs', 'cits')
+    for field, dtype in (('ptr', np.int64), ('pid', np.int64), ('doi', np.int32), ('sha', np.int32), ('row', np.int32))
+] + [
+    ('index_pid_keys', np.int64),
+    ('index_pid_rows', np.int32),
+    ('index_doi_keys', np.uint64),
+    ('index_doi_rows', np.int32),
+    ('index_doi_strs', np.int32),
+    ('index_sha_keys', np.uint64),
+    ('index_sha_rows', np.int32),
+    ('index_sha_strs', np.int32),
+    ('group_ptr', np.int64),
+    ('group_rows', np.int32),
+]
+
+# interned string tables in a store
+STORE_TABLES = ['dois', 'shas', 'titles', 'venues', 'fos_meta']
+
+
+class StringTableBuilder:
+    """
+    Interns strings while a store is built; each distinct string is stored once
+    """
+    def __init__(self):
+        self.index = dict()
+        self.strings = []
+
+    def add(self, s: Optional[str]) -> int:
+        if s is None:
+            return NO_ID
+        ind = self.index.get(s)
+        if ind is None:
+            ind = len(self.strings)
+            self.index[s] = ind
+            self.strings.append(s)
+        return ind
+
+    def build(self) -> 'StringTable':
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return StringTable(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+
+class StringTable:
+    """
+    Read-only string table stored as one utf-8 blob plus offsets
+    """
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+        self._reverse = None
+
+    @classmethod
+    def load(cls, store_dir: str, name: str, mmap_mode: Optional[str] = 'r') -> 'StringTable':
+        return cls(
+            np.load(os.path.join(store_dir, f'{name}.offsets.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(store_dir, f'{name}.blob.npy'), mmap_mode=mmap_mode)
+        )
+
+    def save(self, out_dir: str, name: str):
+        np.save(os.path.join(out_dir, f'{name}.offsets.npy'), self.offsets)
+        np.save(os.path.join(out_dir, f'{name}.blob.npy'), self.blob)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, ind: int) -> Optional[str]:
+        if ind < 0:
+            return None
+        return bytes(self.blob[self.offsets[ind]:self.offsets[ind + 1]]).decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, s: str) -> int:
+        """
+        Index of a string (builds a reverse map on first use; meant for small tables)
+        :param s:
+        :return:
+        """
+        if self._reverse is None:
+            self._reverse = {value: i for i, value in enumerate(self)}
+        return self._reverse.get(s, NO_ID)
+
+
+class _LazyArrays(dict):
+    """
+    Dict that loads missing entries on first access
+    """
+    def __init__(self, load_fn: Callable):
+        super().__init__()
+        self.load_fn = load_fn
+
+    def __missing__(self, name):
+        value = self.load_fn(name)
+        self[name] = value
+        return value
+
+
+def _match_sorted(keys: np.ndarray, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Vectorized lookup of queries in sorted keys; the last duplicate key wins,
+    as with repeated dict assignment. NO_ID where there is no match.
+    """
+    out = np.full(len(queries), NO_ID, dtype=np.int32)
+    if not len(keys) or not len(queries):
+        return out
+    inds = np.searchsorted(keys, queries, side='right') - 1
+    valid = inds >= 0
+    valid[valid] = keys[inds[valid]] == queries[valid]
+    out[valid] = rows[inds[valid]]
+    return out
+
+
+def _take_ragged(ptr: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Offsets and entry positions of the CSR-style entries of rows, in the order of rows
+    """
+    lengths = np.diff(ptr)[rows]
+    new_ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_ptr[1:])
+    positions = np.repeat(ptr[rows] - new_ptr[:-1], lengths) + np.arange(new_ptr[-1], dtype=np.int64)
+    return new_ptr, positions
+
+
+class PaperStore:
+    """
+    Struct-of-arrays storage for papers. Each paper is a row: ids, venue and
+    year are columns (strings interned into tables), FoS entries and refs/cits
+    are CSR-style (per-row offsets into flat entry columns), and every ref/cit
+    is pre-resolved to the row it points at. Columns may be in-memory arrays or
+    memory-mapped from a directory written by save.
+    """
+    def __init__(self, columns: Dict[str, np.ndarray], tables: Dict[str, StringTable], groups: List):
+        self.columns = columns
+        self.tables = tables
+        self.groups = groups
+        self._num_papers = None
+        self._fos_meta = None
+
+    @classmethod
+    def load(cls, store_dir: str, groups: List, mmap_mode: Optional[str] = 'r') -> 'PaperStore':
+        """
+        Open a saved store; columns are only loaded (mapped) when first touched
+        :param store_dir:
+        :param groups:
+        :param mmap_mode:
+        :return:
+        """
+        return cls(
+            _LazyArrays(lambda name: np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode=mmap_mode)),
+            _LazyArrays(lambda name: StringTable.load(store_dir, name, mmap_mode)),
+            groups
+        )
+
+    def save(self, out_dir: str):
+        """
+        Write all columns and tables as .npy files in out_dir
+        :param out_dir:
+        :return:
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        for name, _ in STORE_COLUMNS:
+            np.save(os.path.join(out_dir, f'{name}.npy'), self.columns[name])
+        for name in STORE_TABLES:
+            self.tables[name].save(out_dir, name)
+
+    def __len__(self) -> int:
+        if self._num_papers is None:
+            self._num_papers = len(self.columns['pid'])
+        return self._num_papers
+
+    def fos_meta(self) -> List[List]:
+        """
+        Decoded metadata (name, display name) of every fos_meta table entry, decoded once per store
+        :return:
+        """
+        if self._fos_meta is None:
+            self._fos_meta = [json.loads(meta) for meta in self.tables['fos_meta']]
+        return self._fos_meta
+
+    def nbytes(self) -> int:
+        """
+        Total size of all columns and string tables
+        :return:
+        """
+        return sum(self.columns[name].nbytes for name, _ in STORE_COLUMNS) + \
+            sum(self.tables[name].offsets.nbytes + self.tables[name].blob.nbytes for name in STORE_TABLES)
+
+    def view(self, row: int) -> 'PaperView':
+        return PaperView(self, row)
+
+    def group_rows(self, group_ind: int) -> np.ndarray:
+        group_ptr = self.columns['group_ptr']
+        return self.columns['group_rows'][group_ptr[group_ind]:group_ptr[group_ind + 1]]
+
+    def _find_row(self, index_name: str, key, value: Optional[str] = None) -> int:
+        keys = self.columns[f'index_{index_name}_keys']
+        rows = self.columns[f'index_{index_name}_rows']
+        lo = int(np.searchsorted(keys, key, side='left'))
+        hi = int(np.searchsorted(keys, key, side='right'))
+        # last match wins, as in PaperLookup; compare strings to rule out hash collisions
+        for ind in range(hi - 1, lo - 1, -1):
+            if value is None or self.tables[f'{index_name}s'][self.columns[f'index_{index_name}_strs'][ind]] == value:
+                return int(rows[ind])
+        return NO_ID
+
+    def find_pid(self, pid: int) -> int:
+        return self._find_row('pid', np.int64(pid))
+
+    def find_doi(self, doi: str) -> int:
+        doi = doi.lower()
+        return self._find_row('doi', np.uint64(hash_str(doi)), doi)
+
+    def find_sha(self, sha: str) -> int:
+        sha = sha.lower()
+        return self._find_row('sha', np.uint64(hash_str(sha)), sha)
+
+    def find_triple(self, paper_ids) -> int:
+        """
+        Row of a [pid, doi, sha] triple, matching on pid, then DOI, then SHA
+        :param paper_ids:
+        :return:
+        """
+        pid, doi, sha = paper_ids
+        row = NO_ID
+        if pid:
+            row = self.find_pid(int(pid))
+        if row == NO_ID and doi:
+            row = self.find_doi(doi)
+        if row == NO_ID and sha:
+            row = self.find_sha(sha)
+        return row
+
+    def resolve_triples(self, pids: np.ndarray, doi_inds: np.ndarray, sha_inds: np.ndarray) -> np.ndarray:
+        """
+        Vectorized find_triple over edge columns (pids, and DOI/SHA indexes into this store's tables)
+        :param pids:
+        :param doi_inds:
+        :param sha_inds:
+        :return: rows (NO_ID where unresolved)
+        """
+        rows = np.full(len(pids), NO_ID, dtype=np.int32)
+        has_pid = pids != NO_ID
+        rows[has_pid] = _match_sorted(
+            self.columns['index_pid_keys'], self.columns['index_pid_rows'], pids[has_pid]
+        )
+        for name, inds in (('doi', doi_inds), ('sha', sha_inds)):
+            todo = (rows == NO_ID) & (inds != NO_ID)
+            if not todo.any():
+                continue
+            # hash each distinct table entry once
+            uniq, inverse = np.unique(inds[todo], return_inverse=True)
+            table = self.tables[f'{name}s']
+            hashes = hash_strs(table[ind].lower() for ind in uniq)
+            rows[todo] = _match_sorted(
+                self.columns[f'index_{name}_keys'], self.columns[f'index_{name}_rows'], hashes[inverse]
+            )
+        return rows
+
+
+class PaperStoreBuilder:
+    """
+    Accumulates papers row by row into compact typed arrays, then builds a PaperStore
+    """
+    def __init__(self):
+        self.tables = {name: StringTableBuilder() for name in STORE_TABLES}
+        self.columns = {name: array(np.dtype(dtype).char) for name, dtype in STORE_COLUMNS}
+        for name in ('fos_ptr', 'refs_ptr', 'cits_ptr'):
+            self.columns[name].append(0)
+        self.row_by_ids = dict()
+        self.groups = []
+        self.group_rows = defaultdict(list)
+        # other ids of merged papers: pids, or DOI/SHA table indexes, and their rows
+        self.alias_keys = {'pid': array('q'), 'doi': array('i'), 'sha': array('i')}
+        self.alias_rows = {name: array('i') for name in self.alias_keys}
+
+    def add(self, paper: Paper) -> int:
+        """
+        Add a paper (exact duplicates by pid/doi/sha are stored once)
+        :param paper:
+        :return: row of the paper
+        """
+        paper_ids = (paper.pid, paper.doi, paper.sha)
+        row = self.row_by_ids.get(paper_ids)
+        if row is not None:
+            return row
+        row = len(self.row_by_ids)
+        self.row_by_ids[paper_ids] = row
+
+        cols = self.columns
+        tables = self.tables
+        cols['pid'].append(int(paper.pid) if paper.pid else NO_ID)
+        cols['doi'].append(tables['dois'].add(paper.doi))
+        cols['sha'].append(tables['shas'].add(paper.sha))
+        cols['title'].append(tables['titles'].add(paper.title))
+        cols['venue'].append(tables['venues'].add(paper.venue))
+        cols['year'].append(int(paper.year) if paper.year else NO_ID)
+
+        for entry in (paper.fos or []):
+            cols['fos_id'].append(entry[0])
+            cols['fos_score'].append(entry[1])
+            # name and any other metadata between score and level
+            cols['fos_meta'].append(tables['fos_meta'].add(json.dumps(entry[2:-1])))
+            cols['fos_level'].append(entry[-1])
+        cols['fos_ptr'].append(len(cols['fos_id']))
+
+        for direction, edges in (('refs', paper.refs), ('cits', paper.cits)):
+            for pid, doi, sha in edges:
+                cols[f'{direction}_pid'].append(int(pid) if pid else NO_ID)
+                cols[f'{direction}_doi'].append(tables['dois'].add(doi if doi else None))
+                cols[f'{direction}_sha'].append(tables['shas'].add(sha if sha else None))
+            cols[f'{direction}_ptr'].append(len(cols[f'{direction}_pid']))
+        return row
+
+    def add_to_group(self, section: str, venue_key: str, paper: Paper):
+        """
+        Add a paper and record it as a member of dataset[section][venue_key]
+        :param section: 'core' or 'extended'
+        :param venue_key:
+        :param paper:
+        :return:
+        """
+        self.add_group_row(section, venue_key, self.add(paper))
+
+    def add_group_row(self, section: str, venue_key: str, row: int):
+        """
+        Record an added paper, given by row, as a member of dataset[section][venue_key]
+        :param section: 'core' or 'extended'
+        :param venue_key:
+        :param row:
+        :return:
+        """
+        group = (section, venue_key)
+        if group not in self.group_rows:
+            self.groups.append(list(group))
+        self.group_rows[group].append(row)
+
+    def add_alias(self, name: str, key: Union[int, str], row: int):
+        """
+        Make another id of a merged paper find its row (ids of the paper itself are always indexed)
+        :param name: 'pid', 'doi' or 'sha'
+        :param key:
+        :param row:
+        :return:
+        """
+        key = int(key) if name == 'pid' else self.tables[f'{name}s'].add(key)
+        if self.columns[name][row] == key:
+            return
+        self.alias_keys[name].append(key)
+        self.alias_rows[name].append(row)
+
+    def build(self, order: Optional[np.ndarray] = None) -> PaperStore:
+        """
+        Finalize arrays, build id indexes and resolve refs/cits to rows
+        :param order: rows as added, in the order to store them (default the order they were added)
+        :return:
+        """
+        columns = {
+            name: np.frombuffer(self.columns[name], dtype=dtype) if len(self.columns[name])
+            else np.zeros(0, dtype=dtype)
+            for name, dtype in STORE_COLUMNS
+        }
+        tables = {name: builder.build() for name, builder in self.tables.items()}
+        num_papers = len(columns['pid'])
+        all_rows = np.arange(num_papers, dtype=np.int32)
+        # stored row of each added row
+        new_rows = all_rows
+        if order is not None:
+            order = np.asarray(order, dtype=np.int64)
+            new_rows = np.empty(num_papers, dtype=np.int32)
+            new_rows[order] = all_rows
+            for name in ('pid', 'doi', 'sha', 'title', 'venue', 'year'):
+                columns[name] = columns[name][order]
+            for prefix, fields in (('fos', ('id', 'score', 'meta', 'level')), ('refs', ('pid', 'doi', 'sha')),
+                                   ('cits', ('pid', 'doi', 'sha'))):
+                columns[f'{prefix}_ptr'], positions = _take_ragged(columns[f'{prefix}_ptr'], order)
+                for field in fields:
+                    columns[f'{prefix}_{field}'] = columns[f'{prefix}_{field}'][positions]
+
+        # id indexes, with aliases after the papers' own ids; stable sort keeps the
+        # last duplicate last, matching PaperLookup dicts
+        alias_keys = {name: np.array(keys, dtype=np.int64) for name, keys in self.alias_keys.items()}
+        alias_rows = {name: new_rows[np.array(rows, dtype=np.int64)] for name, rows in self.alias_rows.items()}
+        has_pid = columns['pid'] != NO_ID
+        keys = np.concatenate([columns['pid'][has_pid], alias_keys['pid']]).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        columns['index_pid_keys'] = keys[order]
+        columns['index_pid_rows'] = np.concatenate([all_rows[has_pid], alias_rows['pid']]).astype(np.int32)[order]
+        for name in ('doi', 'sha'):
+            has_id = columns[name] != NO_ID
+            inds = np.concatenate([columns[name][has_id], alias_keys[name]]).astype(np.int32)
+            strings = self.tables[f'{name}s'].strings
+            hashes = hash_strs(strings[ind] for ind in inds)
+            order = np.argsort(hashes, kind='stable')
+            columns[f'index_{name}_keys'] = hashes[order]
+            columns[f'index_{name}_rows'] = np.concatenate([all_rows[has_id], alias_rows[name]]).astype(np.int32)[order]
+            columns[f'index_{name}_strs'] = inds[order]
+
+        group_rows = [self.group_rows[tuple(group)] for group in self.groups]
+        columns['group_ptr'] = np.cumsum([0] + [len(rows) for rows in group_rows]).astype(np.int64)
+        columns['group_rows'] = new_rows[np.array([row for rows in group_rows for row in rows], dtype=np.int64)]
+
+        store = PaperStore(columns, tables, self.groups)
+        for direction in ('refs', 'cits'):
+            columns[f'{direction}_row'] = store.resolve_triples(
+                columns[f'{direction}_pid'], columns[f'{direction}_doi'], columns[f'{direction}_sha']
+            )
+        return store
+
+
+class PaperView:
+    """
+    Lightweight read-only view of one row of a PaperStore, with the same
+    attributes and helpers as Paper
+    """
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store: PaperStore, row: int):
+        self.store = store
+        self.row = row
+
+    def _str(self, column: str, table: str) -> Optional[str]:
+        return self.store.tables[table][self.store.columns[column][self.row]]
+
+    @property
+    def pid(self) -> Optional[int]:
+        pid = int(self.store.columns['pid'][self.row])
+        return pid if pid != NO_ID else None
+
+    @property
+    def doi(self) -> Optional[str]:
+        return self._str('doi', 'dois')
+
+    @property
+    def sha(self) -> Optional[str]:
+        return self._str('sha', 'shas')
+
+    @property
+    def title(self) -> Optional[str]:
+        return self._str('title', 'titles')
+
+    @property
+    def venue(self) -> Optional[str]:
+        return self._str('venue', 'venues')
+
+    @property
+    def year(self) -> Optional[int]:
+        year = int(self.store.columns['year'][self.row])
+        return year if year != NO_ID else None
+
+    def _fos_entries(self, level: Optional[int] = None) -> Optional[List]:
+        cols = self.store.columns
+        start, end = cols['fos_ptr'][self.row], cols['fos_ptr'][self.row + 1]
+        if end == start:
+            return None
+        fos_meta = self.store.fos_meta()
+        return [
+            [int(fos_id), float(score)] + fos_meta[meta_ind] + [int(fos_level)]
+            for fos_id, score, meta_ind, fos_level in zip(
+                cols['fos_id'][start:end],
+                cols['fos_score'][start:end],
+                cols['fos_meta'][start:end],
+                cols['fos_level'][start:end]
+            )
+            if level is None or fos_level == level
+        ]
+
+    @property
+    def fos(self) -> Optional[List]:
+        return self._fos_entries()
+
+    def _edges(self, direction: str) -> List[List]:
+        cols = self.store.columns
+        ptr = cols[f'{direction}_ptr']
+        start, end = ptr[self.row], ptr[self.row + 1]
+        dois = self.store.tables['dois']
+        shas = self.store.tables['shas']
+        return [
+            [int(pid) if pid != NO_ID else None, dois[doi], shas[sha]]
+            for pid, doi, sha in zip(
+                cols[f'{direction}_pid'][start:end],
+                cols[f'{direction}_doi'][start:end],
+                cols[f'{direction}_sha'][start:end]
+            )
+        ]
+
+    @property
+    def refs(self) -> List[List]:
+        return self._edges('refs')
+
+    @property
+    def cits(self) -> List[List]:
+        return self._edges('cits')
+
+    def __eq__(self, p2):
+        if self.pid and p2.pid and self.pid == p2.pid:
+            return True
+        if self.doi and p2.doi and self.doi == p2.doi:
+            return True
+        if self.sha and p2.sha and self.sha == p2.sha:
+            return True
+        return False
+
+    def __hash__(self):
+        return hash((self.pid, self.doi, self.sha))
+
+    def __repr__(self):
+        fos = self.fos
+        cols = self.store.columns
+        return json.dumps({
+            "pid": self.pid,
+            "doi": self.doi,
+            "sha": self.sha,
+            "venue": self.venue,
+            "year": self.year,
+            "fos": [fos_entry[2] for fos_entry in fos] if fos else None,
+            "title": self.title,
+            "references": int(cols['refs_ptr'][self.row + 1] - cols['refs_ptr'][self.row]),
+            "citations": int(cols['cits_ptr'][self.row + 1] - cols['cits_ptr'][self.row])
+        })
+
+    def as_json(self):
+        return {
+            "pid": self.pid,
+            "doi": self.doi,
+            "sha": self.sha,
+            "venue": self.venue,
+            "year": self.year,
+            "fos": self.fos,
+            "title": self.title,
+            "refs": self.refs,
+            "cits": self.cits
+        }
+
+    def to_paper(self) -> Paper:
+        """
+        Materialize as a standalone Paper
+        :return:
+        """
+        return Paper.from_normalized(**self.as_json())
+
+    @property
+    def l0_fos(self):
+        return self._fos_entries(0)
+
+    @property
+    def l1_fos(self):
+        return self._fos_entries(1)
+
+    @property
+    def l2_fos(self):
+        return self._fos_entries(2)
+
+    def has_fos(self, fos_str: str) -> bool:
+        fos = self.fos
+        if not fos:
+            return False
+        for fos_entry in fos:
+            if fos_str == fos_entry[2]:
+                return True
+        return False
+
+
+class PaperSequence(Sequence):
+    """
+    Read-only sequence of store rows, yielding PaperViews
+    """
+    def __init__(self, store: PaperStore, rows: np.ndarray):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return PaperSequence(self.store, self.rows[ind])
+        return PaperView(self.store, int(self.rows[ind]))
+
+    def __iter__(self) -> Iterator[PaperView]:
+        store = self.store
+        for row in self.rows:
+            yield PaperView(store, int(row))
+
+    def __add__(self, other) -> List:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> List:
+        return list(other) + list(self)
+
+
+class StoreLookup:
+    """
+    PaperLookup-compatible lookup over a PaperStore, returning PaperViews
+    """
+    def __init__(self, store: PaperStore):
+        self.store = store
+        self.papers = PaperSequence(store, np.arange(len(store), dtype=np.int32))
+        # secondary indexes, built on first use
+        self._venue_rows = None
+        self._fos_id_rows = None
+        self._fos_name_rows = dict()
+        self._graph = None
+
+    def _view(self, row: int) -> Optional[PaperView]:
+        return PaperView(self.store, row) if row != NO_ID else None
+
+    def get_paper_by_pid(self, pid: int):
+        return self._view(self.store.find_pid(pid))
+
+    def get_paper_by_doi(self, doi: str):
+        return self._view(self.store.find_doi(doi))
+
+    def get_paper_by_sha(self, sha: str):
+        return self._view(self.store.find_sha(sha))
+
+    def get_paper_by_triple(self, paper_ids):
+        row = self.store.find_triple(paper_ids)
+        if PROFILER.enabled:
+            count('lookup.triples_resolved' if row != NO_ID else 'lookup.triples_unresolved')
+        return self._view(row)
+
+    def get_paper_id(self, paper) -> int:
+        """
+        Dense integer id of a paper (its store row), or -1 if not in the store
+        :param paper:
+        :return:
+        """
+        if paper is None:
+            return NO_ID
+        if isinstance(paper, PaperView) and paper.store is self.store:
+            return paper.row
+        return self.store.find_triple([paper.pid, paper.doi, paper.sha])
+
+    @property
+    def graph(self) -> CitationGraph:
+        """
+        Citation graph over store rows, from the edges resolved when the store was built
+        :return:
+        """
+        if self._graph is None:
+            cols = self.store.columns
+            self._graph = CitationGraph.from_resolved(
+                cols['refs_ptr'], cols['refs_row'], cols['cits_ptr'], cols['cits_row']
+            )
+            count('graph.unresolved_refs', self._graph.num_unresolved('refs'))
+            count('graph.unresolved_cits', self._graph.num_unresolved('cits'))
+        return self._graph
+
+    def _rows_in_venue(self, venue_str: str) -> np.ndarray:
+        norm_venue = get_venue_normalizer().normalize(venue_str)[0]
+        if not norm_venue:
+            return np.zeros(0, dtype=np.int32)
+        if self._venue_rows is None:
+            # venue -> rows (ascending), via one stable sort of the venue column
+            venue_col = np.asarray(self.store.columns['venue'])
+            order = np.argsort(venue_col, kind='stable').astype(np.int32)
+            bounds = np.flatnonzero(np.diff(venue_col[order])) + 1
+            self._venue_rows = {
+                int(venue_col[rows[0]]): rows
+                for rows in np.split(order, bounds) if len(rows)
+            }
+        venue_ind = self.store.tables['venues'].find(norm_venue)
+        if venue_ind == NO_ID:
+            # rows without a venue are keyed NO_ID in _venue_rows
+            return np.zeros(0, dtype=np.int32)
+        return self._venue_rows.get(venue_ind, np.zeros(0, dtype=np.int32))
+
+    def get_papers_in_venue(self, venue_str: str) -> PaperSequence:
+        return PaperSequence(self.store, self._rows_in_venue(venue_str))
+
+    def get_papers_in_venue_by_year(self, venue_str: str) -> Tuple[Dict, PaperSequence]:
+        rows = self._rows_in_venue(venue_str)
+        years = self.store.columns['year'][rows]
+        has_year = (years != NO_ID) & (years != 0)
+        by_year = defaultdict(tuple, {
+            int(year): PaperSequence(self.store, rows[has_year & (years == year)])
+            for year in np.unique(years[has_year])
+        })
+        return by_year, PaperSequence(self.store, rows[~has_year])
+
+    def get_papers_in_venue_by_year_range(
+            self,
+            venue_str: str,
+            start_year: Optional[int] = None,
+            end_year: Optional[int] = None
+    ) -> PaperSequence:
+        """
+        Get papers in venue published from start_year to end_year (inclusive),
+        ordered by year; papers without a year are excluded
+        :param venue_str:
+        :param start_year: no lower bound if None
+        :param end_year: no upper bound if None
+        :return:
+        """
+        rows = self._rows_in_venue(venue_str)
+        years = self.store.columns['year'][rows]
+        keep = (years != NO_ID) & (years != 0)
+        if start_year is not None:
+            keep &= years >= start_year
+        if end_year is not None:
+            keep &= years <= end_year
+        rows = rows[keep]
+        return PaperSequence(self.store, rows[np.argsort(years[keep], kind='stable')])
+
+    def _rows_for_entries(self, entries: np.ndarray) -> np.ndarray:
+        return np.unique(np.searchsorted(self.store.columns['fos_ptr'], entries, side='right') - 1).astype(np.int32)
+
+    def get_papers_in_fos(self, fos: Union[str, int]) -> PaperSequence:
+        """
+        Get papers tagged with a FoS, given by name (str) or MAG id (int)
+        :param fos:
+        :return:
+        """
+        cols = self.store.columns
+        if isinstance(fos, str):
+            if fos not in self._fos_name_rows:
+                meta_inds = [i for i, meta in enumerate(self.store.fos_meta()) if meta[0] == fos]
+                self._fos_name_rows[fos] = self._rows_for_entries(
+                    np.flatnonzero(np.isin(cols['fos_meta'], meta_inds))
+                )
+            return PaperSequence(self.store, self._fos_name_rows[fos])
+
+        if self._fos_id_rows is None:
+            fos_ids = np.asarray(cols['fos_id'])
+            order = np.argsort(fos_ids, kind='stable')
+            bounds = np.flatnonzero(np.diff(fos_ids[order])) + 1
+            self._fos_id_rows = {
+                int(fos_ids[entries[0]]): self._rows_for_entries(entries)
+                for entries in np.split(order, bounds) if len(entries)
+            }
+        return PaperSequence(self.store, self._fos_id_rows.get(fos, np.zeros(0, dtype=np.int32)))
+
+
+def split_groups(store: PaperStore) -> Tuple[Dict, Dict]:
+    """
+    Rebuild the core/extended dicts of load_dataset from a store's groups
+    :param store:
+    :return:
+    """
+    core = defaultdict(list)
+    extended = defaultdict(list)
+    for i, (section, venue_key) in enumerate(store.groups):
+        papers = PaperSequence(store, store.group_rows(i))
+        if section == 'core':
+            core[venue_key] = papers
+        else:
+            extended[venue_key] = papers
+    return core, extended
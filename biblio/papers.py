@@ -2,24 +2,15 @@ import os, sys
 import json
 import gzip
 import re
-from typing import Dict, List, Tuple, Optional
-from collections import defaultdict
+import bisect
+import hashlib
+from typing import Dict, List, Tuple, Optional, Union
+from collections import defaultdict, OrderedDict
 
+from biblio.dblp_index import get_dblp_index
+from biblio.citation_graph import CitationGraph
+from biblio.utils.profile_utils import PROFILER, count, phase
 
-# load DBLP conference data
-print('loading dblp data; this will take a moment...')
-DBLP_ALL_FILE = 'data/dblp_papers_by_conference.json.gz'
-with gzip.open(DBLP_ALL_FILE, 'r') as f:
-    data = json.load(f)
-
-# create mappings between DOIs and DBLP conf identifiers and years
-DBLP_DOI_TO_CONF = dict()
-DBLP_DOI_TO_YEAR = dict()
-for conf_key, papers in data.items():
-    for paper in papers:
-        if paper['doi']:
-            DBLP_DOI_TO_CONF[paper['doi'].lower()] = conf_key
-            DBLP_DOI_TO_YEAR[paper['doi'].lower()] = paper['year']
 
 VENUE_2_DIGIT_YEAR_REGEX = r"(\'\d{2})"
 VENUE_4_DIGIT_YEAR_REGEX = r"(\d{4})"
@@ -148,6 +139,168 @@ def normalize_venue(venue_str: str) -> Tuple[Optional[str], Optional[int]]:
     return venue_str, None
 
 
+VENUE_ALIAS_FILE = 'data/cache/venue_aliases.json'
+
+# bump when normalize_venue changes
+VENUE_ALIAS_VERSION = 1
+
+
+def _venue_normalization_key() -> str:
+    # learned aliases are only valid for the S2_VENUE_NORMALIZATION they were computed with
+    table = json.dumps(S2_VENUE_NORMALIZATION, sort_keys=True)
+    return f'{VENUE_ALIAS_VERSION}-{hashlib.blake2b(table.encode("utf-8"), digest_size=8).hexdigest()}'
+
+
+class VenueNormalizer:
+    """
+    Memoized normalize_venue. Each distinct raw venue string is normalized
+    once and kept in a bounded LRU cache; the learned raw -> (venue, year)
+    table can be saved and loaded so that later runs skip the regex work.
+    """
+    def __init__(self, max_size: int = 2 ** 16, alias_file: Optional[str] = VENUE_ALIAS_FILE):
+        self.max_size = max_size
+        self.alias_file = alias_file
+        self._cache = OrderedDict()
+        # whether entries were learned since the table was loaded/saved
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        if alias_file and os.path.exists(alias_file):
+            self.load_aliases(alias_file)
+
+    def normalize(self, venue_str: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Same as normalize_venue
+        :param venue_str:
+        :return:
+        """
+        entry = self._cache.get(venue_str)
+        if entry is not None:
+            self.hits += 1
+            self._cache.move_to_end(venue_str)
+            return entry
+        self.misses += 1
+        entry = normalize_venue(venue_str)
+        self._cache[venue_str] = entry
+        self._dirty = True
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return entry
+
+    __call__ = normalize
+
+    def normalize_many(self, venue_strs):
+        """
+        Normalize a list (returns a list of (venue, year)) or a pandas Series
+        (returns a Series of (venue, year) with the same index); each distinct
+        string is normalized once
+        :param venue_strs:
+        :return:
+        """
+        if hasattr(venue_strs, 'map') and hasattr(venue_strs, 'unique'):
+            table = {v: self.normalize(v) for v in venue_strs.unique() if isinstance(v, str)}
+            return venue_strs.map(table)
+        table = {}
+        results = []
+        for v in venue_strs:
+            if v not in table:
+                table[v] = self.normalize(v)
+            results.append(table[v])
+        return results
+
+    def stats(self) -> Dict:
+        """
+        Cache statistics
+        :return:
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.,
+            'size': len(self._cache),
+            'max_size': self.max_size
+        }
+
+    def load_aliases(self, alias_file: str) -> bool:
+        """
+        Load a saved alias table; ignored if it was learned with a different
+        S2_VENUE_NORMALIZATION
+        :param alias_file:
+        :return: whether the table was loaded
+        """
+        try:
+            with open(alias_file, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get('key') != _venue_normalization_key():
+            return False
+        for venue_str, (venue, year) in saved['aliases'].items():
+            self._cache[venue_str] = (venue, year)
+        return True
+
+    def save_aliases(self, alias_file: Optional[str] = None, force: bool = False):
+        """
+        Save the learned raw -> (venue, year) table, if anything new was learned
+        :param alias_file: defaults to the file the normalizer was created with
+        :param force: write even if nothing changed
+        :return:
+        """
+        alias_file = alias_file or self.alias_file
+        if not alias_file or not (force or self._dirty):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(alias_file)), exist_ok=True)
+        tmp_file = f'{alias_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as outf:
+            json.dump({
+                'key': _venue_normalization_key(),
+                'aliases': {venue_str: list(entry) for venue_str, entry in self._cache.items()}
+            }, outf)
+        os.replace(tmp_file, alias_file)
+        self._dirty = False
+
+
+_VENUE_NORMALIZER = None
+
+
+def get_venue_normalizer() -> VenueNormalizer:
+    """
+    Shared venue normalizer for this process (created on first use)
+    :return:
+    """
+    global _VENUE_NORMALIZER
+    if _VENUE_NORMALIZER is None:
+        _VENUE_NORMALIZER = VenueNormalizer()
+    return _VENUE_NORMALIZER
+
+
+def resolve_venue_year(
+        doi: Optional[str],
+        venue: Optional[str],
+        year: Optional[int]
+) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Get normalized venue and year for a paper record, preferring DBLP
+    :param doi:
+    :param venue: S2 venue string
+    :param year: S2 year
+    :return:
+    """
+    dblp_entry = get_dblp_index().lookup(doi) if doi else None
+    if dblp_entry:
+        return dblp_entry
+    # try to get something from S2 venue
+    if venue:
+        norm_venue, norm_year = get_venue_normalizer().normalize(venue)
+    else:
+        norm_venue, norm_year = None, None
+    # and keep year if there's a year
+    if year:
+        norm_year = year
+    return norm_venue, norm_year
+
+
 class Paper:
     def __init__(
             self,
@@ -166,26 +319,42 @@ class Paper:
         self.pid = pid if pid else None
         self.doi = doi.lower() if doi else None
         self.sha = sha.lower() if sha else None
-        if doi and doi.lower() in DBLP_DOI_TO_CONF:
-            self.venue = DBLP_DOI_TO_CONF[doi.lower()]
-            self.year = DBLP_DOI_TO_YEAR[doi.lower()]
-        else:
-            # try to get something from S2 venue
-            if venue:
-                venue_name, venue_year = normalize_venue(venue)
-                self.venue = venue_name
-                self.year = venue_year
-            else:
-                self.venue = None
-                self.year = None
-            # and keep year if there's a year
-            if year:
-                self.year = year
+        self.venue, self.year = resolve_venue_year(doi, venue, year)
         self.fos = sorted(fos, key=lambda x: x[1], reverse=True) if fos else None
         self.title = title if title else None
         self.refs = refs if refs else []
         self.cits = cits if cits else []
 
+    @classmethod
+    def from_normalized(
+            cls,
+            pid: Optional[int],
+            doi: Optional[str],
+            sha: Optional[str],
+            venue: Optional[str],
+            year: Optional[int],
+            fos: Optional[List],
+            title: Optional[str],
+            refs: List,
+            cits: List
+    ) -> 'Paper':
+        """
+        Create a paper from already normalized fields (e.g. the output of
+        as_json), skipping DBLP lookup and venue normalization
+        :return:
+        """
+        paper = cls.__new__(cls)
+        paper.pid = pid
+        paper.doi = doi
+        paper.sha = sha
+        paper.venue = venue
+        paper.year = year
+        paper.fos = fos
+        paper.title = title
+        paper.refs = refs
+        paper.cits = cits
+        return paper
+
     def __eq__(self, p2):
         if self.pid and p2.pid and self.pid == p2.pid:
             return True
@@ -252,18 +421,35 @@ class Paper:
 
 
 class PaperLookup:
-    def __init__(self, paper_list: List[Paper]):
+    def __init__(self, paper_list: List[Paper], aliases=None):
+        """
+        :param paper_list:
+        :param aliases: PaperAliases from biblio.entity_resolution.resolve_papers; every id of
+            every merged record then resolves to its canonical paper in paper_list
+        """
         self.papers = paper_list
         self.pid_dict = dict()
         self.doi_dict = dict()
         self.sha_dict = dict()
-        for paper in paper_list:
-            if paper.pid:
-                self.pid_dict[paper.pid] = paper
-            if paper.doi:
-                self.doi_dict[paper.doi] = paper
-            if paper.sha:
-                self.sha_dict[paper.sha] = paper
+        if aliases is not None:
+            self.pid_dict = {pid: paper_list[i] for pid, i in aliases.pid_map.items()}
+            self.doi_dict = {doi: paper_list[i] for doi, i in aliases.doi_map.items()}
+            self.sha_dict = {sha: paper_list[i] for sha, i in aliases.sha_map.items()}
+        else:
+            for paper in paper_list:
+                if paper.pid:
+                    self.pid_dict[paper.pid] = paper
+                if paper.doi:
+                    self.doi_dict[paper.doi] = paper
+                if paper.sha:
+                    self.sha_dict[paper.sha] = paper
+        # secondary indexes, built on first use
+        self._venue_index = None
+        self._venue_year_index = None
+        self._fos_name_index = None
+        self._fos_id_index = None
+        self._paper_ids = None
+        self._graph = None
 
     def get_paper_by_pid(self, pid: int):
         if pid in self.pid_dict:
@@ -284,32 +470,140 @@ class PaperLookup:
             return None
 
     def get_paper_by_triple(self, paper_ids):
+        paper = self._get_paper_by_triple(paper_ids)
+        if PROFILER.enabled:
+            count('lookup.triples_resolved' if paper else 'lookup.triples_unresolved')
+        return paper
+
+    def _get_paper_by_triple(self, paper_ids):
         pid, doi, sha = paper_ids
         pid = int(pid) if pid else None
         if pid and pid in self.pid_dict:
             return self.pid_dict[pid]
         if doi and doi.lower() in self.doi_dict:
-            return self.doi_dict[doi]
-        if sha and sha in self.sha_dict:
-            return self.sha_dict[sha]
+            return self.doi_dict[doi.lower()]
+        if sha and sha.lower() in self.sha_dict:
+            return self.sha_dict[sha.lower()]
         return None
 
-    def get_papers_in_venue(self, venue_str: str) -> List[Paper]:
-        norm_venue, _ = normalize_venue(venue_str)
+    def get_paper_id(self, paper: Optional[Paper]) -> int:
+        """
+        Dense integer id of a paper (its position in self.papers), or -1 if not in the lookup
+        :param paper:
+        :return:
+        """
+        if paper is None:
+            return -1
+        if self._paper_ids is None:
+            self._paper_ids = {(p.pid, p.doi, p.sha): i for i, p in enumerate(self.papers)}
+        return self._paper_ids.get((paper.pid, paper.doi, paper.sha), -1)
+
+    @property
+    def graph(self) -> CitationGraph:
+        """
+        Citation graph over paper ids, with every ref/cit triple resolved once (built on first use)
+        :return:
+        """
+        if self._graph is None:
+            with phase('lookup.citation_graph'):
+                self._graph = CitationGraph.from_papers(
+                    self.papers,
+                    lambda paper_ids: self.get_paper_id(self.get_paper_by_triple(paper_ids))
+                )
+            count('graph.unresolved_refs', self._graph.num_unresolved('refs'))
+            count('graph.unresolved_cits', self._graph.num_unresolved('cits'))
+        return self._graph
+
+    def _normalize_venue_query(self, venue_str: str) -> Optional[str]:
+        return get_venue_normalizer().normalize(venue_str)[0]
+
+    def _build_venue_indexes(self):
+        by_venue = defaultdict(list)
+        for p in self.papers:
+            if p.venue:
+                by_venue[p.venue].append(p)
+        self._venue_index = {venue: tuple(papers) for venue, papers in by_venue.items()}
+
+        # venue -> ({year: papers}, papers without year, sorted years)
+        self._venue_year_index = dict()
+        for venue, papers in self._venue_index.items():
+            by_year = defaultdict(list)
+            no_year = []
+            for p in papers:
+                if not p.year:
+                    no_year.append(p)
+                else:
+                    by_year[p.year].append(p)
+            years = sorted(by_year.keys())
+            self._venue_year_index[venue] = (
+                {year: tuple(by_year[year]) for year in years},
+                tuple(no_year),
+                years
+            )
+
+    def _build_fos_indexes(self):
+        by_name = defaultdict(list)
+        by_id = defaultdict(list)
+        for p in self.papers:
+            if not p.fos:
+                continue
+            # each paper listed once per FoS, even with repeated entries
+            for name in dict.fromkeys(fos_entry[2] for fos_entry in p.fos):
+                by_name[name].append(p)
+            for mag_id in dict.fromkeys(fos_entry[0] for fos_entry in p.fos):
+                by_id[mag_id].append(p)
+        self._fos_name_index = {name: tuple(papers) for name, papers in by_name.items()}
+        self._fos_id_index = {mag_id: tuple(papers) for mag_id, papers in by_id.items()}
+
+    def get_papers_in_venue(self, venue_str: str) -> Tuple[Paper, ...]:
+        norm_venue = self._normalize_venue_query(venue_str)
         if not norm_venue:
-            return []
-        return [p for p in self.papers if p.venue and p.venue == norm_venue]
-
-    def get_papers_in_venue_by_year(self, venue_str: str) -> Tuple[Dict, List[Paper]]:
-        matching_papers = self.get_papers_in_venue(venue_str)
-        by_year = defaultdict(list)
-        no_year = []
-        for p in matching_papers:
-            if not p.year:
-                no_year.append(p)
-            else:
-                by_year[p.year].append(p)
-        return by_year, no_year
-
-    def get_papers_in_fos(self, fos: str) -> List[Paper]:
-        return [p for p in self.papers if p.has_fos(fos)]
+            return ()
+        if self._venue_index is None:
+            self._build_venue_indexes()
+        return self._venue_index.get(norm_venue, ())
+
+    def get_papers_in_venue_by_year(self, venue_str: str) -> Tuple[Dict, Tuple[Paper, ...]]:
+        norm_venue = self._normalize_venue_query(venue_str)
+        if self._venue_year_index is None:
+            self._build_venue_indexes()
+        if not norm_venue or norm_venue not in self._venue_year_index:
+            return defaultdict(tuple), ()
+        by_year, no_year, _ = self._venue_year_index[norm_venue]
+        return defaultdict(tuple, by_year), no_year
+
+    def get_papers_in_venue_by_year_range(
+            self,
+            venue_str: str,
+            start_year: Optional[int] = None,
+            end_year: Optional[int] = None
+    ) -> Tuple[Paper, ...]:
+        """
+        Get papers in venue published from start_year to end_year (inclusive),
+        ordered by year; papers without a year are excluded
+        :param venue_str:
+        :param start_year: no lower bound if None
+        :param end_year: no upper bound if None
+        :return:
+        """
+        norm_venue = self._normalize_venue_query(venue_str)
+        if self._venue_year_index is None:
+            self._build_venue_indexes()
+        if not norm_venue or norm_venue not in self._venue_year_index:
+            return ()
+        by_year, _, years = self._venue_year_index[norm_venue]
+        lo = bisect.bisect_left(years, start_year) if start_year is not None else 0
+        hi = bisect.bisect_right(years, end_year) if end_year is not None else len(years)
+        return tuple(p for year in years[lo:hi] for p in by_year[year])
+
+    def get_papers_in_fos(self, fos: Union[str, int]) -> Tuple[Paper, ...]:
+        """
+        Get papers tagged with a FoS, given by name (str) or MAG id (int)
+        :param fos:
+        :return:
+        """
+        if self._fos_name_index is None:
+            self._build_fos_indexes()
+        if isinstance(fos, str):
+            return self._fos_name_index.get(fos, ())
+        return self._fos_id_index.get(fos, ())
@@ -0,0 +1,315 @@
+"""
+A small stage runner for analysis scripts: named stages with dependencies,
+each stage's output pickled under PIPELINE_DIR and keyed by its code, its
+parameters, the files it reads and the keys of its dependencies.
+
+Every key also includes a hash of the source of the biblio package (or of
+other code directories given to the Pipeline), so editing any library
+function a stage calls invalidates its artifacts.
+
+A run only executes the stages needed for its targets whose artifacts are
+missing or out of date; up-to-date dependencies are loaded from disk, and
+only if a stage that needs them has to run. Stages marked cache=False (e.g.
+loading the dataset, which has its own caches) are kept in memory and rerun
+when needed. Stages marked concurrent run in forked processes when more than
+one of them is ready at a time, inheriting their inputs from the parent.
+"""
+
+import os, sys
+import time
+import pickle
+import hashlib
+import inspect
+import traceback
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from biblio.utils.cache_utils import file_stamp
+from biblio.utils.profile_utils import phase
+
+
+PIPELINE_DIR = 'data/cache/pipeline'
+# library code hashed into every stage key
+LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# bump when the artifact layout changes
+PIPELINE_VERSION = 1
+
+
+def code_dir_version(code_dirs: Sequence[str]) -> str:
+    """
+    Hash of the contents of every .py file under the given directories
+    :param code_dirs:
+    :return:
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for code_dir in code_dirs:
+        for root, dirs, files in os.walk(code_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(root, name)
+                    h.update(os.path.relpath(path, code_dir).encode('utf-8'))
+                    with open(path, 'rb') as f:
+                        h.update(hashlib.blake2b(f.read(), digest_size=16).digest())
+    return h.hexdigest()
+
+
+class Stage:
+    """
+    A named step computing func(inputs) from the outputs of its dependencies
+    (inputs maps each dependency name to its output)
+    """
+    def __init__(
+            self,
+            name: str,
+            func: Callable[[Dict[str, Any]], Any],
+            deps: Sequence[str] = (),
+            params: Optional[Dict] = None,
+            sources: Sequence[str] = (),
+            code: Sequence[Callable] = (),
+            outputs: Sequence[str] = (),
+            cache: bool = True,
+            concurrent: bool = False
+    ):
+        """
+        :param name:
+        :param func:
+        :param deps: names of the stages whose outputs func reads
+        :param params: JSON-like parameters that change the output (part of the key)
+        :param sources: files read by func (their size and mtime are part of the key)
+        :param code: other functions whose source is part of the key, besides func (library
+            code under the Pipeline's code_dirs is always part of the key)
+        :param outputs: files written by func; the stage is out of date if any is missing
+        :param cache: store the output as an artifact
+        :param concurrent: may run in a forked process alongside other concurrent stages
+        """
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.sources = list(sources)
+        self.code = [func] + list(code)
+        self.outputs = list(outputs)
+        self.cache = cache
+        self.concurrent = concurrent
+
+    def code_version(self) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for f in self.code:
+            h.update(inspect.getsource(f).encode('utf-8'))
+        return h.hexdigest()
+
+
+class Pipeline:
+    """
+    A DAG of stages, e.g.
+
+        pipeline = Pipeline([Stage('load', load), Stage('refs', refs_lcdi, deps=['load'], concurrent=True)])
+        pipeline.run(['refs'], workers=2)
+    """
+    def __init__(
+            self,
+            stages: Sequence[Stage],
+            cache_dir: str = PIPELINE_DIR,
+            code_dirs: Sequence[str] = (LIBRARY_DIR,)
+    ):
+        """
+        :param stages:
+        :param cache_dir: where artifacts are stored
+        :param code_dirs: directories of library code the stages call; their source is part of every key
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = cache_dir
+        self.code_dirs = list(code_dirs)
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f'stage {stage.name} depends on unknown stage {dep}')
+        self.order = self._topological_order()
+        self._keys = None
+
+    def _topological_order(self) -> List[str]:
+        order = []
+        state = dict()
+
+        def visit(name):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f'dependency cycle through stage {name}')
+            state[name] = 'visiting'
+            for dep in self.stages[name].deps:
+                visit(dep)
+            state[name] = 'done'
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def keys(self) -> Dict[str, str]:
+        """
+        Cache key of every stage, from its code, the library code, parameters, source files and dependency keys
+        :return:
+        """
+        if self._keys is None:
+            keys = dict()
+            library_version = code_dir_version(self.code_dirs)
+            for name in self.order:
+                stage = self.stages[name]
+                h = hashlib.blake2b(digest_size=16)
+                h.update(repr((
+                    PIPELINE_VERSION,
+                    name,
+                    library_version,
+                    stage.code_version(),
+                    sorted(stage.params.items()),
+                    [file_stamp(path) if os.path.exists(path) else None for path in stage.sources],
+                    [keys[dep] for dep in stage.deps]
+                )).encode('utf-8'))
+                keys[name] = h.hexdigest()
+            self._keys = keys
+        return self._keys
+
+    def artifact_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f'{name}-{self.keys()[name]}.pkl')
+
+    def is_up_to_date(self, name: str) -> bool:
+        stage = self.stages[name]
+        return (
+            stage.cache
+            and os.path.exists(self.artifact_path(name))
+            and all(os.path.exists(path) for path in stage.outputs)
+        )
+
+    def _load(self, name: str) -> Any:
+        with open(self.artifact_path(name), 'rb') as f:
+            return pickle.load(f)
+
+    def _save(self, name: str, value: Any):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.artifact_path(name)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as outf:
+            pickle.dump(value, outf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        # drop artifacts of older versions of this stage
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(f'{name}-') and entry.endswith('.pkl') and entry != os.path.basename(path):
+                os.remove(os.path.join(self.cache_dir, entry))
+
+    def plan(self, targets: Optional[Sequence[str]] = None, force: Sequence[str] = ()) -> List[str]:
+        """
+        Stages to execute for the targets, in dependency order
+        :param targets: stage names (default all stages)
+        :param force: stages to rerun even if up to date
+        :return:
+        """
+        targets = list(self.order) if targets is None else list(targets)
+        for name in targets:
+            if name not in self.stages:
+                raise ValueError(f'unknown stage {name}; stages are {self.order}')
+        to_run = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in to_run or (name not in force and self.is_up_to_date(name)):
+                continue
+            to_run.add(name)
+            pending += self.stages[name].deps
+        return [name for name in self.order if name in to_run]
+
+    def _run_stage(self, name: str, results: Dict[str, Any]) -> Any:
+        stage = self.stages[name]
+        with phase(f'stage.{name}'):
+            value = stage.func({dep: results[dep] for dep in stage.deps})
+        if stage.cache:
+            self._save(name, value)
+        return value
+
+    def _run_in_child(self, name: str, results: Dict[str, Any]):
+        # forked: inputs are inherited, the output is passed back as an artifact
+        try:
+            self._run_stage(name, results)
+        except BaseException:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    def run(
+            self,
+            targets: Optional[Sequence[str]] = None,
+            workers: int = 1,
+            force: Sequence[str] = ()
+    ) -> Dict[str, Any]:
+        """
+        Execute the out-of-date stages needed for the targets
+        :param targets: stage names (default all stages)
+        :param workers: maximum number of concurrent stages running at once
+        :param force: stages to rerun even if up to date
+        :return: outputs of the targets
+        """
+        targets = list(self.order) if targets is None else list(targets)
+        to_run = self.plan(targets, force)
+        needed = set(to_run) | set(targets)
+        for name in to_run:
+            needed.update(self.stages[name].deps)
+        skipped = [name for name in self.order if name in needed and name not in to_run]
+        print(f'stages to run: {", ".join(to_run) or "none"}')
+
+        results = dict()
+
+        def ensure_inputs(name):
+            for dep in self.stages[name].deps:
+                if dep not in results:
+                    results[dep] = self._load(dep)
+
+        remaining = list(to_run)
+        running = dict()
+        context = multiprocessing.get_context('fork')
+        while remaining or running:
+            ready = [
+                name for name in remaining
+                if all(dep not in remaining and dep not in running for dep in self.stages[name].deps)
+            ]
+            concurrent_ready = [name for name in ready if self.stages[name].concurrent and self.stages[name].cache]
+            if workers > 1 and len(concurrent_ready) + len(running) > 1:
+                for name in concurrent_ready[:max(0, workers - len(running))]:
+                    ensure_inputs(name)
+                    print(f'[{name}] started in a worker process')
+                    process = context.Process(target=self._run_in_child, args=(name, results))
+                    process.start()
+                    running[name] = (process, time.time())
+                    remaining.remove(name)
+            elif ready:
+                name = ready[0]
+                ensure_inputs(name)
+                tic = time.time()
+                print(f'[{name}] running...')
+                results[name] = self._run_stage(name, results)
+                print(f'[{name}] done in {time.time() - tic:.1f}s')
+                remaining.remove(name)
+                continue
+            if running:
+                # wait for any worker to finish
+                while not any(not process.is_alive() for process, _ in running.values()):
+                    time.sleep(0.05)
+                for name, (process, tic) in list(running.items()):
+                    if process.is_alive():
+                        continue
+                    process.join()
+                    del running[name]
+                    if process.exitcode != 0:
+                        for other, _ in running.values():
+                            other.terminate()
+                        raise RuntimeError(f'stage {name} failed (exit code {process.exitcode})')
+                    results[name] = self._load(name)
+                    print(f'[{name}] done in {time.time() - tic:.1f}s')
+
+        for name in targets:
+            if name not in results:
+                results[name] = self._load(name) if self.stages[name].cache else None
+        if skipped:
+            print(f'up to date: {", ".join(skipped)}')
+        return {name: results[name] for name in targets}
@@ -0,0 +1,118 @@
+import os, sys
+import json
+from typing import Dict, Tuple
+
+from biblio.papers import PaperLookup
+from biblio.paper_store import PaperStore, PaperStoreBuilder, StoreLookup, split_groups
+from biblio.load_dataset import build_dataset_store, DATASET_PATH
+from biblio.dblp_index import DBLP_ALL_FILE
+from biblio.utils.cache_utils import file_stamp, make_tmp_dir, publish_dir
+
+
+SNAPSHOT_DIR = 'data/cache/snapshot'
+
+# bump when the on-disk layout changes
+SNAPSHOT_VERSION = 3
+
+
+def save_snapshot(store: PaperStore, out_dir: str = SNAPSHOT_DIR, meta: Dict = None):
+    """
+    Write a PaperStore as a snapshot that load_snapshot can memory-map
+    :param store:
+    :param out_dir:
+    :param meta: extra metadata (e.g. source stamps) stored in meta.json
+    :return:
+    """
+    store.save(out_dir)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as outf:
+        json.dump(dict(
+            meta or {},
+            version=SNAPSHOT_VERSION,
+            num_papers=len(store),
+            groups=store.groups
+        ), outf)
+
+
+def write_snapshot(core: Dict, extended: Dict, lookup: PaperLookup, out_dir: str = SNAPSHOT_DIR, meta: Dict = None):
+    """
+    Write a dataset loaded with load_dataset as a columnar snapshot.
+
+    Each paper in lookup.papers becomes one PaperStore row: strings (DOIs,
+    SHAs, titles, venues, FoS metadata) are interned into string tables, FoS
+    entries and refs/cits are stored CSR-style, and each ref/cit is also
+    resolved to its row.
+    :param core:
+    :param extended:
+    :param lookup:
+    :param out_dir:
+    :param meta: extra metadata (e.g. source stamps) stored in meta.json
+    :return:
+    """
+    builder = PaperStoreBuilder()
+    for paper in lookup.papers:
+        builder.add(paper)
+    # ids of merged records, so they find their canonical paper as in lookup
+    for name in ('pid', 'doi', 'sha'):
+        for key, paper in getattr(lookup, f'{name}_dict').items():
+            builder.add_alias(name, key, builder.add(paper))
+    for section, section_dict in (('core', core), ('extended', extended)):
+        for venue_key, plist in section_dict.items():
+            for paper in plist:
+                builder.add_to_group(section, venue_key, paper)
+    save_snapshot(builder.build(), out_dir, meta)
+
+
+def load_snapshot(snapshot_dir: str = SNAPSHOT_DIR) -> Tuple[Dict, Dict, StoreLookup]:
+    """
+    Open a snapshot; same return values as load_dataset, with PaperViews in
+    place of Papers. Columns are memory-mapped and only paged in when touched.
+    :param snapshot_dir:
+    :return:
+    """
+    with open(os.path.join(snapshot_dir, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'Snapshot version mismatch in {snapshot_dir}; please re-export')
+    store = PaperStore.load(snapshot_dir, meta['groups'])
+    core, extended = split_groups(store)
+    return core, extended, StoreLookup(store)
+
+
+def _source_stamps(data_path: str) -> Dict:
+    return {
+        'dataset': file_stamp(data_path),
+        'dblp': file_stamp(DBLP_ALL_FILE) if os.path.exists(DBLP_ALL_FILE) else None
+    }
+
+
+def load_dataset_snapshot(
+        data_path: str = DATASET_PATH,
+        snapshot_dir: str = SNAPSHOT_DIR
+) -> Tuple[Dict, Dict, StoreLookup]:
+    """
+    Load the dataset from its snapshot, (re)exporting the snapshot first if it
+    is missing or older than the dataset or DBLP files
+    :param data_path:
+    :param snapshot_dir:
+    :return:
+    """
+    stamps = _source_stamps(data_path)
+    meta_file = os.path.join(snapshot_dir, 'meta.json')
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') == SNAPSHOT_VERSION and meta.get('sources') == stamps:
+            return load_snapshot(snapshot_dir)
+
+    store = build_dataset_store(data_path)
+    print('writing snapshot...')
+    tmp_dir = make_tmp_dir(snapshot_dir)
+    save_snapshot(store, tmp_dir, meta={'sources': stamps})
+    publish_dir(tmp_dir, snapshot_dir, replace=True)
+    return load_snapshot(snapshot_dir)
+
+
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH
+    core_ds, extended_ds, snapshot_lookup = load_dataset_snapshot(data_file)
+    print(f'{len(snapshot_lookup.papers)} papers in snapshot at {SNAPSHOT_DIR}')
@@ -0,0 +1,662 @@
+"""
+PaperLookup backed by an on-disk SQLite database, for datasets that do not
+fit in memory as Paper objects.
+
+ingest_dataset streams the gzipped dataset into the database (papers merged
+by shared ids as in load_dataset, their refs/cits resolved to paper ids in
+SQL, FoS and venue group membership);
+SqliteLookup then answers the same queries as PaperLookup, hydrating Paper
+objects on demand and keeping the most recently used ones in an LRU cache.
+
+usage: python biblio/sqlite_lookup.py [dataset_path] [db_path]
+"""
+
+import os, sys
+import json
+import sqlite3
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from biblio.papers import Paper, get_venue_normalizer
+from biblio.citation_graph import CitationGraph
+from biblio.load_dataset import iter_dataset, DATASET_PATH
+from biblio.entity_resolution import merge_papers
+from biblio.dblp_index import DBLP_ALL_FILE
+from biblio.utils.cache_utils import file_stamp
+from biblio.utils.profile_utils import PROFILER, count, phase
+
+
+SQLITE_DB_PATH = 'data/cache/a11y_bibliometrics.sqlite'
+
+# bump when the schema changes
+SQLITE_VERSION = 3
+
+# ids per IN (...) query, below SQLite's default limit on bound parameters
+QUERY_BATCH_SIZE = 500
+
+# papers hydrated per query when iterating over a sequence
+HYDRATE_BATCH_SIZE = 1000
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE papers (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE,
+    pid INTEGER,
+    doi TEXT,
+    sha TEXT,
+    venue TEXT,
+    year INTEGER,
+    title TEXT,
+    fos TEXT
+);
+CREATE TABLE edges (
+    src INTEGER,
+    direction INTEGER,
+    pos INTEGER,
+    pid INTEGER,
+    doi TEXT,
+    sha TEXT,
+    dst INTEGER,
+    PRIMARY KEY (src, direction, pos)
+) WITHOUT ROWID;
+CREATE TABLE paper_fos (fos_id INTEGER, name TEXT, paper INTEGER);
+CREATE TABLE group_members (
+    section TEXT,
+    venue_key TEXT,
+    pos INTEGER,
+    paper INTEGER,
+    UNIQUE (section, venue_key, paper)
+);
+CREATE TABLE alias_pid (pid INTEGER PRIMARY KEY, paper INTEGER);
+CREATE TABLE alias_doi (doi TEXT PRIMARY KEY, paper INTEGER) WITHOUT ROWID;
+CREATE TABLE alias_sha (sha TEXT PRIMARY KEY, paper INTEGER) WITHOUT ROWID;
+'''
+
+# records as read from the dataset, in a temporary database attached while ingesting;
+# label is the smallest record id in the record's group of shared ids once propagated
+STAGING_SCHEMA = '''
+CREATE TABLE staging.records (
+    id INTEGER PRIMARY KEY,
+    section TEXT,
+    venue_key TEXT,
+    pid INTEGER,
+    doi TEXT,
+    sha TEXT,
+    record TEXT,
+    label INTEGER,
+    paper INTEGER
+);
+CREATE TABLE staging.canonical (paper INTEGER PRIMARY KEY, label INTEGER UNIQUE);
+'''
+
+STAGING_INDEXES = '''
+CREATE INDEX staging.records_pid ON records (pid, label) WHERE pid IS NOT NULL;
+CREATE INDEX staging.records_doi ON records (doi, label) WHERE doi IS NOT NULL;
+CREATE INDEX staging.records_sha ON records (sha, label) WHERE sha IS NOT NULL;
+'''
+
+# records staged per insert
+STAGING_BATCH_SIZE = 10000
+
+# created after the bulk insert
+INDEXES = '''
+CREATE INDEX papers_venue_year ON papers (venue, year);
+CREATE INDEX paper_fos_id ON paper_fos (fos_id, paper);
+CREATE INDEX paper_fos_name ON paper_fos (name, paper);
+CREATE INDEX group_members_group ON group_members (section, venue_key, pos);
+'''
+
+DIRECTIONS = ('refs', 'cits')
+
+
+def _paper_key(pid, doi, sha) -> str:
+    # (pid, doi, sha) of a canonical paper, unique once records are merged
+    return json.dumps([int(pid) if pid else None, doi, sha])
+
+
+def _source_stamps(data_path: str) -> Dict:
+    return {
+        'dataset': file_stamp(data_path),
+        'dblp': file_stamp(DBLP_ALL_FILE) if os.path.exists(DBLP_ALL_FILE) else None
+    }
+
+
+def _batches(values: Sequence, size: int = QUERY_BATCH_SIZE) -> Iterator[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def ingest_dataset(data_path: str = DATASET_PATH, db_path: str = SQLITE_DB_PATH) -> str:
+    """
+    Stream the dataset into a new SQLite database at db_path (replacing any
+    existing one once complete). Records of the same paper (sharing a pid, DOI
+    or SHA) are merged as in load_dataset. The records are first copied into a
+    temporary staging database, where they are grouped by their ids and listed
+    in venue groups in SQL; each canonical paper is then merged from its staged
+    records, one paper at a time, so memory use does not grow with the dataset.
+    Every id of a merged record resolves to its canonical paper.
+    :param data_path:
+    :param db_path:
+    :return: db_path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    tmp_path = f'{db_path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    # the file is only published when complete, so no journal is needed
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executescript(SCHEMA)
+    # an empty file name gives a temporary database, deleted once detached
+    conn.execute("ATTACH DATABASE '' AS staging")
+    conn.execute('PRAGMA staging.journal_mode = OFF')
+    conn.executescript(STAGING_SCHEMA)
+
+    print('staging records...')
+    with phase('sqlite.stage'):
+        num_records = _stage_records(conn, data_path)
+
+    print('resolving paper ids...')
+    with phase('sqlite.resolve'):
+        num_papers = _group_staged_records(conn)
+        for column in ('pid', 'doi', 'sha'):
+            conn.execute(
+                f'INSERT INTO alias_{column} ({column}, paper) SELECT {column}, MIN(paper) FROM staging.records '
+                f'WHERE {column} IS NOT NULL GROUP BY {column}'
+            )
+        count('dataset.merged_records', num_records - num_papers)
+
+    print('ingesting papers...')
+    with phase('sqlite.ingest'):
+        # each canonical paper listed once per group, at its first record
+        conn.execute(
+            'INSERT OR IGNORE INTO group_members (section, venue_key, pos, paper) '
+            'SELECT section, venue_key, id, paper FROM staging.records ORDER BY id'
+        )
+        groups = [list(group) for group in conn.execute(
+            'SELECT section, venue_key FROM staging.records GROUP BY section, venue_key ORDER BY MIN(id)'
+        )]
+        paper_rows = []
+        edge_rows = []
+        fos_rows = []
+        for paper_id, paper in _iter_merged_papers(conn):
+            paper_rows.append((
+                paper_id, _paper_key(paper.pid, paper.doi, paper.sha), int(paper.pid) if paper.pid else None,
+                paper.doi, paper.sha, paper.venue, int(paper.year) if paper.year else None, paper.title,
+                json.dumps(paper.fos) if paper.fos else None
+            ))
+            for direction, edges in enumerate((paper.refs, paper.cits)):
+                edge_rows += [
+                    (paper_id, direction, pos, int(pid) if pid else None, doi or None, sha or None)
+                    for pos, (pid, doi, sha) in enumerate(edges)
+                ]
+            fos_rows += [(entry[0], entry[2], paper_id) for entry in dict(
+                ((entry[0], entry[2]), entry) for entry in (paper.fos or [])
+            ).values()]
+            if len(edge_rows) >= 100000 or len(paper_rows) >= 10000:
+                _flush_rows(conn, paper_rows, edge_rows, fos_rows)
+        _flush_rows(conn, paper_rows, edge_rows, fos_rows)
+
+    print('indexing...')
+    with phase('sqlite.index'):
+        conn.executescript(INDEXES)
+        for venue_key, venue in (('a11y_assets', 'conf/assets'), ('a11y_chi', 'conf/chi')):
+            conn.execute(
+                'INSERT INTO group_members (section, venue_key, pos, paper) '
+                'SELECT g.section, ?, g.pos, g.paper FROM group_members g JOIN papers p ON p.id = g.paper '
+                "WHERE g.section = 'core' AND g.venue_key = 'a11y' AND p.venue = ?",
+                (venue_key, venue)
+            )
+
+    print('resolving references and citations...')
+    with phase('sqlite.resolve_edges'):
+        # pid first, then DOI, then SHA, through the ids of every merged record, as in PaperLookup
+        conn.execute('''
+            UPDATE edges SET dst = COALESCE(
+                (SELECT a.paper FROM alias_pid a WHERE a.pid = edges.pid),
+                (SELECT a.paper FROM alias_doi a WHERE a.doi = LOWER(edges.doi)),
+                (SELECT a.paper FROM alias_sha a WHERE a.sha = LOWER(edges.sha)),
+                0
+            )
+        ''')
+
+    conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+        ('version', json.dumps(SQLITE_VERSION)),
+        ('sources', json.dumps(_source_stamps(data_path))),
+        ('num_papers', json.dumps(num_papers)),
+        ('groups', json.dumps(groups + [['core', 'a11y_assets'], ['core', 'a11y_chi']]))
+    ])
+    conn.commit()
+    conn.execute('DETACH DATABASE staging')
+    conn.execute('ANALYZE')
+    conn.close()
+    os.replace(tmp_path, db_path)
+    print(f'{num_papers} papers from {num_records} records in {db_path}')
+    return db_path
+
+
+def _flush_rows(conn: sqlite3.Connection, paper_rows: List, edge_rows: List, fos_rows: List):
+    conn.executemany(
+        'INSERT INTO papers (id, key, pid, doi, sha, venue, year, title, fos) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        paper_rows
+    )
+    conn.executemany('INSERT INTO edges (src, direction, pos, pid, doi, sha) VALUES (?, ?, ?, ?, ?, ?)', edge_rows)
+    conn.executemany('INSERT INTO paper_fos (fos_id, name, paper) VALUES (?, ?, ?)', fos_rows)
+    paper_rows.clear()
+    edge_rows.clear()
+    fos_rows.clear()
+
+
+def _stage_records(conn: sqlite3.Connection, data_path: str) -> int:
+    """
+    Copy the core and extended records of the dataset into staging.records
+    :param conn:
+    :param data_path:
+    :return: number of records
+    """
+    rows = []
+    num_records = 0
+    for section, venue_key, paper in iter_dataset(data_path):
+        if section not in ('core', 'extended'):
+            continue
+        num_records += 1
+        rows.append((
+            num_records, section, venue_key, int(paper.pid) if paper.pid else None, paper.doi or None,
+            paper.sha or None, json.dumps(paper.as_json()), num_records
+        ))
+        if len(rows) >= STAGING_BATCH_SIZE:
+            conn.executemany('INSERT INTO staging.records (id, section, venue_key, pid, doi, sha, record, label) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            rows.clear()
+    conn.executemany('INSERT INTO staging.records (id, section, venue_key, pid, doi, sha, record, label) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    return num_records
+
+
+def _group_staged_records(conn: sqlite3.Connection) -> int:
+    """
+    Group staged records that share a pid, DOI or SHA (transitively), as
+    entity_resolution.group_records does, in SQL: every record starts with its
+    own id as label and takes the smallest label among records sharing one of
+    its ids until no label changes. Groups are then numbered from 1 in order of
+    their first record, as canonical paper ids.
+    :param conn:
+    :return: number of canonical papers
+    """
+    conn.executescript(STAGING_INDEXES)
+    changed = True
+    while changed:
+        changed = False
+        for column in ('pid', 'doi', 'sha'):
+            before = conn.total_changes
+            conn.execute(f'''
+                UPDATE staging.records SET label = (
+                    SELECT MIN(r.label) FROM staging.records r WHERE r.{column} = records.{column}
+                )
+                WHERE {column} IS NOT NULL AND label > (
+                    SELECT MIN(r.label) FROM staging.records r WHERE r.{column} = records.{column}
+                )
+            ''')
+            changed |= conn.total_changes != before
+    conn.execute('INSERT INTO staging.canonical (label) SELECT DISTINCT label FROM staging.records ORDER BY label')
+    conn.execute('UPDATE staging.records SET paper = (SELECT c.paper FROM staging.canonical c WHERE c.label = records.label)')
+    conn.execute('CREATE INDEX staging.records_paper ON records (paper, id)')
+    return conn.execute('SELECT COUNT(*) FROM staging.canonical').fetchone()[0]
+
+
+def _iter_merged_papers(conn: sqlite3.Connection) -> Iterator[Tuple[int, Paper]]:
+    """
+    Merge the staged records of each canonical paper, one paper at a time
+    :param conn:
+    :return: iterator of (paper id, merged paper), in paper id order
+    """
+    paper_id = None
+    members = []
+    for row_paper, record in conn.execute('SELECT paper, record FROM staging.records ORDER BY paper, id'):
+        if row_paper != paper_id and members:
+            yield paper_id, merge_papers(members)
+            members = []
+        paper_id = row_paper
+        members.append(Paper.from_normalized(**json.loads(record)))
+    if members:
+        yield paper_id, merge_papers(members)
+
+
+class SqlitePaperSequence(Sequence):
+    """
+    Read-only sequence of papers of a SqliteLookup, hydrated on access
+    """
+    def __init__(self, lookup: 'SqliteLookup', ids: np.ndarray):
+        self.lookup = lookup
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return SqlitePaperSequence(self.lookup, self.ids[ind])
+        return self.lookup.get_papers_by_ids([int(self.ids[ind])])[0]
+
+    def __iter__(self) -> Iterator[Paper]:
+        for batch in _batches(self.ids, HYDRATE_BATCH_SIZE):
+            yield from self.lookup.get_papers_by_ids([int(i) for i in batch])
+
+    def __add__(self, other) -> List:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> List:
+        return list(other) + list(self)
+
+
+class SqliteLookup:
+    """
+    PaperLookup-compatible lookup over a database written by ingest_dataset.
+    Paper ids are dense (0 to number of papers - 1) as in PaperLookup.
+    """
+    def __init__(self, db_path: str = SQLITE_DB_PATH, cache_size: int = 2 ** 16):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._conn = None
+        self._conn_pid = None
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.meta = {key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM meta')}
+        if self.meta.get('version') != SQLITE_VERSION:
+            raise ValueError(f'Database version mismatch in {db_path}; please re-ingest')
+        self.papers = SqlitePaperSequence(self, np.arange(self.meta['num_papers'], dtype=np.int64))
+        self._graph = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # connections must not be shared with forked processes
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(f'file:{os.path.abspath(self.db_path)}?mode=ro', uri=True)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _ids(self, query: str, params: Tuple = ()) -> np.ndarray:
+        # row ids from SQLite start at 1
+        return np.array([row[0] - 1 for row in self.conn.execute(query, params)], dtype=np.int64)
+
+    def _hydrate(self, ids: List[int]) -> Dict[int, Paper]:
+        papers = dict()
+        for batch in _batches(ids):
+            marks = ','.join('?' * len(batch))
+            row_ids = [i + 1 for i in batch]
+            edges = {row_id: ([], []) for row_id in row_ids}
+            for src, direction, pid, doi, sha in self.conn.execute(
+                    f'SELECT src, direction, pid, doi, sha FROM edges WHERE src IN ({marks}) ORDER BY src, direction, pos',
+                    row_ids
+            ):
+                edges[src][direction].append([pid, doi, sha])
+            for row_id, pid, doi, sha, venue, year, title, fos in self.conn.execute(
+                    f'SELECT id, pid, doi, sha, venue, year, title, fos FROM papers WHERE id IN ({marks})',
+                    row_ids
+            ):
+                refs, cits = edges[row_id]
+                papers[row_id - 1] = Paper.from_normalized(
+                    pid, doi, sha, venue, year, json.loads(fos) if fos else None, title, refs, cits
+                )
+        return papers
+
+    def get_papers_by_ids(self, ids: List[int]) -> List[Optional[Paper]]:
+        """
+        Papers by dense id (None for -1), from the LRU cache or hydrated in batched queries
+        :param ids:
+        :return:
+        """
+        cache = self._cache
+        missing = [i for i in dict.fromkeys(ids) if i >= 0 and i not in cache]
+        self.misses += len(missing)
+        self.hits += sum(1 for i in ids if i >= 0) - len(missing)
+        if PROFILER.enabled:
+            count('sqlite.papers_hydrated', len(missing))
+        hydrated = self._hydrate(missing) if missing else dict()
+        results = []
+        for i in ids:
+            if i < 0:
+                results.append(None)
+                continue
+            paper = hydrated.get(i)
+            if paper is None:
+                paper = cache[i]
+                cache.move_to_end(i)
+            else:
+                cache[i] = paper
+            results.append(paper)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return results
+
+    def cache_stats(self) -> Dict:
+        """
+        Paper cache statistics
+        :return:
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.,
+            'size': len(self._cache),
+            'max_size': self.cache_size
+        }
+
+    def _find_ids(self, column: str, keys: List) -> Dict:
+        # id -> paper id for a batch of pids/DOIs/SHAs, through the ids of every merged record
+        found = dict()
+        keys = list(dict.fromkeys(keys))
+        for batch in _batches(keys):
+            marks = ','.join('?' * len(batch))
+            found.update(
+                (key, row_id - 1) for key, row_id in self.conn.execute(
+                    f'SELECT {column}, paper FROM alias_{column} WHERE {column} IN ({marks})', batch
+                )
+            )
+        return found
+
+    def get_paper_ids_by_triples(self, triples: Sequence) -> List[int]:
+        """
+        Dense ids of many [pid, doi, sha] triples (matching on pid, then DOI, then SHA), -1 if unresolved
+        :param triples:
+        :return:
+        """
+        pids = [int(pid) if pid else None for pid, _, _ in triples]
+        dois = [doi.lower() if doi else None for _, doi, _ in triples]
+        shas = [sha.lower() if sha else None for _, _, sha in triples]
+        by_pid = self._find_ids('pid', [pid for pid in pids if pid])
+        by_doi = self._find_ids('doi', [doi for pid, doi in zip(pids, dois) if doi and pid not in by_pid])
+        by_sha = self._find_ids('sha', [
+            sha for pid, doi, sha in zip(pids, dois, shas) if sha and pid not in by_pid and doi not in by_doi
+        ])
+        ids = []
+        for pid, doi, sha in zip(pids, dois, shas):
+            paper_id = by_pid.get(pid, -1) if pid else -1
+            if paper_id < 0 and doi:
+                paper_id = by_doi.get(doi, -1)
+            if paper_id < 0 and sha:
+                paper_id = by_sha.get(sha, -1)
+            ids.append(paper_id)
+        return ids
+
+    def get_papers_by_triples(self, triples: Sequence) -> List[Optional[Paper]]:
+        """
+        Batched get_paper_by_triple
+        :param triples:
+        :return:
+        """
+        papers = self.get_papers_by_ids(self.get_paper_ids_by_triples(triples))
+        if PROFILER.enabled:
+            resolved = sum(1 for p in papers if p)
+            count('lookup.triples_resolved', resolved)
+            count('lookup.triples_unresolved', len(papers) - resolved)
+        return papers
+
+    def get_paper_by_triple(self, paper_ids):
+        return self.get_papers_by_triples([paper_ids])[0]
+
+    def get_paper_by_pid(self, pid: int):
+        return self.get_paper_by_triple([pid, None, None])
+
+    def get_paper_by_doi(self, doi: str):
+        return self.get_paper_by_triple([None, doi, None])
+
+    def get_paper_by_sha(self, sha: str):
+        return self.get_paper_by_triple([None, None, sha])
+
+    def get_paper_id(self, paper: Optional[Paper]) -> int:
+        """
+        Dense integer id of a paper, or -1 if not in the database
+        :param paper:
+        :return:
+        """
+        if paper is None:
+            return -1
+        row = self.conn.execute(
+            'SELECT id FROM papers WHERE key = ?', (_paper_key(paper.pid, paper.doi, paper.sha),)
+        ).fetchone()
+        return row[0] - 1 if row else -1
+
+    @property
+    def graph(self) -> CitationGraph:
+        """
+        Citation graph over paper ids, from the edges resolved at ingestion
+        :return:
+        """
+        if self._graph is None:
+            with phase('lookup.citation_graph'):
+                arrays = []
+                for direction in range(len(DIRECTIONS)):
+                    edges = np.array(self.conn.execute(
+                        'SELECT src, dst FROM edges WHERE direction = ? ORDER BY src, pos', (direction,)
+                    ).fetchall(), dtype=np.int64).reshape(-1, 2)
+                    ptr = np.zeros(len(self.papers) + 1, dtype=np.int64)
+                    np.cumsum(np.bincount(edges[:, 0] - 1, minlength=len(self.papers)), out=ptr[1:])
+                    arrays += [ptr, edges[:, 1] - 1]
+                self._graph = CitationGraph.from_resolved(*arrays)
+            count('graph.unresolved_refs', self._graph.num_unresolved('refs'))
+            count('graph.unresolved_cits', self._graph.num_unresolved('cits'))
+        return self._graph
+
+    def get_group(self, section: str, venue_key: str) -> SqlitePaperSequence:
+        """
+        Papers of dataset[section][venue_key], in dataset order
+        :param section: 'core' or 'extended'
+        :param venue_key:
+        :return:
+        """
+        return SqlitePaperSequence(self, self._ids(
+            'SELECT paper FROM group_members WHERE section = ? AND venue_key = ? ORDER BY pos',
+            (section, venue_key)
+        ))
+
+    def _normalize_venue_query(self, venue_str: str) -> Optional[str]:
+        return get_venue_normalizer().normalize(venue_str)[0]
+
+    def get_papers_in_venue(self, venue_str: str) -> SqlitePaperSequence:
+        norm_venue = self._normalize_venue_query(venue_str)
+        ids = self._ids('SELECT id FROM papers WHERE venue = ? ORDER BY id', (norm_venue,)) \
+            if norm_venue else np.zeros(0, dtype=np.int64)
+        return SqlitePaperSequence(self, ids)
+
+    def get_papers_in_venue_by_year(self, venue_str: str) -> Tuple[Dict, SqlitePaperSequence]:
+        norm_venue = self._normalize_venue_query(venue_str)
+        if not norm_venue:
+            return defaultdict(tuple), SqlitePaperSequence(self, np.zeros(0, dtype=np.int64))
+        rows = self.conn.execute('SELECT id, year FROM papers WHERE venue = ? ORDER BY id', (norm_venue,)).fetchall()
+        by_year = dict()
+        no_year = []
+        for row_id, year in rows:
+            if year:
+                by_year.setdefault(year, []).append(row_id - 1)
+            else:
+                no_year.append(row_id - 1)
+        return (
+            defaultdict(tuple, {
+                year: SqlitePaperSequence(self, np.array(by_year[year], dtype=np.int64)) for year in sorted(by_year)
+            }),
+            SqlitePaperSequence(self, np.array(no_year, dtype=np.int64))
+        )
+
+    def get_papers_in_venue_by_year_range(
+            self,
+            venue_str: str,
+            start_year: Optional[int] = None,
+            end_year: Optional[int] = None
+    ) -> SqlitePaperSequence:
+        """
+        Get papers in venue published from start_year to end_year (inclusive),
+        ordered by year; papers without a year are excluded
+        :param venue_str:
+        :param start_year: no lower bound if None
+        :param end_year: no upper bound if None
+        :return:
+        """
+        norm_venue = self._normalize_venue_query(venue_str)
+        if not norm_venue:
+            return SqlitePaperSequence(self, np.zeros(0, dtype=np.int64))
+        return SqlitePaperSequence(self, self._ids(
+            'SELECT id FROM papers WHERE venue = ? AND year > 0 AND year >= ? AND year <= ? ORDER BY year, id',
+            (norm_venue, start_year if start_year is not None else 0, end_year if end_year is not None else 2 ** 31)
+        ))
+
+    def get_papers_in_fos(self, fos: Union[str, int]) -> SqlitePaperSequence:
+        """
+        Get papers tagged with a FoS, given by name (str) or MAG id (int)
+        :param fos:
+        :return:
+        """
+        column = 'name' if isinstance(fos, str) else 'fos_id'
+        return SqlitePaperSequence(self, self._ids(
+            f'SELECT DISTINCT paper FROM paper_fos WHERE {column} = ? ORDER BY paper', (fos,)
+        ))
+
+
+def load_dataset_sqlite(
+        data_path: str = DATASET_PATH,
+        db_path: str = SQLITE_DB_PATH,
+        cache_size: int = 2 ** 16
+) -> Tuple[Dict, Dict, SqliteLookup]:
+    """
+    Open the dataset's SQLite database, (re)ingesting it first if it is
+    missing or older than the dataset or DBLP files. Same return values as
+    load_dataset; papers are hydrated from the database when accessed.
+    :param data_path:
+    :param db_path:
+    :param cache_size: number of hydrated papers kept in memory
+    :return:
+    """
+    lookup = None
+    if os.path.exists(db_path):
+        try:
+            lookup = SqliteLookup(db_path, cache_size)
+        except (sqlite3.Error, ValueError):
+            lookup = None
+        if lookup is not None and lookup.meta.get('sources') != _source_stamps(data_path):
+            lookup.close()
+            lookup = None
+    if lookup is None:
+        ingest_dataset(data_path, db_path)
+        lookup = SqliteLookup(db_path, cache_size)
+    core = dict()
+    extended = dict()
+    for section, venue_key in lookup.meta['groups']:
+        (core if section == 'core' else extended)[venue_key] = lookup.get_group(section, venue_key)
+    return core, extended, lookup
+
+
+if __name__ == '__main__':
+    data_file = sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH
+    db_file = sys.argv[2] if len(sys.argv) > 2 else SQLITE_DB_PATH
+    ingest_dataset(data_file, db_file)
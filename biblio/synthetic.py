@@ -0,0 +1,178 @@
+"""
+Deterministic synthetic data in the same formats as the downloadable
+datasets, for benchmarking without the real files.
+
+generate_synthetic_data(root, scale) writes, relative to root:
+    data/analysis/a11y_bibliometrics_dataset.jsonl.gz
+    data/analysis/a11y_bibliometrics_mag_fos.jsonl.gz
+    data/dblp_papers_by_conference.json.gz
+so scripts and loaders run unchanged with root as the working directory.
+
+usage: python biblio/synthetic.py out_dir [scale]
+"""
+
+import os, sys
+import json
+import gzip
+import random
+from typing import Dict, List
+
+from biblio.papers import S2_VENUE_NORMALIZATION
+from biblio.constants import VENUES_TO_PLOT
+
+
+# papers at scale 1
+BASE_NUM_PAPERS = 2000
+
+# share of papers in the core a11y set
+CORE_FRACTION = 0.15
+
+NUM_L0_FOS = 19
+NUM_L1_FOS = 292
+# level-2 FoS at scale 1
+BASE_NUM_L2_FOS = 1000
+
+MIN_YEAR = 1994
+MAX_YEAR = 2021
+
+# venues outside VENUES_TO_PLOT, as raw S2 strings
+OTHER_S2_VENUES = [
+    'Lecture Notes in Computer Science', 'ACM Trans. Access. Comput.', 'Universal Access in the Information Society',
+    'Disability and rehabilitation. Assistive technology', 'Journal of Visual Impairment & Blindness',
+    'IEEE Transactions on Biomedical Engineering', 'Studies in health technology and informatics', 'arXiv'
+]
+
+
+def _s2_names(venue: str) -> List[str]:
+    # raw S2 strings that normalize to a DBLP venue key
+    names = [s2 for s2, norm in S2_VENUE_NORMALIZATION.items() if norm == venue]
+    return names or [venue]
+
+
+def _make_mag(rng: random.Random, scale: float) -> List[Dict]:
+    """
+    Levels 0-2 of a MAG-like FoS hierarchy
+    """
+    entries = []
+    l0_ids = list(range(1, NUM_L0_FOS + 1))
+    for m in l0_ids:
+        entries.append({'mag_id': m, 'level': 0, 'l0_parent': [], 'l1_parent': [], 'normalizedname': f'field {m}'})
+    l1_ids = list(range(1000, 1000 + NUM_L1_FOS))
+    for m in l1_ids:
+        l0_parent = rng.sample(l0_ids, 1 if rng.random() < 0.8 else 2)
+        entries.append({'mag_id': m, 'level': 1, 'l0_parent': l0_parent, 'l1_parent': [], 'normalizedname': f'topic {m}'})
+    l1_parents = {e['mag_id']: e['l0_parent'] for e in entries if e['level'] == 1}
+    for m in range(100000, 100000 + int(BASE_NUM_L2_FOS * scale)):
+        l1_parent = rng.sample(l1_ids, 1 if rng.random() < 0.7 else 2)
+        l0_parent = sorted(set(p for l1 in l1_parent for p in l1_parents[l1]))
+        entries.append({'mag_id': m, 'level': 2, 'l0_parent': l0_parent, 'l1_parent': l1_parent, 'normalizedname': f'subtopic {m}'})
+    return entries
+
+
+def _make_fos(rng: random.Random, mag_by_level: Dict[int, List[Dict]], focus: int) -> List:
+    """
+    FoS entries of one paper, [mag_id, score, normalizedname, displayname, level],
+    clustered around a focus L1 topic so that diversity varies between papers
+    """
+    if rng.random() < 0.05:
+        return None
+    fos = []
+    l1 = mag_by_level[1]
+    chosen = {focus} | set(rng.randrange(len(l1)) for _ in range(rng.randint(0, 3)))
+    for ind in chosen:
+        entry = l1[ind]
+        for l0 in entry['l0_parent']:
+            fos.append([l0, round(rng.random(), 4), f'field {l0}', f'Field {l0}', 0])
+        fos.append([entry['mag_id'], round(rng.random(), 4), entry['normalizedname'], entry['normalizedname'].title(), 1])
+    for entry in rng.sample(mag_by_level[2], rng.randint(0, 4)):
+        fos.append([entry['mag_id'], round(rng.random(), 4), entry['normalizedname'], entry['normalizedname'].title(), 2])
+    return fos
+
+
+def generate_synthetic_data(root: str, scale: float = 1, seed: int = 0) -> Dict[str, str]:
+    """
+    Write a synthetic dataset, MAG FoS file and DBLP file under root
+    :param root:
+    :param scale: 1 is BASE_NUM_PAPERS papers; 10 and 100 for larger runs
+    :param seed: same seed and scale give byte-identical files
+    :return: paths of the written files
+    """
+    rng = random.Random(seed)
+    num_papers = int(BASE_NUM_PAPERS * scale)
+    num_core = int(num_papers * CORE_FRACTION)
+
+    mag = _make_mag(rng, scale)
+    mag_by_level = {level: [e for e in mag if e['level'] == level] for level in (0, 1, 2)}
+
+    extended_venues = [v for v in VENUES_TO_PLOT] + OTHER_S2_VENUES
+    dblp = {venue: [] for venue in VENUES_TO_PLOT}
+    papers = []
+    for i in range(num_papers):
+        is_core = i < num_core
+        venue_key = rng.choice(['conf/chi', 'conf/assets']) if is_core else rng.choice(extended_venues)
+        year = rng.randint(MIN_YEAR, MAX_YEAR)
+        doi = f'10.{1000 + i % 7000}/synthetic.{i}' if rng.random() < 0.8 else None
+        s2_venue = rng.choice(_s2_names(venue_key))
+        if venue_key in dblp and rng.random() < 0.3:
+            # S2 venue strings sometimes carry the year
+            s2_venue = f"{s2_venue} '{year % 100:02d}" if rng.random() < 0.5 else f'{s2_venue} {year}'
+        paper = {
+            'pid': 100000 + i,
+            'doi': doi,
+            'sha': f'{rng.getrandbits(160):040x}' if rng.random() < 0.9 else None,
+            'venue': s2_venue,
+            'year': year if rng.random() < 0.95 else None,
+            'fos': _make_fos(rng, mag_by_level, rng.randrange(NUM_L1_FOS)),
+            'title': f'Synthetic paper {i}',
+            'refs': [],
+            'cits': []
+        }
+        papers.append((is_core, venue_key, paper))
+        if doi and venue_key in dblp and rng.random() < 0.6:
+            # DBLP DOIs are not consistently cased
+            dblp_doi = doi.upper() if rng.random() < 0.3 else doi
+            dblp[venue_key].append({'doi': dblp_doi, 'year': year, 'title': paper['title']})
+
+    # references to earlier papers, skewed towards a popular few; each
+    # resolved reference is mirrored as a citation of the referenced paper
+    for i, (_, _, paper) in enumerate(papers):
+        if i == 0:
+            continue
+        for _ in range(rng.randint(0, 25)):
+            j = int(i * rng.random() ** 2)
+            ref = papers[j][2]
+            paper['refs'].append([str(ref['pid']), ref['doi'], ref['sha']])
+            ref['cits'].append([str(paper['pid']), paper['doi'], paper['sha']])
+        # references outside the dataset
+        for k in range(rng.randint(0, 5)):
+            paper['refs'].append([str(900000000 + i * 8 + k), None, None])
+
+    core = {'a11y': [paper for is_core, _, paper in papers if is_core]}
+    extended = dict()
+    for is_core, venue_key, paper in papers:
+        if not is_core:
+            extended.setdefault(venue_key, []).append(paper)
+
+    paths = {
+        'dataset': os.path.join(root, 'data', 'analysis', 'a11y_bibliometrics_dataset.jsonl.gz'),
+        'mag': os.path.join(root, 'data', 'analysis', 'a11y_bibliometrics_mag_fos.jsonl.gz'),
+        'dblp': os.path.join(root, 'data', 'dblp_papers_by_conference.json.gz')
+    }
+    os.makedirs(os.path.dirname(paths['dataset']), exist_ok=True)
+    # mtime=0 keeps the gzip output identical across runs
+    with gzip.GzipFile(paths['dataset'], 'wb', mtime=0) as outf:
+        outf.write(json.dumps({'core': core, 'extended': extended}).encode('utf-8'))
+    with gzip.GzipFile(paths['mag'], 'wb', mtime=0) as outf:
+        for entry in mag:
+            outf.write((json.dumps(entry) + '\n').encode('utf-8'))
+    with gzip.GzipFile(paths['dblp'], 'wb', mtime=0) as outf:
+        outf.write(json.dumps(dblp).encode('utf-8'))
+    return paths
+
+
+if __name__ == '__main__':
+    out_root = sys.argv[1]
+    data_scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    written = generate_synthetic_data(out_root, data_scale)
+    for name, path in written.items():
+        print(f'{name}\t{path}')
@@ -0,0 +1,58 @@
+"""
+Utilities for on-disk caches of derived data
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+
+def file_stamp(path: str) -> Dict:
+    """
+    Identify a source file by path, size and mtime, for cache invalidation
+    :param path:
+    :return:
+    """
+    stat = os.stat(path)
+    return {
+        'source': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns
+    }
+
+
+def make_tmp_dir(final_dir: str) -> str:
+    """
+    Create a private scratch directory next to final_dir, to be published with publish_dir
+    :param final_dir:
+    :return:
+    """
+    parent = os.path.dirname(os.path.abspath(final_dir))
+    os.makedirs(parent, exist_ok=True)
+    return tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+
+
+def publish_dir(tmp_dir: str, final_dir: str, replace: bool = False):
+    """
+    Atomically move a fully written directory into place, so readers never
+    see a partial cache. If final_dir already exists it is kept (another
+    process finished first) unless replace is set.
+    :param tmp_dir:
+    :param final_dir:
+    :param replace:
+    :return:
+    """
+    old_dir: Optional[str] = None
+    if replace and os.path.exists(final_dir):
+        old_dir = make_tmp_dir(final_dir)
+        os.rmdir(old_dir)
+        os.rename(final_dir, old_dir)
+    try:
+        os.rename(tmp_dir, final_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.exists(final_dir):
+            raise
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
@@ -0,0 +1,47 @@
+"""
+Utilities for hashing string identifiers into fixed-width integer keys
+"""
+
+import hashlib
+from typing import Iterable
+
+import numpy as np
+
+
+# width of hashed keys, in bytes (uint64)
+HASH_BYTES = 8
+
+
+def hash_str(s: str) -> int:
+    """
+    Hash a string identifier (DOI, SHA, ...) to an unsigned 64-bit integer
+    :param s:
+    :return:
+    """
+    return int.from_bytes(
+        hashlib.blake2b(s.encode('utf-8'), digest_size=HASH_BYTES).digest(),
+        'little'
+    )
+
+
+def hash_strs(strs: Iterable[str]) -> np.ndarray:
+    """
+    Hash a sequence of string identifiers into a uint64 array
+    :param strs:
+    :return:
+    """
+    return np.fromiter((hash_str(s) for s in strs), dtype=np.uint64)
+
+
+def find_sorted(sorted_hashes: np.ndarray, s: str) -> int:
+    """
+    Position of the hash of s in a sorted uint64 array, or -1 if absent
+    :param sorted_hashes:
+    :param s:
+    :return:
+    """
+    h = np.uint64(hash_str(s))
+    ind = int(np.searchsorted(sorted_hashes, h))
+    if ind < len(sorted_hashes) and sorted_hashes[ind] == h:
+        return ind
+    return -1
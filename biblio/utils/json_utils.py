@@ -0,0 +1,151 @@
+"""
+Utilities for incrementally parsing large JSON documents
+"""
+
+import json
+from typing import Any, Iterator, Optional, Set, Tuple, TextIO
+
+
+# characters read from the underlying file per refill
+CHUNK_SIZE = 1 << 20
+
+
+class JsonStreamReader:
+    """
+    Pull parser over a text stream holding a single JSON document. Containers
+    are walked token by token, and leaf values are decoded one at a time, so
+    only the value currently being decoded has to fit in memory.
+    """
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Next non-whitespace character (without consuming it); '' at end of stream
+        :return:
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, ch: str):
+        """
+        Consume a structural character
+        :param ch:
+        :return:
+        """
+        found = self.peek()
+        if found != ch:
+            raise json.JSONDecodeError(f'Expecting {ch!r}, found {found!r}', self.buf, self.pos)
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        """
+        Decode the next complete JSON value
+        :return:
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # value is (probably) cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # a number may have been cut off at the buffer boundary (e.g. '2.' of
+            # '2.5'); it is only complete once a delimiter follows it
+            if self.buf[self.pos] not in '{["':
+                next_pos = end
+                while next_pos < len(self.buf) and self.buf[next_pos] in ' \t\n\r':
+                    next_pos += 1
+                truncated = next_pos == len(self.buf) or self.buf[next_pos] not in ',]}:'
+                if truncated and self._fill():
+                    continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        """
+        Consume the next JSON value without keeping it
+        :return:
+        """
+        if self.peek() in '{[':
+            for _ in self.iter_items():
+                self.skip_value()
+        else:
+            self.read_value()
+
+    def iter_items(self) -> Iterator[Optional[str]]:
+        """
+        Walk the members of the next object or array. For each member, yields
+        its key (None for array elements) with the reader positioned at the
+        member's value; the caller must consume the value before resuming.
+        :return:
+        """
+        opener = self.peek()
+        if opener not in '{[':
+            raise json.JSONDecodeError('Expecting object or array', self.buf, self.pos)
+        closer = '}' if opener == '{' else ']'
+        self.pos += 1
+        if self.peek() == closer:
+            self.pos += 1
+            return
+        while True:
+            if opener == '{':
+                key = self.read_value()
+                self.expect(':')
+                yield key
+            else:
+                yield None
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(closer)
+                return
+
+
+def iter_grouped_records(
+        f: TextIO,
+        sections: Optional[Set[str]] = None
+) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Stream records from a document of the form {section: {group: [record, ...]}}
+    :param f: text stream
+    :param sections: sections to read (others are skipped); None reads all
+    :return: iterator of (section, group, record)
+    """
+    reader = JsonStreamReader(f)
+    remaining = set(sections) if sections is not None else None
+    for section in reader.iter_items():
+        if remaining is not None and section not in remaining:
+            reader.skip_value()
+            continue
+        for group in reader.iter_items():
+            for _ in reader.iter_items():
+                yield section, group, reader.read_value()
+        if remaining is not None:
+            remaining.discard(section)
+            # no need to scan the rest of the file
+            if not remaining:
+                return
@@ -1,8 +1,30 @@
 import os, sys
-from typing import Dict, Set, Optional, List
+import hashlib
+from typing import Dict, Set, Optional, List, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse
 
 from biblio.load_fos import MagLookup
 from biblio.papers import Paper, PaperLookup
+from biblio.utils.profile_utils import count, phase
+
+
+def get_neighbor_papers(paper: Paper, lookup: PaperLookup, direction: str) -> List[Paper]:
+    """
+    Papers referenced by (direction='refs') or citing (direction='cits') a paper,
+    read from the lookup's citation graph; unresolved neighbors are omitted
+    :param paper:
+    :param lookup:
+    :param direction:
+    :return:
+    """
+    paper_id = lookup.get_paper_id(paper)
+    if paper_id < 0:
+        # paper is not part of the lookup; resolve its triples directly
+        edges = paper.refs if direction == 'refs' else paper.cits
+        return [p for p in (lookup.get_paper_by_triple(triple) for triple in edges) if p]
+    return [lookup.papers[j] for j in lookup.graph.neighbors(paper_id, direction)]
 
 
 # prop : dict(key=mag_id, value=count_of_papers_with_mag_id)
@@ -16,19 +38,26 @@ def compute_lcdi(prop: Dict, this_fos: List, mag_lookup: MagLookup) -> float:
     :param mag_lookup:
     :return:
     """
+    count('lcdi.compute_calls')
     # proportion for normalizing each summation in denominator
     j_norm_prop = 1. / len(this_fos)
 
     # total number of papers
     total_p = sum(prop.values())
 
+    # proportions and similarities over every FoS in prop
+    fos_ids = list(prop.keys())
+    p = np.fromiter(prop.values(), dtype=np.float64, count=len(fos_ids)) / total_p
+    sim = mag_lookup.sim_matrix(fos_ids)
+
     # compute denominator (sum(s_ij p_i p_j))
+    fos_index = {mag_id: k for k, mag_id in enumerate(fos_ids)}
     denom = 0
     for j in this_fos:
-        sum_val = 0
-        for i, p_i in prop.items():
-            sum_val += mag_lookup.sim(i, j) * (p_i / total_p) * (prop.get(j, 0) / total_p)
-        denom += j_norm_prop * sum_val
+        k = fos_index.get(j)
+        if k is None:
+            continue
+        denom += j_norm_prop * float(sim[:, k] @ p) * p[k]
 
     return 1. / denom
 
@@ -47,8 +76,10 @@ def compute_lcdi_for_paper_refs_l1(
     if paper.l1_fos:
         this_fos_dict = list(set([fos[0] for fos in paper.l1_fos]))
     else:
+        count('lcdi.papers_skipped_no_fos')
         return None
     if not this_fos_dict:
+        count('lcdi.papers_skipped_no_fos')
         return None
 
     # initialize fos prop
@@ -56,7 +87,7 @@ def compute_lcdi_for_paper_refs_l1(
     for mag_id in this_fos_dict:
         p_dict[mag_id] += 1. / len(this_fos_dict)
 
-    ref_papers = [lookup.get_paper_by_triple(ref) for ref in paper.refs]
+    ref_papers = get_neighbor_papers(paper, lookup, 'refs')
     for ref in ref_papers:
         if ref.l1_fos:
             ref_l1_fos = [fos[0] for fos in ref.l1_fos]
@@ -83,8 +114,10 @@ def compute_lcdi_for_paper_cits_l1(
     if paper.l1_fos:
         this_fos_dict = list(set([fos[0] for fos in paper.l1_fos]))
     else:
+        count('lcdi.papers_skipped_no_fos')
         return None
     if not this_fos_dict:
+        count('lcdi.papers_skipped_no_fos')
         return None
 
     # initialize fos prop
@@ -92,10 +125,8 @@ def compute_lcdi_for_paper_cits_l1(
     for mag_id in this_fos_dict:
         p_dict[mag_id] += 1. / len(this_fos_dict)
 
-    cit_papers = [lookup.get_paper_by_triple(ref) for ref in paper.cits]
+    cit_papers = get_neighbor_papers(paper, lookup, 'cits')
     for cit in cit_papers:
-        if not cit:
-            continue
         if cit.l1_fos:
             cit_l1_fos = [fos[0] for fos in cit.l1_fos]
         else:
@@ -104,4 +135,347 @@ def compute_lcdi_for_paper_cits_l1(
             p_dict[mag_id] += 1. / len(cit_l1_fos)
 
     lcdi = compute_lcdi(p_dict, this_fos_dict, mag_lookup)
-    return lcdi
\ No newline at end of file
+    return lcdi
+
+
+def fos_weight_matrix(lookup: PaperLookup, level: int = 1) -> Tuple[scipy.sparse.csr_matrix, List[int]]:
+    """
+    Sparse (papers x FoS) matrix with row i spreading weight 1 evenly over the
+    FoS entries of the given level of lookup.papers[i] (zero row if it has none),
+    i.e. the contribution of a neighbor to a paper's FoS proportions
+    :param lookup:
+    :param level:
+    :return: matrix and the FoS id of each column
+    """
+    num_papers = len(lookup.papers)
+    store = getattr(lookup, 'store', None)
+    if store is not None:
+        cols = store.columns
+        entry_rows = np.repeat(np.arange(num_papers), np.diff(cols['fos_ptr']))
+        at_level = np.asarray(cols['fos_level']) == level
+        rows = entry_rows[at_level]
+        fos_ids = np.asarray(cols['fos_id'])[at_level]
+    else:
+        rows = []
+        fos_ids = []
+        for i, p in enumerate(lookup.papers):
+            level_fos = [entry[0] for entry in p.fos if entry[-1] == level] if p and p.fos else []
+            rows += [i] * len(level_fos)
+            fos_ids += level_fos
+        rows = np.array(rows, dtype=np.int64)
+        fos_ids = np.array(fos_ids, dtype=np.int64)
+
+    col_ids, cols_of_entries = np.unique(fos_ids, return_inverse=True)
+    counts = np.bincount(rows, minlength=num_papers)
+    weights = 1. / counts[rows] if len(rows) else np.zeros(0)
+    # duplicate entries are summed, as repeated += in the per-paper functions
+    matrix = scipy.sparse.csr_matrix(
+        (weights, (rows, cols_of_entries)),
+        shape=(num_papers, len(col_ids))
+    )
+    return matrix, col_ids.tolist()
+
+
+def neighbor_adjacency(papers: Sequence, lookup: PaperLookup, direction: str) -> scipy.sparse.csr_matrix:
+    """
+    Sparse (papers x lookup.papers) count of resolved neighbors of each paper
+    (multi-edges counted), as listed by get_neighbor_papers
+    :param papers:
+    :param lookup:
+    :param direction: 'refs', 'cits' or 'both' (references plus citations)
+    :return:
+    """
+    if direction == 'both':
+        return (neighbor_adjacency(papers, lookup, 'refs') + neighbor_adjacency(papers, lookup, 'cits')).tocsr()
+    adj_ptr = [0]
+    adj_ind = []
+    for paper in papers:
+        paper_id = lookup.get_paper_id(paper) if paper else -1
+        if paper_id >= 0:
+            neighbors = lookup.graph.neighbors(paper_id, direction)
+        elif paper:
+            edges = paper.refs if direction == 'refs' else paper.cits
+            neighbors = [lookup.get_paper_id(lookup.get_paper_by_triple(triple)) for triple in edges]
+            neighbors = [j for j in neighbors if j >= 0]
+        else:
+            neighbors = []
+        adj_ind.append(np.asarray(neighbors, dtype=np.int64))
+        adj_ptr.append(adj_ptr[-1] + len(neighbors))
+    return scipy.sparse.csr_matrix(
+        (np.ones(adj_ptr[-1]), np.concatenate(adj_ind) if adj_ind else np.zeros(0, dtype=np.int64), adj_ptr),
+        shape=(len(papers), len(lookup.papers))
+    )
+
+
+def build_fos_proportions(
+        papers: Sequence,
+        lookup: PaperLookup,
+        fos_of_interest: Set,
+        direction: str,
+        level: int = 1,
+        adj: Optional[scipy.sparse.csr_matrix] = None,
+        weights: Optional[Tuple[scipy.sparse.csr_matrix, List[int]]] = None
+) -> Tuple[scipy.sparse.csr_matrix, scipy.sparse.csr_matrix, List[int]]:
+    """
+    Build the FoS proportion counts of every paper's neighborhood at once, as
+    in compute_lcdi_for_paper_refs_l1 / _cits_l1: each paper's own FoS count
+    1/|own| each, and each resolved neighbor spreads 1 over its FoS
+    :param papers:
+    :param lookup:
+    :param fos_of_interest: FoS universe (other FoS seen in the neighborhoods are added to it)
+    :param direction: 'refs', 'cits' or 'both'
+    :param level: FoS level
+    :param adj: neighbor_adjacency of the papers, if already built (direction is then ignored)
+    :param weights: fos_weight_matrix(lookup, level), if already built
+    :return: (papers x FoS) proportion counts, (papers x FoS) indicator of each
+        paper's own FoS, and the FoS id of each column
+    """
+    weights, weight_ids = weights if weights is not None else fos_weight_matrix(lookup, level)
+
+    # own FoS (unique ids) of each paper
+    own_rows = []
+    own_ids = []
+    for i, paper in enumerate(papers):
+        level_fos = [entry[0] for entry in paper.fos if entry[-1] == level] if paper and paper.fos else []
+        for mag_id in set(level_fos):
+            own_rows.append(i)
+            own_ids.append(mag_id)
+
+    fos_ids = sorted(set(fos_of_interest) | set(weight_ids) | set(own_ids))
+    fos_col = {mag_id: k for k, mag_id in enumerate(fos_ids)}
+
+    own = scipy.sparse.csr_matrix(
+        (np.ones(len(own_rows)), (own_rows, [fos_col[m] for m in own_ids])),
+        shape=(len(papers), len(fos_ids))
+    )
+    own_counts = np.asarray(own.sum(axis=1)).ravel()
+    own_counts[own_counts == 0] = 1.
+    own_prop = scipy.sparse.diags(1. / own_counts) @ own
+
+    if adj is None:
+        adj = neighbor_adjacency(papers, lookup, direction)
+
+    # map weight matrix columns into the universe
+    remap = scipy.sparse.csr_matrix(
+        (np.ones(len(weight_ids)), (np.arange(len(weight_ids)), [fos_col[m] for m in weight_ids])),
+        shape=(len(weight_ids), len(fos_ids))
+    )
+    prop = own_prop + adj @ (weights @ remap)
+    return prop.tocsr(), (own > 0).astype(np.float64).tocsr(), fos_ids
+
+
+def compute_lcdi_batch(
+        prop: scipy.sparse.csr_matrix,
+        this_fos: scipy.sparse.csr_matrix,
+        sim: np.ndarray,
+        chunk_size: int = 4096
+) -> np.ndarray:
+    """
+    Compute the Leinster–Cobbold diversity index of many papers at once (same
+    values as compute_lcdi per paper). Rows are processed in chunks so that
+    only chunk_size x FoS dense arrays are materialized.
+    :param prop: (papers x FoS) proportion counts
+    :param this_fos: (papers x FoS) indicator of each paper's own FoS (or nonnegative
+        weights, to average the denominator over own FoS with these weights)
+    :param sim: (FoS x FoS) similarity matrix
+    :param chunk_size:
+    :return: LCDI per paper (nan for papers without FoS)
+    """
+    num_papers = prop.shape[0]
+    lcdi = np.full(num_papers, np.nan)
+    for start in range(0, num_papers, chunk_size):
+        end = min(start + chunk_size, num_papers)
+        p = prop[start:end].toarray()
+        totals = p.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.
+        p /= totals
+        own = this_fos[start:end].toarray()
+        num_own = own.sum(axis=1)
+        # sum over own FoS j of p_j * sum_i(s_ij p_i), averaged over own FoS
+        denom = (own * p * (p @ sim)).sum(axis=1) / np.where(num_own > 0, num_own, 1.)
+        with np.errstate(divide='ignore'):
+            lcdi[start:end] = np.where(num_own > 0, 1. / denom, np.nan)
+    return lcdi
+
+
+def compute_windowed_lcdi(
+        prop: scipy.sparse.csr_matrix,
+        this_fos: scipy.sparse.csr_matrix,
+        sim: np.ndarray,
+        group_codes: np.ndarray,
+        years: np.ndarray,
+        num_groups: int,
+        window: int = 1,
+        paper_lcdi: Optional[np.ndarray] = None,
+        chunk_size: int = 4096
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    LCDI of groups of papers (e.g. venues) over every window of `window`
+    consecutive years. FoS proportion counts and own-FoS weights (1/|own| per
+    own FoS of each paper) are summed per (group, year) once; the sums over
+    each window come from prefix sums along years, and the LCDI of all
+    (group, window) rows is computed in one compute_lcdi_batch call. A
+    one-paper window has that paper's LCDI.
+    :param prop: (papers x FoS) proportion counts, as from build_fos_proportions
+    :param this_fos: (papers x FoS) indicator of each paper's own FoS
+    :param sim: (FoS x FoS) similarity matrix
+    :param group_codes: group of each row (0 to num_groups - 1), -1 to leave a row out
+    :param years: year of each row (rows with year <= 0 are left out)
+    :param num_groups:
+    :param window: number of years per window, ending at each year
+    :param paper_lcdi: per-paper LCDI of each row, to also average over each window
+    :param chunk_size: rows per dense block in compute_lcdi_batch
+    :return: (last year of each window, (groups x windows) LCDI of the pooled
+        proportions, number of papers, mean per-paper LCDI); nan for empty windows
+    """
+    years = np.asarray(years, dtype=np.int64)
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    own_counts = np.asarray(this_fos.sum(axis=1)).ravel()
+    keep = np.flatnonzero((group_codes >= 0) & (years > 0) & (own_counts > 0))
+    if not len(keep):
+        empty = np.zeros((num_groups, 0))
+        return np.zeros(0, dtype=np.int64), empty, empty.astype(np.int64), empty
+    first_year = years[keep].min()
+    num_years = int(years[keep].max() - first_year + 1)
+    cells = group_codes[keep] * num_years + (years[keep] - first_year)
+
+    # (group, year) x rows membership
+    members = scipy.sparse.csr_matrix(
+        (np.ones(len(keep)), (cells, keep)),
+        shape=(num_groups * num_years, prop.shape[0])
+    )
+    own_weights = scipy.sparse.diags(1. / np.where(own_counts > 0, own_counts, 1.)) @ this_fos
+
+    def window_sums(per_cell: np.ndarray) -> np.ndarray:
+        # (groups * years, ...) -> sums over the window ending at each year
+        per_cell = per_cell.reshape((num_groups, num_years) + per_cell.shape[1:])
+        prefix = np.concatenate([np.zeros_like(per_cell[:, :1]), np.cumsum(per_cell, axis=1)], axis=1)
+        starts = np.maximum(np.arange(num_years) + 1 - window, 0)
+        return prefix[:, 1:] - prefix[:, starts]
+
+    num_papers = window_sums(np.bincount(cells, minlength=num_groups * num_years)).astype(np.int64)
+    window_prop = window_sums((members @ prop).toarray())
+    window_own = window_sums((members @ own_weights).toarray())
+    # rounding residue of the prefix differences
+    window_prop[window_prop < 1e-12] = 0.
+    window_own[window_own < 1e-12] = 0.
+
+    num_fos = prop.shape[1]
+    lcdi = compute_lcdi_batch(
+        scipy.sparse.csr_matrix(window_prop.reshape(-1, num_fos)),
+        scipy.sparse.csr_matrix(window_own.reshape(-1, num_fos)),
+        sim,
+        chunk_size
+    ).reshape(num_groups, num_years)
+    lcdi[num_papers == 0] = np.nan
+
+    mean_lcdi = np.full((num_groups, num_years), np.nan)
+    if paper_lcdi is not None:
+        paper_lcdi = np.asarray(paper_lcdi, dtype=np.float64)[keep]
+        scored = np.isfinite(paper_lcdi)
+        sums = window_sums(np.bincount(cells[scored], weights=paper_lcdi[scored], minlength=num_groups * num_years))
+        counts = window_sums(np.bincount(cells[scored], minlength=num_groups * num_years))
+        np.divide(sums, counts, out=mean_lcdi, where=counts > 0)
+    return np.arange(first_year, first_year + num_years), lcdi, num_papers, mean_lcdi
+
+
+def compute_lcdi_for_papers_l1(
+        papers: Sequence,
+        lookup: PaperLookup,
+        fos_of_interest: Set,
+        mag_lookup: MagLookup,
+        direction: str,
+        chunk_size: int = 4096
+) -> np.ndarray:
+    """
+    Batch version of compute_lcdi_for_paper_refs_l1 (direction='refs') and
+    compute_lcdi_for_paper_cits_l1 (direction='cits')
+    :param papers:
+    :param lookup:
+    :param fos_of_interest:
+    :param mag_lookup:
+    :param direction:
+    :param chunk_size: rows per dense block in compute_lcdi_batch
+    :return: LCDI per paper (nan where the per-paper functions return None)
+    """
+    with phase('lcdi.build_fos_proportions'):
+        prop, this_fos, fos_ids = build_fos_proportions(papers, lookup, fos_of_interest, direction, level=1)
+    with phase('lcdi.batch'):
+        lcdi = compute_lcdi_batch(prop, this_fos, mag_lookup.sim_matrix(fos_ids), chunk_size)
+    count('lcdi.batch_papers', len(lcdi))
+    count('lcdi.papers_skipped_no_fos', int(np.isnan(lcdi).sum()))
+    return lcdi
+
+
+def get_lcdi_fos_universe(
+        papers: Sequence,
+        lookup: PaperLookup,
+        fos_of_interest: Set,
+        level: int = 1,
+        weight_ids: Optional[List[int]] = None
+) -> Set:
+    """
+    Every FoS column build_fos_proportions can produce for these papers. Passing
+    this as fos_of_interest makes the matrix columns independent of how the
+    papers are split into batches.
+    :param papers:
+    :param lookup:
+    :param fos_of_interest:
+    :param level:
+    :param weight_ids: FoS ids of fos_weight_matrix(lookup, level), if already built
+    :return:
+    """
+    if weight_ids is None:
+        _, weight_ids = fos_weight_matrix(lookup, level)
+    own_ids = [entry[0] for paper in papers if paper and paper.fos for entry in paper.fos if entry[-1] == level]
+    return set(fos_of_interest) | set(weight_ids) | set(own_ids)
+
+
+def lcdi_fingerprints(
+        papers: Sequence,
+        adj: scipy.sparse.csr_matrix,
+        weights: scipy.sparse.csr_matrix,
+        weight_ids: List[int],
+        level: int = 1
+) -> List[str]:
+    """
+    Fingerprint of each paper's LCDI inputs: its own FoS and the multiset of
+    FoS weight rows of its resolved neighbors (by FoS id, so independent of
+    paper ids and column order). Computed from the adjacency and the weight
+    matrix alone, so unchanged papers need no proportions. Equal fingerprints
+    give equal LCDI for the same MAG data.
+    :param papers:
+    :param adj: neighbor_adjacency of the papers
+    :param weights: fos_weight_matrix of the lookup
+    :param weight_ids: FoS id of each column of weights
+    :param level: FoS level
+    :return:
+    """
+    weight_ids = np.asarray(weight_ids, dtype=np.int64)
+    weights = weights.tocsr()
+    adj = adj.tocsr(copy=True)
+    adj.sum_duplicates()
+
+    # one 64-bit hash per distinct neighbor, from its FoS ids and weights
+    neighbors = np.unique(adj.indices)
+    neighbor_hashes = np.zeros(len(neighbors), dtype=np.uint64)
+    for k, j in enumerate(neighbors):
+        start, end = weights.indptr[j], weights.indptr[j + 1]
+        h = hashlib.blake2b(digest_size=8)
+        h.update(weight_ids[weights.indices[start:end]].tobytes())
+        h.update(weights.data[start:end].astype(np.float64).tobytes())
+        neighbor_hashes[k] = int.from_bytes(h.digest(), 'little')
+    adj_hashes = neighbor_hashes[np.searchsorted(neighbors, adj.indices)]
+
+    fingerprints = []
+    for i, paper in enumerate(papers):
+        own_ids = sorted({entry[0] for entry in paper.fos if entry[-1] == level}) if paper and paper.fos else []
+        start, end = adj.indptr[i], adj.indptr[i + 1]
+        order = np.argsort(adj_hashes[start:end], kind='stable')
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.asarray(own_ids, dtype=np.int64).tobytes())
+        h.update(b'|')
+        h.update(adj_hashes[start:end][order].tobytes())
+        h.update(adj.data[start:end][order].astype(np.float64).tobytes())
+        fingerprints.append(h.hexdigest())
+    return fingerprints
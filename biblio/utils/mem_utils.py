@@ -0,0 +1,39 @@
+"""
+Utilities for measuring process memory
+"""
+
+import os, sys
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB
+    :return:
+    """
+    # VmHWM is reset on exec, unlike ru_maxrss, which spawned processes
+    # inherit from their parent on Linux
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except (OSError, ValueError, IndexError):
+        pass
+    # not available on Windows; imported here so importing this module always works
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def current_rss_mb() -> float:
+    """
+    Current resident set size of this process in MB (Linux), falling back to peak RSS
+    :return:
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
@@ -0,0 +1,55 @@
+"""
+Utilities for running a measurement in a fresh process
+"""
+
+import os, sys
+import time
+import queue
+import multiprocessing
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+
+# how often the parent checks whether the child process is still alive
+POLL_SECONDS = 1.
+
+
+def run_in_process(
+        target: Callable,
+        args: Sequence = (),
+        timeout: Optional[float] = None,
+        ctx=None
+) -> Tuple[Any, Optional[str]]:
+    """
+    Call target(*args, results) in a new process and wait for the one value it
+    puts on the results queue, without blocking forever if the process dies
+    :param target:
+    :param args:
+    :param timeout: seconds before the process is terminated (no limit if None)
+    :param ctx: multiprocessing context (default spawn, so the child starts from a fresh interpreter)
+    :return: (value, None), or (None, reason) if the process exited without a value or timed out
+    """
+    ctx = ctx or multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=target, args=tuple(args) + (results,))
+    proc.start()
+    start = time.time()
+    try:
+        while True:
+            try:
+                return results.get(timeout=POLL_SECONDS), None
+            except queue.Empty:
+                if not proc.is_alive():
+                    # the value may have arrived just before the process exited
+                    try:
+                        return results.get(timeout=POLL_SECONDS), None
+                    except queue.Empty:
+                        proc.join()
+                        return None, f'exit code {proc.exitcode}'
+                if timeout is not None and time.time() - start > timeout:
+                    return None, f'timed out after {timeout:g}s'
+    finally:
+        if proc.is_alive():
+            proc.join(POLL_SECONDS)
+        if proc.is_alive():
+            proc.terminate()
+        proc.join()
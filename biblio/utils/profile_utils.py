@@ -0,0 +1,115 @@
+"""
+Opt-in phase timers, counters and memory snapshots.
+
+Instrumented code calls count()/phase() unconditionally; both return
+immediately unless profiling was turned on with enable_profiling(). Hot loops
+check PROFILER.enabled themselves to skip even the call.
+"""
+
+import os, sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+from biblio.utils.mem_utils import current_rss_mb, peak_rss_mb
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.counters = defaultdict(int)
+        # name -> [total seconds, number of times entered]
+        self.timers = defaultdict(lambda: [0., 0])
+        self.memory = []
+        self.start_time = time.time()
+
+
+PROFILER = Profiler()
+
+
+def enable_profiling():
+    PROFILER.reset()
+    PROFILER.enabled = True
+
+
+def disable_profiling():
+    PROFILER.enabled = False
+
+
+def count(name: str, n: int = 1):
+    """
+    Add n to a counter
+    :param name:
+    :param n:
+    :return:
+    """
+    if PROFILER.enabled:
+        PROFILER.counters[name] += n
+
+
+def add_time(name: str, seconds: float, calls: int = 1):
+    """
+    Add time measured by the caller to a timer
+    :param name:
+    :param seconds:
+    :param calls:
+    :return:
+    """
+    if PROFILER.enabled:
+        timer = PROFILER.timers[name]
+        timer[0] += seconds
+        timer[1] += calls
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Time a block and take a memory snapshot when it ends; phases may nest
+    :param name:
+    :return:
+    """
+    if not PROFILER.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+        snapshot_memory(name)
+
+
+def snapshot_memory(label: str):
+    """
+    Record current and peak resident memory
+    :param label:
+    :return:
+    """
+    if PROFILER.enabled:
+        PROFILER.memory.append({
+            'label': label,
+            'seconds': time.time() - PROFILER.start_time,
+            'rss_mb': current_rss_mb(),
+            'peak_rss_mb': peak_rss_mb()
+        })
+
+
+def profile_report() -> Dict:
+    """
+    Everything recorded since profiling was enabled, as a JSON-serializable dict
+    :return:
+    """
+    return {
+        'wall_seconds': time.time() - PROFILER.start_time,
+        'peak_rss_mb': peak_rss_mb(),
+        'timers': {
+            name: {'seconds': seconds, 'calls': calls}
+            for name, (seconds, calls) in sorted(PROFILER.timers.items(), key=lambda x: -x[1][0])
+        },
+        'counters': dict(sorted(PROFILER.counters.items())),
+        'memory': PROFILER.memory
+    }
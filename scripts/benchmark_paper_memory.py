@@ -0,0 +1,62 @@
+"""
+Compare memory held by the dataset when loaded as Paper objects (load_dataset)
+versus the array-backed PaperStore (load_dataset_store).
+
+Each loader runs in a fresh process; reports resident memory retained after
+loading and peak resident memory during loading.
+
+usage: python scripts/benchmark_paper_memory.py [dataset_path]
+"""
+
+import os, sys
+import gc
+import time
+from typing import Optional
+
+from biblio.load_dataset import load_dataset, load_dataset_store, DATASET_PATH
+from biblio.utils.mem_utils import current_rss_mb, peak_rss_mb
+from biblio.utils.process_utils import run_in_process
+
+
+def _measure(loader_name: str, data_path: str, results):
+    loader = {'load_dataset': load_dataset, 'load_dataset_store': load_dataset_store}[loader_name]
+    gc.collect()
+    rss_before = current_rss_mb()
+    start = time.time()
+    core, extended, lookup = loader(data_path)
+    elapsed = time.time() - start
+    gc.collect()
+    rss_after = current_rss_mb()
+    results.put({
+        'loader': loader_name,
+        'papers': len(lookup.papers),
+        'seconds': elapsed,
+        'retained_mb': rss_after - rss_before,
+        'peak_mb': peak_rss_mb() - rss_before,
+        # size of the arrays themselves, excluding allocator overhead
+        'array_bytes': lookup.store.nbytes() if hasattr(lookup, 'store') else None
+    })
+
+
+def run_benchmark(data_path: str = DATASET_PATH, timeout: Optional[float] = None):
+    results = []
+    for loader_name in ('load_dataset', 'load_dataset_store'):
+        res, error = run_in_process(_measure, (loader_name, data_path), timeout)
+        results.append(res if error is None else {'loader': loader_name, 'error': error})
+
+    print()
+    print('LOADER\t\t\tPAPERS\tSECONDS\tRETAINED_MB\tPEAK_MB\tBYTES/PAPER\tARRAY_BYTES/PAPER')
+    for res in results:
+        if 'error' in res:
+            print(f"{res['loader']:<20}\tFAILED ({res['error']})")
+            continue
+        num_papers = max(res['papers'], 1)
+        per_paper = res['retained_mb'] * 2 ** 20 / num_papers
+        array_per_paper = f"{res['array_bytes'] / num_papers:.0f}" if res['array_bytes'] is not None else '-'
+        print(f"{res['loader']:<20}\t{res['papers']}\t{res['seconds']:.1f}\t"
+              f"{res['retained_mb']:.1f}\t\t{res['peak_mb']:.1f}\t{per_paper:.0f}\t\t{array_per_paper}")
+    return results
+
+
+if __name__ == '__main__':
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH)
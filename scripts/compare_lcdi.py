@@ -0,0 +1,45 @@
+"""
+Bootstrap confidence intervals of the mean LCDI of each venue and permutation
+tests of the difference in mean LCDI for every pair of venues, from the
+results of scripts/get_lcdi_scores.py.
+
+usage: python scripts/compare_lcdi.py [--resamples 10000] [--seed 0] [--confidence 0.95]
+"""
+
+import os, sys
+import time
+import argparse
+
+from biblio.constants import VENUES_TO_PLOT
+from biblio.lcdi_stats import LCDI_RESULT_FILES, load_lcdi_values, bootstrap_ci, permutation_tests
+
+
+OUT_DIR = 'data/analysis'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare mean LCDI across venues')
+    parser.add_argument('--resamples', type=int, default=10000, help='bootstrap/permutation resamples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of the bootstrap intervals')
+    parser.add_argument('--directions', nargs='+', choices=list(LCDI_RESULT_FILES), default=list(LCDI_RESULT_FILES))
+    args = parser.parse_args()
+
+    for direction in args.directions:
+        values = load_lcdi_values(LCDI_RESULT_FILES[direction], VENUES_TO_PLOT)
+
+        print(f'bootstrapping mean LCDI ({direction})...')
+        start = time.time()
+        intervals = bootstrap_ci(values, args.resamples, args.confidence, args.seed)
+        print(f'{len(intervals)} venues in {time.time() - start:.1f}s')
+        print(intervals.to_string(index=False))
+        intervals.to_csv(os.path.join(OUT_DIR, f'lcdi_{direction}_bootstrap_ci.csv'), index=False)
+
+        print(f'permutation tests ({direction})...')
+        start = time.time()
+        tests = permutation_tests(values, num_resamples=args.resamples, seed=args.seed)
+        print(f'{len(tests)} venue pairs in {time.time() - start:.1f}s')
+        print(tests[tests['p_holm'] < 1. - args.confidence].to_string(index=False))
+        tests.to_csv(os.path.join(OUT_DIR, f'lcdi_{direction}_permutation_tests.csv'), index=False)
+
+    print('done.')
@@ -0,0 +1,74 @@
+"""
+Sensitivity sweep of per-paper neighborhood diversity over FoS levels and
+Leinster–Cobbold orders, for the a11y core groups and VENUES_TO_PLOT. The
+l1_q2 column of the own-FoS weighting equals the LCDI of
+scripts/get_lcdi_scores.py.
+
+usage: python scripts/get_diversity_scores.py [--directions refs cits] [--levels 0 1 2] [--orders 0 1 2 inf]
+"""
+
+import os, sys
+import json
+import time
+import argparse
+
+from biblio.load_dataset import load_dataset
+from biblio.load_fos import MagLookup
+from biblio.diversity import DIVERSITY_ORDERS, WEIGHTINGS, compute_diversity
+from biblio.utils.list_utils import flatten
+from biblio.utils.profile_utils import enable_profiling, phase, profile_report
+from biblio.constants import VENUES_TO_PLOT
+
+
+OUT_DIR = 'data/analysis'
+PROFILE_PATH = 'data/analysis/diversity_profile.json'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute per-paper diversity for several FoS levels and orders')
+    parser.add_argument('--directions', nargs='+', choices=['refs', 'cits', 'both'], default=['refs', 'cits'])
+    parser.add_argument('--levels', nargs='+', type=int, choices=[0, 1, 2], default=[0, 1, 2])
+    parser.add_argument(
+        '--orders', nargs='+', type=float, default=list(DIVERSITY_ORDERS),
+        help='Leinster–Cobbold orders q >= 0 (inf for the max-similarity limit)'
+    )
+    parser.add_argument('--weighting', choices=WEIGHTINGS, default='own')
+    parser.add_argument(
+        '--profile', nargs='?', const=PROFILE_PATH, default=None,
+        help=f'record phase timers and counters, and write them as JSON (default {PROFILE_PATH})'
+    )
+    args = parser.parse_args()
+    if args.profile:
+        enable_profiling()
+
+    with phase('load_dataset'):
+        core, extended, lookup = load_dataset('data/analysis/a11y_bibliometrics_dataset.jsonl.gz')
+    print('loading mag...')
+    mag_lookup = MagLookup('data/analysis/a11y_bibliometrics_mag_fos.jsonl.gz')
+
+    groups = [(key, core[key]) for key in ('a11y', 'a11y_assets', 'a11y_chi')]
+    groups += [(voi, [p for p in lookup.get_papers_in_venue(voi) if p]) for voi in VENUES_TO_PLOT]
+    all_papers = flatten([papers for _, papers in groups])
+    group_column = flatten([[key] * len(papers) for key, papers in groups])
+    print(f'{len(all_papers)} papers')
+
+    for direction in args.directions:
+        print(f'computing diversity ({direction})...')
+        start = time.time()
+        scores = compute_diversity(
+            all_papers, lookup, mag_lookup, direction, args.levels, args.orders, weighting=args.weighting
+        )
+        print(f'{len(args.levels) * len(args.orders)} (level, order) combinations in {time.time() - start:.1f}s')
+        scores.insert(0, 'group', group_column)
+        scores = scores.dropna(subset=scores.columns[2:], how='all')
+        suffix = '' if args.weighting == 'own' else f'_{args.weighting}'
+        out_path = os.path.join(OUT_DIR, f'diversity_{direction}_by_papers{suffix}.csv')
+        scores.to_csv(out_path, index=False)
+        print(scores.groupby('group', sort=False).mean(numeric_only=True).drop(columns='pid').to_string())
+        print(f'written to {out_path}')
+
+    if args.profile:
+        with open(args.profile, 'w') as outf:
+            json.dump(profile_report(), outf, indent=2)
+        print(f'profile written to {args.profile}')
+    print('done.')
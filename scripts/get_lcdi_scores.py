@@ -1,113 +1,394 @@
 import os, sys
 import json
-import tqdm
+import time
+import argparse
+import multiprocessing
+from typing import Dict, Optional, Set, Tuple
 from collections import defaultdict
 
+import numpy as np
+
 from biblio.utils.list_utils import flatten
-from biblio.load_dataset import load_dataset
+from biblio.load_dataset import load_dataset, DATASET_PATH
+from biblio.dblp_index import DBLP_ALL_FILE
 from biblio.load_fos import MagLookup
-from biblio.utils.lcdi_utils import compute_lcdi_for_paper_refs_l1, compute_lcdi_for_paper_cits_l1
+from biblio.utils.lcdi_utils import (
+    build_fos_proportions, compute_lcdi_batch, compute_windowed_lcdi, fos_weight_matrix, get_lcdi_fos_universe,
+    get_neighbor_papers, lcdi_fingerprints, neighbor_adjacency
+)
+from biblio.utils.cache_utils import file_stamp
+from biblio.lcdi_store import LcdiStore, LCDI_STORE_DIR
+from biblio.lcdi_results import LcdiResultWriter, lcdi_result_paths, write_lcdi_json
+from biblio.pipeline import Pipeline, Stage, PIPELINE_DIR
+from biblio.utils.profile_utils import add_time, count, enable_profiling, phase, profile_report, snapshot_memory
 from biblio.constants import VENUES_TO_PLOT
 
 
-if __name__ == '__main__':
-    # load dataset
-    core, extended, lookup = load_dataset('data/analysis/a11y_bibliometrics_dataset.jsonl.gz')
+# rows per dense block; shards are whole multiples of this so every row is
+# computed in the same block layout for any number of workers
+CHUNK_SIZE = 256
+
+# set in the parent before the pool forks, so workers inherit the loaded
+# lookups read-only instead of receiving pickled copies per task
+_worker_state = {}
+
+PROFILE_PATH = 'data/analysis/lcdi_profile.json'
+MAG_PATH = 'data/analysis/a11y_bibliometrics_mag_fos.jsonl.gz'
+DIRECTIONS = ('refs', 'cits')
+
+# --only shortcuts: a direction selects its LCDI and export stages
+ONLY_TARGETS = {'refs': 'export_refs', 'cits': 'export_cits'}
 
-    # mag lookup
-    print('loading mag...')
-    mag_lookup = MagLookup('data/analysis/a11y_bibliometrics_mag_fos.jsonl.gz')
 
-    # COMPARATIVE analysis (compute individually then average)
-    print('Computing individual LCDI (refs)...')
+def _compute_shard(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, int, float]:
+    state = _worker_state
+    tic = time.time()
+    # rows of the proportion matrices, which may only cover the papers to compute
+    prop_rows = state['prop_rows'][rows]
+    lcdi = compute_lcdi_batch(state['prop'][prop_rows], state['this_fos'][prop_rows], state['sim'], CHUNK_SIZE)
+    return rows, lcdi, os.getpid(), time.time() - tic
+
+
+def get_l1_fos_of_interest(lookup) -> Set:
+    """
+    L1 FoS of the papers in VENUES_TO_PLOT and of their references and citations
+    :param lookup:
+    :return:
+    """
     all_fos = []
     for voi in VENUES_TO_PLOT:
         papers = lookup.get_papers_in_venue(voi)
-        voi_refs = flatten([p.refs for p in papers])
-        voi_cits = flatten([p.cits for p in papers])
-        voi_ref_papers = [lookup.get_paper_by_triple(tuple(ref)) for ref in voi_refs]
-        voi_cit_papers = [lookup.get_paper_by_triple(tuple(cit)) for cit in voi_cits]
+        voi_ref_papers = flatten([get_neighbor_papers(p, lookup, 'refs') for p in papers])
+        voi_cit_papers = flatten([get_neighbor_papers(p, lookup, 'cits') for p in papers])
         all_fos += flatten(
             [p.fos for p in papers if p and p.fos] + \
             [p.fos for p in voi_ref_papers if p and p.fos] + \
             [p.fos for p in voi_cit_papers if p and p.fos]
         )
-    all_l1_fos = set([entry[0] for entry in all_fos if entry[-1] == 1])
+    return set([entry[0] for entry in all_fos if entry[-1] == 1])
 
-    lcdi_results = defaultdict(dict)
 
-    for p in tqdm.tqdm(core['a11y']):
-        lcdi = compute_lcdi_for_paper_refs_l1(p, lookup, all_l1_fos, mag_lookup)
-        if lcdi:
-            lcdi_results['a11y'][p.pid] = lcdi
+def compute_group_lcdi_by_year(groups, all_papers, prop, this_fos, sim, lcdi, window: int = 1):
+    """
+    Group-level LCDI over each window of `window` years, from the per-paper
+    proportions already built for compute_group_lcdi
+    :param groups: (group, papers) pairs, in the row order of all_papers
+    :param all_papers:
+    :param prop:
+    :param this_fos:
+    :param sim:
+    :param lcdi: per-paper LCDI of each row
+    :param window: number of years per window
+    :return: dict(key=group, value=dict(key=last year of window, value=dict(lcdi, mean_lcdi, num_papers)))
+    """
+    group_codes = np.repeat(np.arange(len(groups)), [len(papers) for _, papers in groups])
+    years = np.array([p.year or 0 for p in all_papers], dtype=np.int64)
+    with phase('lcdi.by_year'):
+        window_years, pooled, num_papers, mean_lcdi = compute_windowed_lcdi(
+            prop, this_fos, sim, group_codes, years, len(groups), window, lcdi
+        )
+    by_year = dict()
+    for g, (key, _) in enumerate(groups):
+        by_year[key] = {
+            int(year): {
+                'lcdi': None if np.isnan(pooled[g, y]) else float(pooled[g, y]),
+                'mean_lcdi': None if np.isnan(mean_lcdi[g, y]) else float(mean_lcdi[g, y]),
+                'num_papers': int(num_papers[g, y])
+            }
+            for y, year in enumerate(window_years) if num_papers[g, y]
+        }
+    return by_year
 
-    for p in tqdm.tqdm(core['a11y_assets']):
-        lcdi = compute_lcdi_for_paper_refs_l1(p, lookup, all_l1_fos, mag_lookup)
-        if lcdi:
-            lcdi_results['a11y_assets'][p.pid] = lcdi
 
-    for p in tqdm.tqdm(core['a11y_chi']):
-        lcdi = compute_lcdi_for_paper_refs_l1(p, lookup, all_l1_fos, mag_lookup)
-        if lcdi:
-            lcdi_results['a11y_chi'][p.pid] = lcdi
+def compute_group_lcdi(
+        core,
+        lookup,
+        fos_of_interest,
+        mag_lookup,
+        direction,
+        workers: int = 1,
+        store: Optional[LcdiStore] = None,
+        window: Optional[int] = None,
+        writer: Optional[LcdiResultWriter] = None
+):
+    """
+    LCDI of every paper in the a11y core groups and in VENUES_TO_PLOT. Papers
+    are split into shards computed by a pool of forked worker processes; the
+    output does not depend on the number of workers. With a store, papers
+    whose inputs are unchanged since the last run are read from it (without
+    building their FoS proportions, unless a window needs them), and new
+    results are checkpointed to it after every shard. Results are streamed to
+    the writer in group order as soon as every earlier paper is known.
+    :param core:
+    :param lookup:
+    :param fos_of_interest:
+    :param mag_lookup:
+    :param direction: 'refs' or 'cits'
+    :param workers: number of processes
+    :param store: persistent results, or None to recompute everything
+    :param window: if set, also compute the LCDI of each group over windows of this many years
+    :param writer: receives a row per paper with a nonzero LCDI
+    :return: compute_group_lcdi_by_year result, or None without a window
+    """
+    groups = [(key, core[key]) for key in ('a11y', 'a11y_assets', 'a11y_chi')]
+    groups += [(voi, [p for p in lookup.get_papers_in_venue(voi) if p]) for voi in VENUES_TO_PLOT]
+    all_papers = flatten([papers for _, papers in groups])
+    group_offsets = np.cumsum([0] + [len(papers) for _, papers in groups])
+    print(f'{len(all_papers)} papers')
 
-    for voi in VENUES_TO_PLOT:
-        print(voi)
-        papers = lookup.get_papers_in_venue(voi)
-        for p in tqdm.tqdm(papers):
-            lcdi = compute_lcdi_for_paper_refs_l1(p, lookup, all_l1_fos, mag_lookup)
-            if lcdi:
-                lcdi_results[voi][p.pid] = lcdi
+    # fixed FoS columns and warm caches, shared by all shards
+    with phase('lcdi.fos_universe'):
+        weights = fos_weight_matrix(lookup, level=1)
+        fos_universe = get_lcdi_fos_universe(all_papers, lookup, fos_of_interest, level=1, weight_ids=weights[1])
+    mag_lookup.precompute_sim(fos_universe)
+    with phase('lcdi.adjacency'):
+        adj = neighbor_adjacency(all_papers, lookup, direction)
 
-    with open('data/analysis/lcdi_refs_by_papers_l1.json', 'w') as outf:
-        json.dump(lcdi_results, outf)
+    lcdi = np.full(len(all_papers), np.nan)
+    if store is not None:
+        with phase('lcdi.fingerprints'):
+            fingerprints = lcdi_fingerprints(all_papers, adj, weights[0], weights[1], level=1)
+        todo = []
+        for i, (p, fingerprint) in enumerate(zip(all_papers, fingerprints)):
+            stored = store.get(p, fingerprint)
+            if stored is None:
+                todo.append(i)
+            else:
+                lcdi[i] = stored
+        todo = np.array(todo, dtype=np.int64)
+        print(f'{len(all_papers) - len(todo)} papers unchanged, {len(todo)} to compute')
+        count('lcdi.papers_from_store', len(all_papers) - len(todo))
+    else:
+        todo = np.arange(len(all_papers))
 
-    # CITATIONS!!! COMPARATIVE analysis (compute individually then average)
-    print('Computing individual LCDI (cits)...')
-    all_fos = []
-    for voi in VENUES_TO_PLOT:
-        papers = lookup.get_papers_in_venue(voi)
-        voi_refs = flatten([p.refs for p in papers])
-        voi_cits = flatten([p.cits for p in papers])
-        voi_ref_papers = [lookup.get_paper_by_triple(tuple(ref)) for ref in voi_refs]
-        voi_cit_papers = [lookup.get_paper_by_triple(tuple(cit)) for cit in voi_cits]
-        all_fos += flatten(
-            [p.fos for p in papers if p and p.fos] + \
-            [p.fos for p in voi_ref_papers if p and p.fos] + \
-            [p.fos for p in voi_cit_papers if p and p.fos]
+    # proportions of the papers to compute only, unless the by-year LCDI needs every paper
+    prop_papers = todo if window is None else np.arange(len(all_papers))
+    with phase('lcdi.build_fos_proportions'):
+        prop, this_fos, fos_ids = build_fos_proportions(
+            [all_papers[i] for i in prop_papers], lookup, fos_universe, direction, level=1,
+            adj=adj[prop_papers], weights=weights
         )
-    all_l1_fos = set([entry[0] for entry in all_fos if entry[-1] == 1])
+    prop_rows = np.full(len(all_papers), -1, dtype=np.int64)
+    prop_rows[prop_papers] = np.arange(len(prop_papers))
 
-    lcdi_results = defaultdict(dict)
+    num_chunks = -(-len(todo) // CHUNK_SIZE)
+    shard_size = max(1, -(-num_chunks // (workers * 4))) * CHUNK_SIZE
+    shards = [todo[start:start + shard_size] for start in range(0, len(todo), shard_size)]
 
-    for p in tqdm.tqdm(core['a11y']):
-        lcdi = compute_lcdi_for_paper_cits_l1(p, lookup, all_l1_fos, mag_lookup)
-        if lcdi:
-            lcdi_results['a11y'][p.pid] = lcdi
+    # rows [0, written) have been passed to the writer
+    written = 0
 
-    for p in tqdm.tqdm(core['a11y_assets']):
-        lcdi = compute_lcdi_for_paper_cits_l1(p, lookup, all_l1_fos, mag_lookup)
-        if lcdi:
-            lcdi_results['a11y_assets'][p.pid] = lcdi
+    def emit(end):
+        nonlocal written
+        if writer is None:
+            return
+        for g, (key, _) in enumerate(groups):
+            start, stop = max(written, group_offsets[g]), min(end, group_offsets[g + 1])
+            if start >= stop:
+                continue
+            values = lcdi[start:stop]
+            keep = np.flatnonzero(~np.isnan(values) & (values != 0))
+            writer.write(key, [all_papers[start + i].pid for i in keep], values[keep])
+        written = max(written, end)
 
-    for p in tqdm.tqdm(core['a11y_chi']):
-        lcdi = compute_lcdi_for_paper_cits_l1(p, lookup, all_l1_fos, mag_lookup)
-        if lcdi:
-            lcdi_results['a11y_chi'][p.pid] = lcdi
+    sim = mag_lookup.sim_matrix(fos_ids)
+    _worker_state.update(prop=prop, this_fos=this_fos, prop_rows=prop_rows, sim=sim)
+    worker_stats = defaultdict(lambda: [0, 0.])
+    tic = time.time()
+    pool = None
+    try:
+        if workers > 1 and len(shards) > 1:
+            pool = multiprocessing.get_context('fork').Pool(workers)
+            # in order, so that rows can be streamed as soon as each shard is done
+            shard_results = pool.imap(_compute_shard, shards)
+        else:
+            shard_results = (_compute_shard(rows) for rows in shards)
+        for rows, shard_lcdi, pid, seconds in shard_results:
+            lcdi[rows] = shard_lcdi
+            worker_stats[pid][0] += len(rows)
+            worker_stats[pid][1] += seconds
+            if store is not None:
+                store.add_many((all_papers[i], fingerprints[i], lcdi[i]) for i in rows)
+            # every row before the next one still to compute is known
+            next_todo = np.searchsorted(todo, rows[-1], side='right')
+            emit(todo[next_todo] if next_todo < len(todo) else len(all_papers))
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _worker_state.clear()
+    elapsed = time.time() - tic
+    add_time('lcdi.compute', elapsed)
+    snapshot_memory('lcdi.compute')
+    # counted here since forked workers do not report their counters
+    count('lcdi.papers_computed', len(todo))
+    count('lcdi.papers_skipped_no_fos', int(np.isnan(lcdi[todo]).sum()))
 
-    for voi in VENUES_TO_PLOT:
-        print(voi)
-        papers = lookup.get_papers_in_venue(voi)
-        for p in tqdm.tqdm(papers):
-            if not p:
-                continue
-            lcdi = compute_lcdi_for_paper_cits_l1(p, lookup, all_l1_fos, mag_lookup)
-            if lcdi:
-                lcdi_results[voi][p.pid] = lcdi
+    print('WORKER\tPAPERS\tSECONDS\tPAPERS/SEC')
+    for pid, (num_papers, seconds) in sorted(worker_stats.items()):
+        print(f'{pid}\t{num_papers}\t{seconds:.2f}\t{num_papers / max(seconds, 1e-9):.0f}')
+    print(f'total\t{len(todo)}\t{elapsed:.2f}\t{len(todo) / max(elapsed, 1e-9):.0f}')
 
-    with open('data/analysis/lcdi_cits_by_papers_l1.json', 'w') as outf:
-        json.dump(lcdi_results, outf)
+    # papers read from the store after the last computed one
+    emit(len(all_papers))
 
-    print('done.')
+    if window is not None:
+        return compute_group_lcdi_by_year(groups, all_papers, prop, this_fos, sim, lcdi, window)
+    return None
+
+
+def lcdi_output_paths(direction: str, window: Optional[int]) -> Dict[str, str]:
+    """
+    Files written by the export stage of a direction
+    :param direction:
+    :param window: by-year window, or None
+    :return:
+    """
+    paths = {'by_papers': f'data/analysis/lcdi_{direction}_by_papers_l1.json'}
+    if window is not None:
+        suffix = '' if window == 1 else f'_{window}y_window'
+        paths['by_year'] = f'data/analysis/lcdi_{direction}_by_year{suffix}_l1.json'
+    return paths
+
+
+def build_pipeline(
+        workers: int = 1,
+        window: Optional[int] = None,
+        store_dir: Optional[str] = LCDI_STORE_DIR,
+        cache_dir: str = PIPELINE_DIR
+) -> Pipeline:
+    """
+    Stages of the LCDI analysis: load (dataset), mag, resolve_edges (citation
+    graph), fos_universe, refs and cits (per-paper LCDI streamed to JSONL with
+    summary tables; independent of each other) and export_refs / export_cits
+    (per-paper JSON and by-year results)
+    :param workers: processes per LCDI stage
+    :param window: also compute LCDI by year over windows of this many years
+    :param store_dir: per-paper LCDI checkpoints, or None to recompute every paper
+    :param cache_dir: where stage artifacts are stored
+    :return:
+    """
+    def load(inputs):
+        return load_dataset(DATASET_PATH)
+
+    def load_mag(inputs):
+        print('loading mag...')
+        return MagLookup(MAG_PATH)
+
+    def resolve_edges(inputs):
+        # built once in the parent, so forked LCDI stages share it
+        graph = inputs['load'][2].graph
+        print(f"{graph.num_unresolved('refs')} unresolved refs, {graph.num_unresolved('cits')} unresolved cits")
+        return graph
 
+    def fos_universe(inputs):
+        return get_l1_fos_of_interest(inputs['load'][2])
 
+    def lcdi_stage(direction):
+        def compute(inputs):
+            print(f'Computing individual LCDI ({direction})...')
+            core, _, lookup = inputs['load']
+            store = None
+            if store_dir is not None:
+                store = LcdiStore(
+                    os.path.join(store_dir, f'lcdi_{direction}_l1.jsonl'),
+                    meta={'direction': direction, 'level': 1, 'mag': file_stamp(MAG_PATH)}
+                )
+            try:
+                with LcdiResultWriter(direction) as writer:
+                    by_year = compute_group_lcdi(
+                        core, lookup, inputs['fos_universe'], inputs['mag'], direction, workers, store, window, writer
+                    )
+                print(f"{writer.num_rows} {direction} results written to {writer.paths['results']}")
+                return {'by_year': by_year}
+            finally:
+                if store is not None:
+                    store.compact()
+                    store.close()
+        return compute
+
+    def export_stage(direction):
+        def export(inputs):
+            by_year = inputs[direction]['by_year']
+            paths = lcdi_output_paths(direction, window)
+            write_lcdi_json(lcdi_result_paths(direction)['results'], paths['by_papers'])
+            if by_year is not None:
+                with open(paths['by_year'], 'w') as outf:
+                    json.dump(by_year, outf)
+                print(f"{direction} LCDI by year written to {paths['by_year']}")
+            return paths
+        return export
+
+    lcdi_code = [
+        compute_group_lcdi, compute_group_lcdi_by_year, _compute_shard,
+        build_fos_proportions, compute_lcdi_batch, compute_windowed_lcdi, LcdiResultWriter
+    ]
+    stages = [
+        # venue/year resolution also reads the DBLP file
+        Stage('load', load, sources=[DATASET_PATH, DBLP_ALL_FILE], cache=False),
+        Stage('mag', load_mag, sources=[MAG_PATH], cache=False),
+        Stage('resolve_edges', resolve_edges, deps=['load'], cache=False),
+        Stage('fos_universe', fos_universe, deps=['load', 'resolve_edges'], code=[get_l1_fos_of_interest])
+    ]
+    for direction in DIRECTIONS:
+        stages.append(Stage(
+            direction, lcdi_stage(direction), deps=['load', 'mag', 'resolve_edges', 'fos_universe'],
+            params={'direction': direction, 'window': window}, code=lcdi_code,
+            outputs=list(lcdi_result_paths(direction).values()), concurrent=True
+        ))
+        stages.append(Stage(
+            f'export_{direction}', export_stage(direction), deps=[direction], params={'window': window},
+            code=[write_lcdi_json], outputs=list(lcdi_output_paths(direction, window).values())
+        ))
+    return Pipeline(stages, cache_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute per-paper LCDI of references and citations')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes per LCDI stage')
+    parser.add_argument(
+        '--stage-workers', type=int, default=1,
+        help='number of independent stages (e.g. refs and cits LCDI) to run at once'
+    )
+    parser.add_argument('--cache-dir', default=LCDI_STORE_DIR, help='where per-paper results are checkpointed')
+    parser.add_argument('--pipeline-dir', default=PIPELINE_DIR, help='where stage artifacts are stored')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='rerun every stage, recompute every paper and skip checkpointing'
+    )
+    parser.add_argument(
+        '--only', nargs='+', default=None,
+        help='run only these stages (and what they need): refs, cits or a stage name '
+             '(load, mag, resolve_edges, fos_universe, export_refs, export_cits)'
+    )
+    parser.add_argument(
+        '--profile', nargs='?', const=PROFILE_PATH, default=None,
+        help=f'record phase timers, counters and memory, and write them as JSON (default {PROFILE_PATH})'
+    )
+    parser.add_argument('--by-year', action='store_true', help='also compute the LCDI of each venue per year')
+    parser.add_argument(
+        '--window', type=int, default=None,
+        help='years per rolling window for --by-year (default 1; implies --by-year)'
+    )
+    args = parser.parse_args()
+    window = args.window if args.window is not None else (1 if args.by_year else None)
+    if window is not None and window < 1:
+        parser.error('--window must be at least 1')
+    if args.profile:
+        enable_profiling()
+
+    pipeline = build_pipeline(args.workers, window, None if args.no_cache else args.cache_dir, args.pipeline_dir)
+    if args.only:
+        targets = [ONLY_TARGETS.get(name, name) for name in args.only]
+        for name in targets:
+            if name not in pipeline.stages:
+                parser.error(f'unknown stage {name}; choose from {", ".join(list(ONLY_TARGETS) + pipeline.order)}')
+    else:
+        targets = [f'export_{direction}' for direction in DIRECTIONS]
+    pipeline.run(targets, args.stage_workers, force=pipeline.order if args.no_cache else ())
+
+    if args.profile:
+        with open(args.profile, 'w') as outf:
+            json.dump(profile_report(), outf, indent=2)
+        print(f'profile written to {args.profile}')
+
+    print('done.')
@@ -0,0 +1,187 @@
+"""
+Benchmark loading, lookups and LCDI on synthetic data (biblio.synthetic).
+
+Each benchmark runs in a fresh process with the synthetic data directory as
+working directory; reports wall time of the measured step, throughput and
+peak resident memory of the process.
+
+usage: python scripts/run_benchmarks.py [--scales 1 10 100] [--only name ...] [--json out.json]
+"""
+
+import os, sys
+import gc
+import json
+import time
+import argparse
+import multiprocessing
+from typing import Callable, Dict, List, Optional, Tuple
+
+from biblio.synthetic import generate_synthetic_data
+from biblio.load_dataset import load_dataset, load_dataset_store, DATASET_PATH
+from biblio.load_fos import MagLookup
+from biblio.dblp_index import get_dblp_index
+from biblio.constants import VENUES_TO_PLOT
+from biblio.utils.lcdi_utils import compute_lcdi_for_paper_refs_l1, compute_lcdi_for_papers_l1
+from biblio.utils.mem_utils import current_rss_mb, peak_rss_mb
+from biblio.utils.process_utils import run_in_process
+
+
+SYNTHETIC_ROOT = 'data/cache/synthetic'
+MAG_PATH = 'data/analysis/a11y_bibliometrics_mag_fos.jsonl.gz'
+
+# venue whose papers are used for the LCDI benchmarks
+LCDI_VENUE = 'conf/assets'
+
+
+def _setup_lcdi():
+    core, extended, lookup = load_dataset(DATASET_PATH)
+    mag_lookup = MagLookup(MAG_PATH)
+    papers = [p for p in lookup.get_papers_in_venue(LCDI_VENUE) if p]
+    fos_of_interest = set(
+        entry[0] for p in lookup.papers if p.fos for entry in p.fos if entry[-1] == 1
+    )
+    mag_lookup.precompute_sim(fos_of_interest)
+    lookup.graph
+    return papers, lookup, fos_of_interest, mag_lookup
+
+
+def _run_lcdi_per_paper(ctx) -> int:
+    papers, lookup, fos_of_interest, mag_lookup = ctx
+    for p in papers:
+        compute_lcdi_for_paper_refs_l1(p, lookup, fos_of_interest, mag_lookup)
+    return len(papers)
+
+
+def _run_lcdi_venue(ctx) -> int:
+    papers, lookup, fos_of_interest, mag_lookup = ctx
+    compute_lcdi_for_papers_l1(papers, lookup, fos_of_interest, mag_lookup, 'refs')
+    return len(papers)
+
+
+def _run_venue_queries(lookup) -> int:
+    for venue in VENUES_TO_PLOT:
+        lookup.get_papers_in_venue(venue)
+        lookup.get_papers_in_venue_by_year(venue)
+    return 2 * len(VENUES_TO_PLOT)
+
+
+def _run_triples(lookup) -> int:
+    num_triples = 0
+    for p in lookup.papers:
+        for triple in p.refs:
+            lookup.get_paper_by_triple(triple)
+        num_triples += len(p.refs)
+    return num_triples
+
+
+def _load_lookup():
+    return load_dataset(DATASET_PATH)[2]
+
+
+# name -> (setup, measured step returning the number of items processed)
+BENCHMARKS: Dict[str, Tuple[Callable, Callable]] = {
+    'load_dataset': (lambda: None, lambda _: len(load_dataset(DATASET_PATH)[2].papers)),
+    'load_dataset_store': (lambda: None, lambda _: len(load_dataset_store(DATASET_PATH)[2].papers)),
+    'mag_lookup_parse': (lambda: None, lambda _: len(MagLookup(MAG_PATH, cache_dir=None).ids)),
+    'mag_lookup_cached': (lambda: None, lambda _: len(MagLookup(MAG_PATH).ids)),
+    'venue_queries': (_load_lookup, _run_venue_queries),
+    'get_paper_by_triple': (_load_lookup, _run_triples),
+    'lcdi_per_paper': (_setup_lcdi, _run_lcdi_per_paper),
+    'lcdi_venue': (_setup_lcdi, _run_lcdi_venue),
+}
+
+
+def _measure(name: str, root: str, results):
+    os.chdir(root)
+    setup, step = BENCHMARKS[name]
+    # keep setup output (loader progress) out of the report
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            ctx = setup()
+            gc.collect()
+            rss_before = current_rss_mb()
+            start = time.time()
+            num_items = step(ctx)
+            elapsed = time.time() - start
+        finally:
+            sys.stdout = stdout
+    results.put({
+        'benchmark': name,
+        'items': num_items,
+        'seconds': elapsed,
+        'items_per_sec': num_items / max(elapsed, 1e-9),
+        'rss_before_mb': rss_before,
+        'peak_rss_mb': peak_rss_mb()
+    })
+
+
+def prepare_data(scale: float, root: str = SYNTHETIC_ROOT) -> str:
+    """
+    Generate synthetic data for a scale (if not already there) and build the
+    DBLP index and MAG cache, so that benchmarks measure warm loads
+    :param scale:
+    :param root:
+    :return: directory of the synthetic data
+    """
+    scale_root = os.path.abspath(os.path.join(root, f'scale-{scale:g}'))
+    if not os.path.exists(os.path.join(scale_root, DATASET_PATH)):
+        print(f'generating synthetic data at scale {scale:g}...')
+        generate_synthetic_data(scale_root, scale)
+    cwd = os.getcwd()
+    os.chdir(scale_root)
+    try:
+        get_dblp_index().build()
+        MagLookup(MAG_PATH)
+    finally:
+        os.chdir(cwd)
+    return scale_root
+
+
+def run_benchmarks(
+        scales: List[float],
+        names: List[str],
+        root: str = SYNTHETIC_ROOT,
+        timeout: Optional[float] = None
+) -> List[Dict]:
+    """
+    Run every benchmark at every scale, each in a fresh process
+    :param scales:
+    :param names:
+    :param root:
+    :param timeout: seconds allowed per benchmark (no limit if None)
+    :return: one result per (scale, benchmark); failed benchmarks have an 'error' entry instead of measurements
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for scale in scales:
+        scale_root = prepare_data(scale, root)
+        for name in names:
+            res, error = run_in_process(_measure, (name, scale_root), timeout, ctx)
+            if error is not None:
+                res = {'benchmark': name, 'error': error}
+            res['scale'] = scale
+            results.append(res)
+            if 'error' in res:
+                print(f"{scale:g}x\t{name:<20}\tFAILED ({res['error']})")
+            else:
+                print(f"{scale:g}x\t{name:<20}\t{res['items']}\t{res['seconds']:.3f}\t"
+                      f"{res['items_per_sec']:.0f}\t\t{res['peak_rss_mb']:.0f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark on synthetic data')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1], help='dataset scales, e.g. 1 10 100')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--root', default=SYNTHETIC_ROOT, help='where synthetic data is generated')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--timeout', type=float, help='seconds allowed per benchmark before it is reported as failed')
+    args = parser.parse_args()
+
+    print('SCALE\tBENCHMARK\t\t\tITEMS\tSECONDS\tITEMS/SEC\tPEAK_RSS_MB')
+    all_results = run_benchmarks(args.scales, args.only, args.root, args.timeout)
+    if args.json:
+        with open(args.json, 'w') as outf:
+            json.dump(all_results, outf, indent=2)